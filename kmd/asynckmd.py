@@ -0,0 +1,201 @@
+"""A base class for command interpreters running on asyncio.
+
+Requires Python 3.7 or later.
+"""
+
+import sys
+import asyncio
+import inspect
+import threading
+
+from functools import partial
+
+from kmd.kmd import Kmd
+from kmd.kmd import ScriptRun
+from kmd.kmd import string_types
+
+
+async def maybe_await(value):
+    """Await ``value`` if it is awaitable, else return it unchanged."""
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+async def run_in_thread(func, *args):
+    """Call ``func(*args)`` in a new daemon thread and await the result.
+
+    Unlike the event loop's default executor, a daemon thread blocked
+    reading input does not keep :func:`asyncio.run <py3k:asyncio.run>`
+    from returning after Ctrl-C.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def set_result(result):
+        if not future.done():
+            future.set_result(result)
+
+    def set_exception(exc):
+        if not future.done():
+            future.set_exception(exc)
+
+    def run():
+        try:
+            result = func(*args)
+        except BaseException as e:
+            callback = partial(set_exception, e)
+        else:
+            callback = partial(set_result, result)
+        try:
+            loop.call_soon_threadsafe(callback)
+        except RuntimeError:
+            # The event loop is closed
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+
+class AsyncKmd(Kmd):
+    """Interpreter base class for :mod:`asyncio <py3k:asyncio>` applications.
+
+    This is a subclass of :class:`~kmd.Kmd` where :meth:`~kmd.asynckmd.AsyncKmd.cmdloop`
+    and :meth:`~kmd.asynckmd.AsyncKmd.onecmd` are coroutines.
+    Changes include:
+
+    #. :meth:`do_*` methods may be coroutine functions. Plain methods
+       continue to work.
+    #. :meth:`~kmd.Kmd.precmd`, :meth:`~kmd.Kmd.postcmd`, :meth:`~kmd.Kmd.default`,
+       and :meth:`~kmd.Kmd.comment` may be coroutine functions as well.
+    #. Input is read in a daemon thread, so other tasks keep running
+       while the prompt is waiting for the user.
+    #. :meth:`~kmd.Kmd.preloop` and :meth:`~kmd.Kmd.postloop` are unchanged
+       and configure the history and readline completer as usual.
+
+    Example::
+
+        import asyncio
+        from kmd.asynckmd import AsyncKmd
+
+        class MyShell(AsyncKmd):
+            prompt = 'myshell> '
+
+            async def do_sleep(self, args):
+                await asyncio.sleep(float(args or 1))
+
+            def do_quit(self, args):
+                return True
+
+        MyShell().run()
+    """
+
+    async def cmdloop(self, intro=None):
+        """Repeatedly issue a prompt, accept input, parse an initial prefix
+        off the received input, and dispatch to action methods, passing them
+        the remainder of the line as argument.
+        """
+        self.preloop()
+        try:
+            if intro is not None:
+                self.intro = intro
+            if self.intro:
+                self.stdout.write(str(self.intro)+"\n")
+            stop = None
+            while not stop:
+                if self.cmdqueue:
+                    line = self.cmdqueue.pop(0)
+                else:
+                    line = await self.async_input(self.prompt)
+                line = await maybe_await(self.precmd(line))
+                stop = await self.onecmd(line)
+                stop = await maybe_await(self.postcmd(stop, line))
+        finally:
+            self.postloop()
+
+    async def async_input(self, prompt):
+        """Read a line without blocking the event loop.
+        Calls :meth:`~kmd.Kmd.input` or reads from :attr:`stdin` via
+        :func:`~kmd.asynckmd.run_in_thread` and returns ``'EOF'`` at end
+        of file.
+        """
+        if self.use_rawinput:
+            try:
+                return await run_in_thread(self.input, prompt)
+            except EOFError:
+                return 'EOF'
+        else:
+            self.stdout.write(prompt)
+            self.stdout.flush()
+            line = await run_in_thread(self.stdin.readline)
+            if not len(line):
+                return 'EOF'
+            return line.rstrip('\r\n')
+
+    async def onecmd(self, line):
+        """Interpret a command line.
+
+        Like :meth:`kmd.Kmd.onecmd` but awaits the result if the
+        dispatched method is a coroutine function.
+        """
+        return await maybe_await(super().onecmd(line))
+
+    async def emptyline(self):
+        """Called when the input line is empty.
+        By default repeats the :attr:`lastcmd <py3k:cmd.Cmd.lastcmd>`.
+        """
+        if self.lastcmd:
+            await self.onecmd(self.lastcmd)
+
+    async def runscript(self, script, stop_on_error=False):
+        """Execute the commands in ``script``.
+        Like :meth:`kmd.Kmd.runscript` but awaits each command.
+        """
+        if isinstance(script, string_types):
+            with open(script, 'rt') as f:
+                return await self.runscript(f, stop_on_error)
+
+        run = ScriptRun(self, stop_on_error)
+        with run:
+            for line in run.lines(script):
+                try:
+                    line = await maybe_await(self.precmd(line))
+                    stop = await self.onecmd(line)
+                    stop = await maybe_await(self.postcmd(stop, line))
+                except Exception:
+                    if run.error():
+                        break
+                    continue
+                if stop:
+                    break
+        return run.status
+
+    async def async_run(self, args=None, script=None, stop_on_error=False):
+        """Coroutine version of :meth:`~kmd.asynckmd.AsyncKmd.run`."""
+        if args is None:
+            args = sys.argv[1:]
+        try:
+            if script is not None:
+                return await self.runscript(script, stop_on_error)
+            elif args:
+                await self.onecmd(self.rejoin(args))
+            else:
+                await self.cmdloop()
+        except KeyboardInterrupt:
+            self.stdout.write('\n')
+            return 1
+        return 0
+
+    def run(self, args=None, script=None, stop_on_error=False):
+        """Run the AsyncKmd in a new event loop.
+
+        If ``args`` is None it defaults to ``sys.argv[1:]``.
+        If arguments are present they are executed via
+        :meth:`~kmd.asynckmd.AsyncKmd.onecmd`.
+        Without arguments, enters the :meth:`~kmd.asynckmd.AsyncKmd.cmdloop`.
+        If a ``script`` is given, it is executed via
+        :meth:`~kmd.asynckmd.AsyncKmd.runscript`.
+        Applications already running an event loop should await
+        :meth:`~kmd.asynckmd.AsyncKmd.async_run` instead.
+        """
+        return asyncio.run(self.async_run(args, script, stop_on_error))
@@ -0,0 +1,108 @@
+"""Completion in background threads.
+
+Only completion functions decorated with :func:`~kmd.background.threadsafe`
+run in background threads. Completion functions using readline, like
+:class:`~kmd.completions.FilenameCompletion`, must run on the main thread,
+because the readline state is process-global.
+"""
+
+import threading
+
+from collections import OrderedDict
+
+from rl import print_exc
+
+
+def threadsafe(func):
+    """Decorator marking a completion function as safe to run in a
+    background thread when a :attr:`~kmd.Kmd.completion_timeout` is set.
+    The function must not call readline or read the
+    :obj:`rl.completion <rl:rl.completion>` state.
+    May also be applied to completion classes that don't use readline,
+    like :class:`~kmd.completions.HostnameCompletion`.
+    """
+    func.threadsafe = True
+    return func
+
+
+class CompletionTask(object):
+    """Call a completion function on a worker thread, collecting the
+    matches as they are produced.
+    If a ``callback`` is given, it is called with the complete list of
+    matches when the completion function has finished successfully.
+    If the completion function raises an exception, it is printed and
+    stored in :attr:`error`.
+    """
+
+    def __init__(self, compfunc, args, callback=None):
+        self.matches = []
+        self.error = None
+        self.callback = callback
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(compfunc, args))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, compfunc, args):
+        try:
+            self.collect(compfunc, args)
+        except Exception as e:
+            # Already printed by collect
+            self.error = e
+        finally:
+            self.done.set()
+
+    @print_exc
+    def collect(self, compfunc, args):
+        for match in compfunc(*args):
+            self.matches.append(match)
+        if self.callback is not None:
+            self.callback(self.matches[:])
+
+    def wait(self, timeout=None):
+        """Wait up to ``timeout`` seconds for the task to finish and return
+        the matches produced so far.
+        """
+        self.done.wait(timeout)
+        return self.matches[:]
+
+
+class CompletionTasks(object):
+    """A bounded mapping of completion requests to running or finished
+    :class:`~kmd.background.CompletionTask` objects.
+    Repeating a request picks up the matches collected in the meantime.
+    """
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.tasks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def complete(self, timeout, compfunc, text, line, begidx, endidx, callback=None):
+        """Return the matches ``compfunc`` produces within ``timeout`` seconds.
+        If the deadline passes, the task keeps running and the next call
+        with the same arguments continues where this one left off.
+        A single match is only returned once the task has finished, as
+        readline would otherwise accept it as the unique completion.
+        """
+        key = (compfunc, text, line, begidx, endidx)
+        with self.lock:
+            task = self.tasks.pop(key, None)
+            if task is None:
+                task = CompletionTask(compfunc, key[1:], callback)
+            self.tasks[key] = task
+            while len(self.tasks) > self.maxsize:
+                self.tasks.popitem(last=False)
+        matches = task.wait(timeout)
+        if task.done.is_set():
+            with self.lock:
+                if self.tasks.get(key) is task:
+                    del self.tasks[key]
+        elif len(matches) == 1:
+            return []
+        return matches
+
+    def clear(self):
+        """Forget all tasks."""
+        with self.lock:
+            self.tasks.clear()
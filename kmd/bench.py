@@ -0,0 +1,531 @@
+"""Benchmarks for kmd.
+
+Usage: python -m kmd.bench <benchmark> [<options>] [<args>]
+
+Options:
+  --save <file>      Store the results as JSON baseline.
+  --compare <file>   Compare the results with a JSON baseline and fail
+                     if any of them regressed by more than --tolerance.
+  --tolerance <pct>  Allowed regression in percent (default: 25).
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import time
+import random
+import inspect
+import tempfile
+import subprocess
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+
+timer = getattr(time, 'perf_counter', time.time)
+
+#: Units of benchmark results. Rates are better when higher,
+#: durations when lower.
+RATE = '/s'
+SECONDS = 's'
+
+
+def make_shell_class(commands=300, **attrs):
+    """Return a Kmd subclass with ``commands`` generated commands."""
+    def do_command(self, args):
+        pass
+    for i in range(commands):
+        attrs['do_command%04d_run' % i] = do_command
+    return type('BenchKmd', (Kmd,), attrs)
+
+
+def measure(func, *args):
+    """Return the seconds it takes to call ``func(*args)``."""
+    start = timer()
+    func(*args)
+    return timer() - start
+
+
+def best_of(repeat, func, *args):
+    """Return the shortest of ``repeat`` measurements."""
+    return min(measure(func, *args) for i in range(repeat))
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values)//2]
+
+
+def run_lines(shell, lines):
+    onecmd = shell.onecmd
+    for line in lines:
+        onecmd(line)
+
+
+def bench_dispatch(number=100000, commands=300, repeat=1):
+    """Compare command dispatch via getattr with the dispatch table.
+    Returns a dict mapping scenario names to commands per second,
+    taking the best of ``repeat`` runs.
+    """
+    names = ['command%04d_run' % i for i in range(commands)]
+    scenarios = (
+        ('full', [names[i % commands] + ' arg' for i in range(number)]),
+        ('abbreviated', [names[i % commands][:-2] + ' arg' for i in range(number)]),
+        ('unknown', ['unknown%d arg' % (i % commands) for i in range(number)]),
+    )
+    shells = {}
+    for use_dispatch_table in (False, True):
+        cls = make_shell_class(commands, use_dispatch_table=use_dispatch_table)
+        shells[use_dispatch_table and 'table' or 'getattr'] = cls(stderr=StringIO())
+    results = {}
+    # Alternate between shells so that both see the same conditions
+    for i in range(repeat):
+        for kind, lines in scenarios:
+            for label, shell in sorted(shells.items()):
+                seconds = measure(run_lines, shell, lines)
+                key = 'dispatch/%s/%s' % (label, kind)
+                results[key] = max(results.get(key, 0), len(lines) / seconds)
+                shell.stderr.seek(0)
+                shell.stderr.truncate()
+    return results
+
+
+IMPORT_SCRIPT = """\
+import time
+timer = getattr(time, 'perf_counter', time.time)
+start = timer()
+import %s
+print(timer() - start)
+"""
+
+PROMPT_SCRIPT = """\
+import sys
+from kmd import Kmd
+shell = Kmd()
+shell.use_rawinput = False
+shell.prompt = '<ready>'
+shell.cmdloop()
+"""
+
+
+def time_import(module, repeat=5):
+    """Return the median time it takes to import ``module`` in a
+    fresh interpreter.
+    """
+    script = IMPORT_SCRIPT % module
+    values = []
+    for i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        values.append(float(output.decode('ascii').strip()))
+    return median(values)
+
+
+def time_first_prompt(repeat=5):
+    """Return the median time from starting a Kmd process to the
+    first prompt.
+    """
+    values = []
+    for i in range(repeat):
+        start = timer()
+        process = subprocess.Popen([sys.executable, '-c', PROMPT_SCRIPT],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        output = b''
+        while not output.endswith(b'<ready>'):
+            data = process.stdout.read(1)
+            if not data:
+                break
+            output += data
+        values.append(timer() - start)
+        process.kill()
+        process.wait()
+        process.stdin.close()
+        process.stdout.close()
+    return median(values)
+
+
+def time_preloop(entries, repeat=5):
+    """Return the time :meth:`~kmd.Kmd.preloop` takes to load a history
+    file with ``entries`` entries.
+    """
+    fd, filename = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'wt') as f:
+            for i in range(entries):
+                f.write('command%d with some arguments\n' % i)
+        shell = Kmd()
+        shell.history_file = entries and filename or ''
+        values = []
+        for i in range(repeat):
+            values.append(measure(shell.preloop))
+            shell.history_file = ''
+            shell.postloop()
+            shell.history_file = entries and filename or ''
+        return min(values)
+    finally:
+        os.remove(filename)
+
+
+def bench_startup(repeat=5, history_entries=100000):
+    """Measure import time, construction, preloop, and time to first prompt.
+    Returns a dict mapping scenario names to seconds.
+    """
+    return {
+        'startup/import kmd': time_import('kmd', repeat),
+        'startup/import kmd.completions': time_import('kmd.completions', repeat),
+        'startup/Kmd()': best_of(repeat, Kmd),
+        'startup/preloop': time_preloop(0, repeat),
+        'startup/preloop %d history entries' % history_entries: time_preloop(history_entries, repeat),
+        'startup/first prompt': time_first_prompt(repeat),
+    }
+
+
+def bench_history(entries=100000, repeat=5):
+    """Measure building a history index of ``entries`` lines and searching it.
+    Returns a dict mapping scenario names to seconds.
+    """
+    from kmd.histindex import HistoryIndex
+    tempdir = tempfile.mkdtemp()
+    try:
+        history_file = os.path.join(tempdir, 'history')
+        with open(history_file, 'wt') as f:
+            for i in range(entries):
+                f.write('git commit -m "change %d" src/module%d.py\n' % (i, i % 997))
+        index = HistoryIndex(os.path.join(tempdir, 'history.idx'))
+        results = {'history/index %d entries' % entries: measure(index.update, history_file)}
+        for name, query, prefix in (
+            ('substring', 'module42.py', False),
+            ('short', 'm', False),
+            ('prefix', 'git commit -m "change 99', True),
+            ('broad prefix', 'git', True),
+            ('no match', 'rebase', False),
+        ):
+            results['history/search %s' % name] = best_of(repeat, index.search, query, 20, prefix)
+        index.close()
+        return results
+    finally:
+        for name in os.listdir(tempdir):
+            os.remove(os.path.join(tempdir, name))
+        os.rmdir(tempdir)
+
+
+def time_session(address, repeat=5):
+    """Return the median time from connecting to a session server at
+    ``address`` to the first prompt.
+    """
+    from kmd.client import Client
+    values = []
+    for i in range(repeat):
+        start = timer()
+        client = Client(address, stdout=StringIO(), stderr=StringIO())
+        client.receive()
+        values.append(timer() - start)
+        client.send({'line': None})
+        client.receive()
+        client.close()
+    return median(values)
+
+
+def bench_sessions(repeat=20):
+    """Compare session start latency of a cold process, a pre-forked
+    worker, and an in-process session. Returns a dict mapping scenario
+    names to seconds.
+    """
+    from kmd.server import KmdServer
+    from kmd.prefork import ForkServer
+    tempdir = tempfile.mkdtemp()
+    try:
+        results = {'session/cold start': time_first_prompt(repeat)}
+        server = ForkServer(Kmd, os.path.join(tempdir, 'prefork.sock'), min_idle=2, max_idle=4)
+        server.start(0.01)
+        try:
+            while server.idle < server.min_idle:
+                time.sleep(0.01)
+            results['session/prefork'] = time_session(server.address, repeat)
+        finally:
+            server.shutdown()
+        server = KmdServer(Kmd, os.path.join(tempdir, 'server.sock'))
+        server.start(0.01)
+        try:
+            results['session/in-process'] = time_session(server.address, repeat)
+        finally:
+            server.shutdown()
+        return results
+    finally:
+        os.rmdir(tempdir)
+
+
+def quote_all(func, items, *args):
+    for item in items:
+        func(item, *args)
+
+
+def bench_quoting(matches=50000, repeat=5):
+    """Measure backslash quoting and dequoting of a long path and of
+    ``matches`` completion matches, with and without characters that
+    need quoting. Returns a dict mapping scenario names to seconds.
+    """
+    from kmd.quoting import backslash_quote
+    from kmd.quoting import backslash_dequote
+    from kmd.quoting import FILENAME_QUOTE_CHARACTERS
+    chars = FILENAME_QUOTE_CHARACTERS
+    path = '/'.join(['dir with spaces (%d) & $x' % i for i in range(400)])
+    plain_path = '/'.join(['directory_name-%d.d' % i for i in range(400)])
+    names = ['file name %d [x].txt' % i for i in range(matches)]
+    plain_names = ['file_name_%d.txt' % i for i in range(matches)]
+    quoted_path = backslash_quote(path, chars)
+    quoted_names = [backslash_quote(x, chars) for x in names]
+    return {
+        'quoting/quote long path': best_of(repeat, backslash_quote, path, chars),
+        'quoting/quote long plain path': best_of(repeat, backslash_quote, plain_path, chars),
+        'quoting/quote %d matches' % matches: best_of(repeat, quote_all, backslash_quote, names, chars),
+        'quoting/quote %d plain matches' % matches: best_of(repeat, quote_all, backslash_quote, plain_names, chars),
+        'quoting/dequote long path': best_of(repeat, backslash_dequote, quoted_path),
+        'quoting/dequote long plain path': best_of(repeat, backslash_dequote, plain_path),
+        'quoting/dequote %d matches' % matches: best_of(repeat, quote_all, backslash_dequote, quoted_names),
+        'quoting/dequote %d plain matches' % matches: best_of(repeat, quote_all, backslash_dequote, plain_names),
+    }
+
+
+#: Characters of random filenames: letters, every character Bash
+#: quotes in filenames, and both quote characters.
+FILENAME_ALPHABET = 'abcXYZ019._-' + '\\ \t\n"\'@><;|&=()#$`?*[!:{~}]^%,+'
+
+
+def random_filenames(count, seed=42, alphabet=FILENAME_ALPHABET):
+    """Return ``count`` random filenames of 1 to 24 characters.
+    The same ``seed`` always produces the same names.
+    """
+    r = random.Random(seed)
+    pool = ''.join(r.choice(alphabet) for i in range(65536))
+    names = []
+    for i in range(count):
+        start = r.randrange(65536-24)
+        names.append(pool[start:start + 1 + start % 24])
+    return names
+
+
+def dequote_all(items, dequote, quote_char, closed=True):
+    """Dequote ``quote_char``-quoted ``items``."""
+    end = closed and -1 or None
+    for item in items:
+        dequote(item[1:end], quote_char)
+
+
+def rejoin_all(shell, names, size=8):
+    """Rejoin ``names`` in groups of ``size`` and split them again."""
+    rejoin = shell.rejoin
+    splitargs = shell.splitargs
+    for i in range(0, len(names), size):
+        splitargs(rejoin(names[i:i+size]))
+
+
+def bench_roundtrip(names=1000000, repeat=1):
+    """Measure quoting, dequoting, and rejoining ``names`` random
+    filenames in every quote style. Filenames are quoted as partial
+    matches so the file system is not accessed.
+    Returns a dict mapping scenario names to filenames per second.
+    """
+    from kmd.quoting import quote_string
+    from kmd.quoting import quote_filename
+    from kmd.quoting import backslash_quote_string
+    from kmd.quoting import backslash_dequote_string
+    from kmd.testing import reset
+    reset()
+    # Configure the completer like preloop does
+    shell = Kmd()
+    shell.preloop()
+    try:
+        filenames = random_filenames(names)
+        double_quoted = [quote_string(x, True, '"') for x in filenames]
+        single_quoted = [quote_string(x, True, "'") for x in filenames]
+        backslash_quoted = [backslash_quote_string(x) for x in filenames]
+        seconds = {
+            'roundtrip/quote_string "': best_of(repeat, quote_all, quote_string, filenames, True, '"'),
+            "roundtrip/quote_string '": best_of(repeat, quote_all, quote_string, filenames, True, "'"),
+            'roundtrip/quote_filename "': best_of(repeat, quote_all, quote_filename, filenames, False, '"'),
+            "roundtrip/quote_filename '": best_of(repeat, quote_all, quote_filename, filenames, False, "'"),
+            'roundtrip/backslash_quote_string': best_of(repeat, quote_all, backslash_quote_string, filenames),
+            'roundtrip/dequote "': best_of(repeat, dequote_all, double_quoted, backslash_dequote_string, '"'),
+            "roundtrip/dequote '": best_of(repeat, dequote_all, single_quoted, backslash_dequote_string, "'"),
+            'roundtrip/dequote backslash': best_of(repeat, quote_all, backslash_dequote_string, backslash_quoted),
+            'roundtrip/rejoin and split': best_of(repeat, rejoin_all, shell, filenames),
+        }
+    finally:
+        shell.postloop()
+        reset()
+    return dict((name, names / value if value else 0.0) for name, value in seconds.items())
+
+
+def compare(results, baseline, unit, tolerance):
+    """Return the names of results that regressed by more than
+    ``tolerance`` percent compared to ``baseline``.
+    """
+    regressions = []
+    factor = 1.0 + tolerance / 100.0
+    for name, value in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if unit == RATE and value * factor < old:
+            regressions.append(name)
+        elif unit == SECONDS and value > old * factor:
+            regressions.append(name)
+    return sorted(regressions)
+
+
+def benchmark(func):
+    """Decorator for :class:`~kmd.bench.Bench` commands. The command is
+    called with the options dict and a list of integer arguments.
+    If the arguments are not numbers, the usage of the command is
+    written to stderr and the status is set to 2.
+    """
+    def dofunc(self, args):
+        try:
+            options, params = self.parse_options(args)
+            params = [int(x) for x in params]
+        except ValueError:
+            self.stderr.write(inspect.cleandoc(func.__doc__) + '\n')
+            self.status = 2
+            return
+        return func(self, options, params)
+
+    dofunc.__name__ = func.__name__
+    dofunc.__doc__ = func.__doc__
+    return dofunc
+
+
+class Bench(Kmd):
+    """Benchmark runner."""
+
+    prompt = '(bench) '
+
+    #: Exit status of the last benchmark, 1 if it found a regression,
+    #: 2 if its arguments were invalid.
+    status = 0
+
+    def parse_options(self, args):
+        """Split ``args`` into an options dict and a list of arguments.
+        Raises ValueError if the tolerance is not a number.
+        """
+        words = self.splitargs(args)
+        options = {'save': None, 'compare': None, 'tolerance': 25.0}
+        params = []
+        while words:
+            word = words.pop(0)
+            if word in ('--save', '--compare', '--tolerance') and words:
+                options[word[2:]] = words.pop(0)
+            else:
+                params.append(word)
+        options['tolerance'] = float(options['tolerance'])
+        return options, params
+
+    def report(self, results, unit, options):
+        """Print ``results`` and save or compare them as requested by
+        ``options``. Returns 1 if a regression was found, 0 otherwise.
+        """
+        width = max(len(x) for x in results)
+        for name in sorted(results):
+            if unit == RATE:
+                self.stdout.write('%-*s %12.0f/s\n' % (width, name, results[name]))
+            else:
+                self.stdout.write('%-*s %12.3f ms\n' % (width, name, results[name] * 1000))
+        status = 0
+        if options['compare']:
+            with open(options['compare'], 'rt') as f:
+                baseline = json.load(f)
+            regressions = compare(results, baseline['results'], unit, options['tolerance'])
+            for name in regressions:
+                self.stderr.write('*** Regression: %s %.6g -> %.6g\n' % (
+                    name, baseline['results'][name], results[name]))
+            if regressions:
+                status = 1
+        if options['save']:
+            with open(options['save'], 'wt') as f:
+                json.dump({'unit': unit, 'results': results}, f, indent=2, sort_keys=True)
+                f.write('\n')
+        return status
+
+    @benchmark
+    def do_dispatch(self, options, params):
+        """Usage: dispatch [<options>] [<number> [<commands>]]
+
+        Compare onecmd via getattr and via the dispatch table.
+        """
+        self.status = self.report(bench_dispatch(*params), RATE, options)
+
+    @benchmark
+    def do_startup(self, options, params):
+        """Usage: startup [<options>] [<repeat> [<history_entries>]]
+
+        Measure import time, Kmd() construction, preloop with and without
+        a large history file, and time to first prompt.
+        """
+        self.status = self.report(bench_startup(*params), SECONDS, options)
+
+    @benchmark
+    def do_history(self, options, params):
+        """Usage: history [<options>] [<entries> [<repeat>]]
+
+        Measure building and searching a history index.
+        """
+        self.status = self.report(bench_history(*params), SECONDS, options)
+
+    @benchmark
+    def do_sessions(self, options, params):
+        """Usage: sessions [<options>] [<repeat>]
+
+        Compare time to first prompt of a cold start, a pre-forked
+        worker, and an in-process server session.
+        """
+        self.status = self.report(bench_sessions(*params), SECONDS, options)
+
+    @benchmark
+    def do_quoting(self, options, params):
+        """Usage: quoting [<options>] [<matches> [<repeat>]]
+
+        Measure backslash quoting and dequoting of long paths and
+        large match lists.
+        """
+        self.status = self.report(bench_quoting(*params), SECONDS, options)
+
+    @benchmark
+    def do_roundtrip(self, options, params):
+        """Usage: roundtrip [<options>] [<names> [<repeat>]]
+
+        Measure quoting and dequoting throughput over a million
+        random filenames in every quote style.
+        """
+        self.status = self.report(bench_roundtrip(*params), RATE, options)
+
+    def do_quit(self, args):
+        """Usage: quit"""
+        return True
+
+    def do_EOF(self, args):
+        return True
+
+    def emptyline(self):
+        pass
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    shell = Bench()
+    if args:
+        try:
+            shell.onecmd(shell.rejoin(args))
+        except KeyboardInterrupt:
+            return 1
+        # Not the return value of onecmd, which is the stop flag
+        return shell.status
+    return shell.run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
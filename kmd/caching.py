@@ -0,0 +1,88 @@
+"""Completion caching."""
+
+import os
+import time
+import threading
+
+from collections import OrderedDict
+
+timer = getattr(time, 'monotonic', time.time)
+
+
+def cacheable(func):
+    """Decorator marking a completion function as cacheable.
+
+    The matches of a cacheable completion function must start with
+    the ``text`` being completed, and the matches for a longer text must
+    be a subset of the matches for a shorter text, so that cached
+    results can be narrowed when the user types more characters.
+    """
+    func.cacheable = True
+    return func
+
+
+def uncacheable(func):
+    """Decorator marking a completion function as not cacheable, even if
+    :attr:`~kmd.Kmd.cache_completions` is True.
+    """
+    func.cacheable = False
+    return func
+
+
+def is_new_component(text):
+    """Return True if ``text`` contains a pathname separator."""
+    return '/' in text or os.sep in text
+
+
+class CompletionCache(object):
+    """A least-recently-used cache of completion results.
+
+    Entries expire after ``ttl`` seconds. A lookup for ``text`` is
+    answered from an entry stored for a prefix of ``text`` by filtering
+    the cached matches, if the matches for longer texts are known to be
+    a subset of the cached matches.
+    """
+
+    def __init__(self, maxsize=128, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, text, subset=False):
+        """Return the cached matches for ``text``, or None.
+        If ``subset`` is False, cached matches are only narrowed while
+        ``text`` stays in the same pathname component, since completing
+        a directory name lists the contents of the directory.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            cached_text, matches, stamp = entry
+            if timer() - stamp > self.ttl:
+                return None
+            self.entries[key] = entry
+        if not text.startswith(cached_text):
+            return None
+        if text == cached_text:
+            return matches[:]
+        if not subset and is_new_component(text[len(cached_text):]):
+            return None
+        return [x for x in matches if x.startswith(text)]
+
+    def put(self, key, text, matches):
+        """Store the ``matches`` for ``text``."""
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (text, list(matches), timer())
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries."""
+        with self.lock:
+            self.entries.clear()
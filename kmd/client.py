@@ -0,0 +1,191 @@
+"""A thin client for :mod:`kmd.server`.
+
+Usage: python -m kmd.client <socket-path> | <host>:<port>
+
+Lines are edited locally with readline; commands are executed and
+completions computed by the server.
+"""
+
+from __future__ import absolute_import
+
+import sys
+import socket
+
+from rl import completer
+from rl import completion
+from rl import print_exc
+
+from kmd.quoting import QUOTE_CHARACTERS
+from kmd.quoting import WORD_BREAK_CHARACTERS
+from kmd.quoting import FILENAME_QUOTE_CHARACTERS
+from kmd.quoting import char_is_quoted
+from kmd.quoting import backslash_quote_filename
+from kmd.quoting import backslash_dequote_filename
+from kmd.quoting import tokenize
+from kmd.server import send
+from kmd.server import receive
+from kmd.server import parse_address
+from kmd.server import COMPLETION_STATE
+
+
+class Client(object):
+    """Connect to a :class:`~kmd.server.KmdServer` at ``address``, a socket
+    path or a (host, port) tuple.
+    """
+
+    def __init__(self, address, stdout=None, stderr=None):
+        if isinstance(address, tuple):
+            self.socket = socket.create_connection(address)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        self.rfile = self.socket.makefile('rb')
+        self.wfile = self.socket.makefile('wb')
+        self.stdout = stdout or sys.stdout
+        self.stderr = stderr or sys.stderr
+        self.config = {'quote_characters': QUOTE_CHARACTERS, 'shell_escape_chars': ''}
+
+    def close(self):
+        """Close the connection."""
+        self.rfile.close()
+        self.wfile.close()
+        self.socket.close()
+
+    def send(self, message):
+        send(self.wfile, message)
+
+    def receive(self):
+        """Return the next message that is not output, writing output
+        messages to stdout and stderr as they arrive.
+        """
+        while True:
+            message = receive(self.rfile)
+            if message is None:
+                return {'exit': True}
+            if 'stdout' in message:
+                self.stdout.write(message['stdout'])
+                self.stdout.flush()
+            elif 'stderr' in message:
+                self.stderr.write(message['stderr'])
+                self.stderr.flush()
+            elif 'error' in message:
+                self.stderr.write('*** %s\n' % (message['error'],))
+                self.stderr.flush()
+            elif 'completer' in message:
+                self.config.update(message['completer'])
+            else:
+                return message
+
+    def complete(self, text, state):
+        """complete(text, state)
+        Return the next possible completion for ``text``, as computed by the server.
+        """
+        if state == 0:
+            readline_state = dict((name, getattr(completion, name)) for name in COMPLETION_STATE)
+            self.send({'complete': [text, completion.line_buffer,
+                                    completion.begidx, completion.endidx, readline_state]})
+            message = self.receive()
+            self.matches = message.get('matches', [])
+            if message.get('filenames'):
+                # Let readline quote the matches and append slashes
+                completion.filename_completion_desired = True
+                completion.filename_quoting_desired = True
+        try:
+            return self.matches[state]
+        except IndexError:
+            return None
+
+    @print_exc
+    def word_break_hook(self, begidx, endidx):
+        """word_break_hook(begidx, endidx)
+        When completing ``?<topic>`` make sure ``?`` is a word break character.
+        Ditto for ``!<command>`` if the server's shell has a ``do_shell`` command.
+        Works like :meth:`kmd.Kmd.word_break_hook`.
+        """
+        line = completion.line_buffer
+        words = tokenize(line)
+        if words and begidx == words[0].start:
+            c = line[begidx]
+            if c == '?' or c in self.config['shell_escape_chars']:
+                if c not in completer.word_break_characters:
+                    return c + completer.word_break_characters
+
+    @print_exc
+    def quote_filename(self, text, single_match, quote_char):
+        """quote_filename(text, single_match, quote_char)
+        Return a quoted version of ``text``.
+        """
+        return backslash_quote_filename(text, single_match, quote_char)
+
+    @print_exc
+    def dequote_filename(self, text, quote_char):
+        """dequote_filename(text, quote_char)
+        Return a dequoted version of ``text``.
+        """
+        return backslash_dequote_filename(text, quote_char)
+
+    def configure(self):
+        """Configure the readline completer like a local
+        :class:`~kmd.Kmd` with filename completion.
+        """
+        completer.quote_characters = self.config['quote_characters']
+        completer.word_break_characters = WORD_BREAK_CHARACTERS
+        completer.special_prefixes = ''
+        completer.filename_quote_characters = FILENAME_QUOTE_CHARACTERS
+        completer.char_is_quoted_function = char_is_quoted
+        completer.filename_quoting_function = self.quote_filename
+        completer.filename_dequoting_function = self.dequote_filename
+        completer.word_break_hook = self.word_break_hook
+        completer.completer = self.complete
+        completer.parse_and_bind('TAB: complete')
+
+    def input(self, prompt):
+        """Read a line with readline. Returns None at end of file."""
+        try:
+            if sys.version_info[0] >= 3:
+                return input(prompt)
+            else:
+                return raw_input(prompt)
+        except EOFError:
+            self.stdout.write('\n')
+            return None
+
+    def run(self):
+        """Interact with the server until the session ends."""
+        try:
+            configured = False
+            while True:
+                message = self.receive()
+                if 'exit' in message:
+                    return 0
+                if not configured:
+                    # The completer configuration arrives first
+                    self.configure()
+                    configured = True
+                if 'prompt' in message:
+                    line = self.input(message['prompt'])
+                else:
+                    line = self.input('')
+                self.send({'line': line})
+        finally:
+            completer.completer = None
+            completer.word_break_hook = None
+            completer.filename_quoting_function = None
+            completer.filename_dequoting_function = None
+            self.close()
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) != 1:
+        sys.stderr.write(__doc__.split('\n\n')[1] + '\n')
+        return 2
+    try:
+        return Client(parse_address(args[0])).run()
+    except KeyboardInterrupt:
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Command queue."""
+
+from collections import deque
+
+
+class CommandQueue(object):
+    """A queue of command lines with the interface of a list.
+
+    Lines are held in a deque, so that ``pop(0)`` is O(1).
+    In addition to the lines it holds, the queue may be fed from
+    iterables which are consumed lazily, one line at a time, whenever
+    the queue runs empty. Lines pending in feeds are not counted by
+    :func:`len` or included in iteration until they are read; truth
+    testing and :func:`len` read one line ahead if the queue is empty,
+    so that ``bool(queue) == (len(queue) > 0)`` always holds.
+    Indexing reads as many lines as needed; negative indexes and
+    slices count from the end of the feeds, so they read all of them.
+    """
+
+    def __init__(self, iterable=()):
+        self.lines = deque(iterable)
+        self.feeds = deque()
+
+    def append(self, line):
+        """Append ``line`` to the queue."""
+        self.lines.append(line)
+
+    def extend(self, iterable):
+        """Append the lines of ``iterable`` to the queue."""
+        self.lines.extend(iterable)
+
+    def insert(self, index, line):
+        """Insert ``line`` before ``index``.
+        ``insert(0, line)`` is O(1).
+        """
+        lines = self.lines
+        if index < 0:
+            index = max(0, len(lines) + index)
+        if index == 0:
+            lines.appendleft(line)
+        elif index >= len(lines):
+            lines.append(line)
+        else:
+            lines.rotate(-index)
+            lines.appendleft(line)
+            lines.rotate(index)
+
+    def pop(self, index=-1):
+        """Remove and return the line at ``index`` (default last).
+        ``pop(0)`` is O(1).
+        """
+        self.fill_to(index)
+        lines = self.lines
+        if index == 0:
+            return lines.popleft()
+        if index == -1:
+            return lines.pop()
+        line = lines[index]
+        del lines[index]
+        return line
+
+    def remove(self, line):
+        """Remove the first occurrence of ``line``."""
+        self.lines.remove(line)
+
+    def index(self, line):
+        """Return the index of the first occurrence of ``line``."""
+        for i, x in enumerate(self.lines):
+            if x == line:
+                return i
+        raise ValueError('%r is not in queue' % (line,))
+
+    def count(self, line):
+        """Return the number of occurrences of ``line``."""
+        return sum(1 for x in self.lines if x == line)
+
+    def clear(self):
+        """Remove all lines and feeds."""
+        self.lines.clear()
+        self.feeds.clear()
+
+    def feed(self, iterable):
+        """Append the lines of ``iterable`` to the queue without reading them.
+        Trailing newlines are stripped as lines are consumed.
+        """
+        self.feeds.append(iter(iterable))
+
+    def fill(self):
+        """Move the next line from the feeds into the queue.
+        Returns False if all feeds are exhausted.
+        """
+        while self.feeds:
+            try:
+                line = next(self.feeds[0])
+            except StopIteration:
+                self.feeds.popleft()
+            else:
+                self.lines.append(line.rstrip('\r\n'))
+                return True
+        return False
+
+    def fill_to(self, index):
+        """Move lines from the feeds into the queue until it holds the
+        line at ``index``. Negative indexes and slices read all feeds.
+        """
+        if not self.feeds:
+            return
+        if isinstance(index, slice) or index < 0:
+            lines = self.lines
+            for feed in self.feeds:
+                lines.extend(line.rstrip('\r\n') for line in feed)
+            self.feeds.clear()
+        else:
+            while len(self.lines) <= index and self.fill():
+                pass
+
+    def __len__(self):
+        if not self.lines:
+            self.fill()
+        return len(self.lines)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __contains__(self, line):
+        return line in self.lines
+
+    def __getitem__(self, index):
+        self.fill_to(index)
+        if isinstance(index, slice):
+            return list(self.lines)[index]
+        return self.lines[index]
+
+    def __setitem__(self, index, value):
+        self.fill_to(index)
+        if isinstance(index, slice):
+            lines = list(self.lines)
+            lines[index] = value
+            self.lines = deque(lines)
+        else:
+            self.lines[index] = value
+
+    def __delitem__(self, index):
+        self.fill_to(index)
+        if isinstance(index, slice):
+            lines = list(self.lines)
+            del lines[index]
+            self.lines = deque(lines)
+        else:
+            del self.lines[index]
+
+    def __eq__(self, other):
+        if isinstance(other, CommandQueue):
+            other = other.lines
+        elif not isinstance(other, (list, deque)):
+            return NotImplemented
+        return list(self.lines) == list(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'CommandQueue(%r)' % (list(self.lines),)
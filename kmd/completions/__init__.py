@@ -18,8 +18,36 @@ A *custom completion* is a class that implements at least two methods:
 
 from __future__ import absolute_import
 
-from .filename import FilenameCompletion
-from .username import UsernameCompletion
-from .hostname import HostnameCompletion
-from .environment import EnvironmentCompletion
-from .command import CommandCompletion
+import sys
+
+#: Maps completion class names to their submodules.
+SUBMODULES = {
+    'FilenameCompletion': 'filename',
+    'UsernameCompletion': 'username',
+    'HostnameCompletion': 'hostname',
+    'EnvironmentCompletion': 'environment',
+    'CommandCompletion': 'command',
+}
+
+__all__ = sorted(SUBMODULES)
+
+if sys.version_info >= (3, 7):
+    from importlib import import_module
+
+    def __getattr__(name):
+        # Import submodules on first access (PEP 562)
+        if name in SUBMODULES:
+            module = import_module('.' + SUBMODULES[name], __name__)
+            value = getattr(module, name)
+            globals()[name] = value
+            return value
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+    def __dir__():
+        return sorted(set(globals()) | set(SUBMODULES))
+else:
+    from .filename import FilenameCompletion
+    from .username import UsernameCompletion
+    from .hostname import HostnameCompletion
+    from .environment import EnvironmentCompletion
+    from .command import CommandCompletion
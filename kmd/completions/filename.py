@@ -13,11 +13,15 @@ from rl import print_exc
 from kmd.quoting import QUOTE_CHARACTERS
 from kmd.quoting import WORD_BREAK_CHARACTERS
 from kmd.quoting import FILENAME_QUOTE_CHARACTERS
+from kmd.quoting import SCANDIR_THRESHOLD
 
 from kmd.quoting import char_is_quoted
 from kmd.quoting import quote_filename
+from kmd.quoting import quote_filenames
 from kmd.quoting import backslash_quote_filename
+from kmd.quoting import backslash_quote_filenames
 from kmd.quoting import backslash_dequote_filename
+from kmd.quoting import find_directories
 
 
 def compose(text):
@@ -36,6 +40,13 @@ class FilenameCompletion(object):
 
     To ensure proper configuration of readline, :class:`~FilenameCompletion`
     should always be instantiated before other completions.
+
+    When readline quotes many matches, for example when inserting all
+    completions, directories are found by listing each parent directory
+    once instead of calling ``stat`` on every match.
+
+    Uses readline, so completion functions using it must not be marked
+    :func:`~kmd.background.threadsafe`.
     """
 
     def __init__(self, quote_char='\\'):
@@ -54,6 +65,10 @@ class FilenameCompletion(object):
         completer.filename_rewrite_hook = self.rewrite_filename
         completer.filename_stat_hook = self.stat_filename
 
+        self.matches = []
+        self.match_set = None
+        self.directories = None
+
         self.backslash_quoting = False
         if quote_char == '\\':
             self.backslash_quoting = True
@@ -71,8 +86,27 @@ class FilenameCompletion(object):
             matches = completion.complete_username(text)
         if not matches:
             matches = completion.complete_filename(text)
+        self.matches = matches
+        self.match_set = None
+        self.directories = None
         return matches
 
+    def known_directories(self, text):
+        """Return the set of directories among the matches of the last
+        call, or None if ``text`` is not one of them or there are too
+        few matches to benefit from listing directories.
+        """
+        if len(self.matches) < SCANDIR_THRESHOLD:
+            return None
+        if self.match_set is None:
+            expanduser = os.path.expanduser
+            found = find_directories([expanduser(x) for x in self.matches])
+            self.match_set = set(self.matches)
+            self.directories = set(x for x in self.matches if expanduser(x) in found)
+        if text not in self.match_set:
+            return None
+        return self.directories
+
     @print_exc
     def char_is_quoted(self, text, index):
         """char_is_quoted(text, index)
@@ -87,10 +121,30 @@ class FilenameCompletion(object):
         Return a quoted version of ``text``. Installed as
         :attr:`rl.completer.filename_quoting_function <rl:rl.Completer.filename_quoting_function>`.
         """
+        directories = None
+        if single_match:
+            directories = self.known_directories(text)
+        if directories is None:
+            if self.backslash_quoting:
+                return backslash_quote_filename(text, single_match, quote_char)
+            else:
+                return quote_filename(text, single_match, quote_char)
+        # Don't append closing quotes to directory names
+        if text in directories and (quote_char or not self.backslash_quoting):
+            completion.suppress_quote = True
+        return self.quote_filenames([text], single_match, quote_char, directories)[0]
+
+    def quote_filenames(self, matches, single_match, quote_char, directories=None):
+        """Return a list of quoted versions of ``matches``.
+        Like :meth:`quote_filename` applied to each match, but
+        checks for directories once per parent directory. If
+        ``directories`` is given, it is the set of matches known to be
+        directories.
+        """
         if self.backslash_quoting:
-            return backslash_quote_filename(text, single_match, quote_char)
+            return backslash_quote_filenames(matches, single_match, quote_char, directories)
         else:
-            return quote_filename(text, single_match, quote_char)
+            return quote_filenames(matches, single_match, quote_char, directories)
 
     @print_exc
     def dequote_filename(self, text, quote_char):
@@ -4,9 +4,15 @@ import os
 
 from rl import completer
 
+from kmd.background import threadsafe
 
+
+@threadsafe
 class HostnameCompletion(object):
-    """Complete host names found in the system's hosts file."""
+    """Complete host names found in the system's hosts file.
+    Does not use readline when called, so completion functions
+    using it may be marked :func:`~kmd.background.threadsafe`.
+    """
 
     def __init__(self, hostsfile='/etc/hosts'):
         """Configure the readline completer.
@@ -4,7 +4,10 @@ from rl import completion
 
 
 class UsernameCompletion(object):
-    """Complete user names."""
+    """Complete user names.
+    Uses readline, so completion functions using it must not be marked
+    :func:`~kmd.background.threadsafe`.
+    """
 
     def __init__(self):
         """Configure the readline completer."""
@@ -0,0 +1,713 @@
+"""Incremental history files.
+
+A history backend replaces the default handling of :attr:`~kmd.Kmd.history_file`,
+which reads the complete file in :meth:`~kmd.Kmd.preloop` and writes it
+in :meth:`~kmd.Kmd.postloop`. Backends are enabled by setting
+:attr:`~kmd.Kmd.history_class`::
+
+    import kmd
+    from kmd.histfile import AppendOnlyHistory
+
+    class MyShell(kmd.Kmd):
+        history_file = '~/.myshell_history'
+        history_class = AppendOnlyHistory
+
+A backend is instantiated with the history file name and must implement
+:meth:`load`, :meth:`append`, :meth:`refresh`, and :meth:`close`.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import mmap
+import errno
+import time
+import struct
+import bisect
+import shutil
+import hashlib
+import threading
+
+from array import array
+
+if sys.version_info[0] >= 3:
+    from queue import Queue, Empty
+else:
+    from Queue import Queue, Empty
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from rl import history
+
+timer = getattr(time, 'monotonic', time.time)
+replace = getattr(os, 'replace', os.rename)
+
+try:
+    OFFSET_TYPE = array('Q').typecode
+except ValueError:
+    OFFSET_TYPE = 'L'
+
+
+def decode(line):
+    if sys.version_info[0] >= 3:
+        return line.decode('utf-8', 'surrogateescape')
+    return line
+
+
+def encode(line):
+    if sys.version_info[0] >= 3:
+        return line.encode('utf-8', 'surrogateescape')
+    return line
+
+
+def read_lines(f, end, count, blocksize=65536):
+    """Read up to ``count`` lines preceding byte offset ``end`` of binary
+    file ``f``, which must be at a line boundary.
+    Returns the offset of the first line read and the list of lines.
+    Timestamp lines written by readline are skipped.
+    """
+    pos = end
+    data = b''
+    while pos > 0 and data.count(b'\n') <= count:
+        size = min(blocksize, pos)
+        pos -= size
+        f.seek(pos)
+        data = f.read(size) + data
+    lines = data.split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    if len(lines) > count:
+        lines = lines[len(lines)-count:]
+    size = len(b'\n'.join(lines))
+    if lines and data.endswith(b'\n'):
+        size += 1
+    offset = end - size
+    return offset, [decode(x) for x in lines if not is_timestamp(x)]
+
+
+def is_timestamp(line):
+    return line[:1] == b'#' and line[1:].isdigit()
+
+
+def prepend_history(lines):
+    """Insert ``lines`` at the beginning of the readline history."""
+    if lines:
+        current = list(history)
+        history.clear()
+        for line in lines + current:
+            history.append(line)
+
+
+class AppendOnlyHistory(object):
+    """History file appended to as lines are entered.
+
+    Only the last :attr:`max_load` entries are loaded at startup.
+    Lines are written by a background thread and synced to disk at most
+    every :attr:`sync_interval` seconds, so a crash loses no more than
+    the lines entered in that interval.
+    When the file has grown to :attr:`truncate_ratio` times
+    :attr:`max_entries` lines, :meth:`load` truncates it to the last
+    :attr:`max_entries` lines.
+    """
+
+    #: Number of entries loaded by :meth:`load`.
+    max_load = 1000
+
+    #: Maximum number of seconds written lines stay unsynced.
+    sync_interval = 1.0
+
+    #: Maximum number of lines kept in the file. If None,
+    #: :attr:`rl:rl.History.max_entries` is used; -1 means unlimited.
+    max_entries = None
+
+    #: Growth factor that triggers a truncation.
+    truncate_ratio = 2.0
+
+    def __init__(self, filename, max_load=None, sync_interval=None, max_entries=None):
+        self.filename = os.path.expanduser(filename)
+        if max_load is not None:
+            self.max_load = max_load
+        if sync_interval is not None:
+            self.sync_interval = sync_interval
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self.offset = 0
+        self.error = None
+        self.queue = Queue()
+        self.thread = None
+
+    def load(self):
+        """Add the last :attr:`max_load` entries of the file to the
+        readline history. Truncates the file if it has grown too large.
+        """
+        self.truncate()
+        try:
+            with open(self.filename, 'rb') as f:
+                f.seek(0, 2)
+                self.offset, lines = read_lines(f, f.tell(), self.max_load)
+        except (IOError, OSError):
+            return
+        for line in lines:
+            history.append(line)
+
+    def truncate(self):
+        """Rewrite the file with its last :attr:`max_entries` lines if it
+        has grown to :attr:`truncate_ratio` times that size.
+        The file is replaced by renaming, so a crash leaves either the
+        old or the new file. Returns True if the file was truncated.
+        """
+        max_entries = self.max_entries
+        if max_entries is None:
+            max_entries = history.max_entries
+        if max_entries <= 0:
+            return False
+        tmpname = self.filename + '.%d' % os.getpid()
+        try:
+            with open(self.filename, 'rb') as f:
+                lock(f, exclusive=True)
+                try:
+                    f.seek(0, 2)
+                    end = f.tell()
+                    offset, lines = read_lines(f, end, int(max_entries * self.truncate_ratio))
+                    if offset == 0:
+                        return False
+                    offset, lines = read_lines(f, end, max_entries)
+                    f.seek(offset)
+                    data = f.read(end - offset)
+                    with open(tmpname, 'wb') as tmp:
+                        tmp.write(data)
+                        tmp.flush()
+                        os.fsync(tmp.fileno())
+                    replace(tmpname, self.filename)
+                finally:
+                    unlock(f)
+        except (IOError, OSError) as e:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            if e.errno != errno.ENOENT:
+                self.error = e
+            return False
+        return True
+
+    def read_older(self, count):
+        """Return up to ``count`` entries preceding the ones read so far,
+        oldest first.
+        """
+        if self.offset <= 0:
+            return []
+        with open(self.filename, 'rb') as f:
+            self.offset, lines = read_lines(f, self.offset, count)
+        return lines
+
+    def load_more(self, count):
+        """Insert up to ``count`` older entries at the beginning of the
+        readline history. Returns the number of entries inserted.
+        """
+        lines = self.read_older(count)
+        prepend_history(lines)
+        return len(lines)
+
+    def append(self, line):
+        """Queue ``line`` for writing."""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put(line)
+
+    def refresh(self):
+        """Called before each prompt. Does nothing."""
+
+    def flush(self, raise_exc=False):
+        """Wait until all queued lines are written and synced.
+        If ``raise_exc`` is True, a write error is allowed to propagate.
+        """
+        if self.thread is not None:
+            event = threading.Event()
+            self.queue.put(event)
+            event.wait()
+        self.check_error(raise_exc)
+
+    def close(self, raise_exc=False):
+        """Write and sync all queued lines and stop the writer thread.
+        If ``raise_exc`` is True, a write error is allowed to propagate.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.check_error(raise_exc)
+
+    def check_error(self, raise_exc):
+        if raise_exc and self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def run(self):
+        f = None
+        unsynced = False
+        last_sync = timer()
+        while True:
+            timeout = None
+            if unsynced:
+                timeout = max(0, last_sync + self.sync_interval - timer())
+            try:
+                items = [self.queue.get(True, timeout)]
+            except Empty:
+                items = []
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            stop = None in items
+            events = [x for x in items if isinstance(x, threading.Event)]
+            lines = [x for x in items if x is not None and x not in events]
+            try:
+                if lines:
+                    if f is None:
+                        f = open(self.filename, 'ab')
+                    f = self.write(f, b''.join(encode(x) + b'\n' for x in lines))
+                    unsynced = True
+                if unsynced and (stop or events or not items or
+                                 timer() - last_sync >= self.sync_interval):
+                    os.fsync(f.fileno())
+                    unsynced = False
+                    last_sync = timer()
+            except (IOError, OSError) as e:
+                self.error = e
+                unsynced = False
+            for event in events:
+                event.set()
+            if stop:
+                if f is not None:
+                    f.close()
+                return
+
+    def write(self, f, data):
+        f.write(data)
+        f.flush()
+        return f
+
+
+def is_replaced(f, filename):
+    """Return True if ``filename`` no longer refers to the open file ``f``."""
+    try:
+        return os.stat(filename).st_ino != os.fstat(f.fileno()).st_ino
+    except (IOError, OSError):
+        return True
+
+
+def lock(f, exclusive=False):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH)
+
+
+def unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class SharedHistory(AppendOnlyHistory):
+    """History file shared by concurrent sessions.
+
+    Lines are appended under an exclusive advisory lock. Before each
+    prompt, :meth:`refresh` reads the lines other sessions have appended
+    since the last read and adds them to the readline history.
+    """
+
+    def __init__(self, filename, max_load=None, sync_interval=None, max_entries=None):
+        super(SharedHistory, self).__init__(filename, max_load, sync_interval, max_entries)
+        self.position = 0
+        self.inode = None
+        self.written = []
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Add the last :attr:`max_load` entries of the file to the
+        readline history.
+        """
+        with self.lock:
+            try:
+                with open(self.filename, 'rb') as f:
+                    lock(f)
+                    try:
+                        f.seek(0, 2)
+                        self.position = f.tell()
+                        self.inode = os.fstat(f.fileno()).st_ino
+                        self.offset, lines = read_lines(f, self.position, self.max_load)
+                    finally:
+                        unlock(f)
+            except (IOError, OSError):
+                return
+        for line in lines:
+            history.append(line)
+
+    def refresh(self):
+        """Add the lines appended by other sessions to the readline history."""
+        with self.lock:
+            try:
+                with open(self.filename, 'rb') as f:
+                    st = os.fstat(f.fileno())
+                    size = st.st_size
+                    if size < self.position or st.st_ino != self.inode:
+                        # The file was truncated or replaced; start over at the end
+                        self.position = size
+                        self.inode = st.st_ino
+                        self.written = []
+                    if size == self.position:
+                        return
+                    lock(f)
+                    try:
+                        f.seek(self.position)
+                        data = f.read()
+                    finally:
+                        unlock(f)
+            except (IOError, OSError):
+                return
+            # Leave an incomplete last line for the next refresh
+            end = self.position + data.rfind(b'\n') + 1
+            lines = []
+            pos = self.position
+            for start, stop in self.written:
+                if stop > end:
+                    break
+                lines.extend(data[pos-self.position:start-self.position].split(b'\n')[:-1])
+                pos = stop
+            lines.extend(data[pos-self.position:end-self.position].split(b'\n')[:-1])
+            self.written = [x for x in self.written if x[1] > end]
+            self.position = end
+        for line in lines:
+            if not is_timestamp(line):
+                history.append(decode(line))
+
+    def write(self, f, data):
+        with self.lock:
+            while True:
+                lock(f, exclusive=True)
+                # Another session may have truncated the file
+                if not is_replaced(f, self.filename):
+                    break
+                unlock(f)
+                f.close()
+                f = open(self.filename, 'ab')
+            try:
+                f.write(data)
+                f.flush()
+                stop = os.fstat(f.fileno()).st_size
+            finally:
+                unlock(f)
+            # Remember our own lines, which are already in the readline history
+            if os.fstat(f.fileno()).st_ino == self.inode:
+                self.written.append((stop - len(data), stop))
+        return f
+
+
+MAGIC = b'KMDHIST1'
+HEADER = struct.Struct('<8sQ')
+RECORD = struct.Struct('<I')
+INDEX = struct.Struct('<QQ')
+
+
+class BinaryHistory(object):
+    """History stored as a binary log of length-prefixed entries.
+
+    The file is memory-mapped and entries are located through an
+    array of offsets, so the history takes 8 bytes of memory per entry
+    plus the :attr:`max_load` entries pushed into readline. The offsets
+    are saved to a ``.offsets`` file on close, so that startup only has
+    to scan the entries appended since.
+    A plain-text history file is converted to a log when opened; the
+    original is kept with a ``.txt`` extension.
+    Entries are appended as they are entered. When the log has grown to
+    :attr:`compact_ratio` times its size after the last compaction,
+    a background thread rewrites it without duplicates, keeping the
+    most recent occurrence of each entry.
+
+    Entries can be accessed like elements of a list.
+    Errors in the background compaction and on close are stored in
+    :attr:`error`.
+    """
+
+    #: Number of entries loaded by :meth:`load`.
+    max_load = 1000
+
+    #: Growth factor that triggers a compaction.
+    compact_ratio = 2.0
+
+    def __init__(self, filename, max_load=None):
+        self.filename = os.path.expanduser(filename)
+        if max_load is not None:
+            self.max_load = max_load
+        self.lock = threading.RLock()
+        self.file = None
+        self.map = None
+        self.offsets = array(OFFSET_TYPE)
+        self.end = 0
+        self.compacted = 0
+        self.loaded = 0
+        self.compactor = None
+        self.error = None
+
+    def open(self):
+        """Open the log, creating it if necessary, and build the offset
+        index. A partially written last entry is truncated, and a
+        plain-text history file is migrated.
+        """
+        if not os.path.exists(self.filename):
+            with open(self.filename, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, 0))
+        self.file = open(self.filename, 'r+b')
+        header = self.file.read(HEADER.size)
+        if header[:len(MAGIC)] != MAGIC:
+            self.file.close()
+            self.file = None
+            self.migrate()
+            self.file = open(self.filename, 'r+b')
+            header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            self.file.close()
+            self.file = None
+            raise ValueError('Not a kmd history file: %r' % self.filename)
+        magic, self.compacted = HEADER.unpack(header)
+        self.remap()
+        self.offsets = self.read_offsets()
+        if self.offsets:
+            # Rescan from the last known entry
+            start = self.offsets.pop()
+        else:
+            start = HEADER.size
+        self.end = self.scan(start)
+        if self.end < len(self.map):
+            self.file.truncate(self.end)
+            self.remap()
+
+    def migrate(self):
+        """Convert a plain-text history file to a log, skipping
+        timestamps and repeated lines. The original file is copied to
+        ``<filename>.txt`` first.
+        """
+        with open(self.filename, 'rb') as f:
+            lines = f.read().split(b'\n')
+        shutil.copyfile(self.filename, self.filename + '.txt')
+        tmpname = self.filename + '.migrate'
+        with open(tmpname, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, 0))
+            last = None
+            for line in lines:
+                if line and line != last and not is_timestamp(line):
+                    f.write(RECORD.pack(len(line)) + line)
+                    last = line
+            f.flush()
+            os.fsync(f.fileno())
+        replace(tmpname, self.filename)
+
+    def read_offsets(self):
+        offsets = array(OFFSET_TYPE)
+        try:
+            with open(self.filename + '.offsets', 'rb') as f:
+                inode, end = INDEX.unpack(f.read(INDEX.size))
+                st = os.fstat(self.file.fileno())
+                if inode == st.st_ino and end <= st.st_size:
+                    data = f.read()
+                    if sys.version_info[0] >= 3:
+                        offsets.frombytes(data)
+                    else:
+                        offsets.fromstring(data)
+        except (IOError, OSError, struct.error):
+            pass
+        if offsets and offsets[-1] + RECORD.size > len(self.map):
+            return array(OFFSET_TYPE)
+        return offsets
+
+    def write_offsets(self):
+        tmpname = self.filename + '.offsets.%d' % os.getpid()
+        try:
+            with open(tmpname, 'wb') as f:
+                f.write(INDEX.pack(os.fstat(self.file.fileno()).st_ino, self.end))
+                self.offsets.tofile(f)
+            replace(tmpname, self.filename + '.offsets')
+        except (IOError, OSError):
+            # The offsets are rebuilt by scanning the log
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+    def remap(self):
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def scan(self, pos):
+        m = self.map
+        size = len(m)
+        offsets = self.offsets
+        while pos + RECORD.size <= size:
+            length, = RECORD.unpack_from(m, pos)
+            if pos + RECORD.size + length > size:
+                break
+            offsets.append(pos)
+            pos += RECORD.size + length
+        return pos
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        with self.lock:
+            return decode(self.raw(self.offsets[index]))
+
+    def raw(self, pos, m=None):
+        if m is None:
+            m = self.map
+            if self.end > len(m):
+                self.remap()
+                m = self.map
+        start = pos + RECORD.size
+        return m[start:start + RECORD.unpack_from(m, pos)[0]]
+
+    def load(self):
+        """Open the log and add its last :attr:`max_load` entries to the
+        readline history. Starts a compaction if one is due.
+        """
+        if self.file is None:
+            try:
+                self.open()
+            except (IOError, OSError, ValueError):
+                return
+        with self.lock:
+            self.loaded = max(0, len(self) - self.max_load)
+            lines = [self[i] for i in range(self.loaded, len(self))]
+        for line in lines:
+            history.append(line)
+        if len(self) > self.compact_ratio * max(self.compacted, self.max_load):
+            self.start_compaction()
+
+    def read_older(self, count):
+        """Return up to ``count`` entries preceding the ones loaded so far,
+        oldest first.
+        """
+        with self.lock:
+            start = max(0, self.loaded - count)
+            lines = [self[i] for i in range(start, self.loaded)]
+            self.loaded = start
+        return lines
+
+    def load_more(self, count):
+        """Insert up to ``count`` older entries at the beginning of the
+        readline history. Returns the number of entries inserted.
+        """
+        lines = self.read_older(count)
+        prepend_history(lines)
+        return len(lines)
+
+    def append(self, line):
+        """Append ``line`` to the log, unless it repeats the last entry."""
+        if self.file is None:
+            return
+        data = encode(line)
+        with self.lock:
+            if self.offsets and self.raw(self.offsets[-1]) == data:
+                return
+            self.file.seek(self.end)
+            self.file.write(RECORD.pack(len(data)) + data)
+            self.file.flush()
+            self.offsets.append(self.end)
+            self.end += RECORD.size + len(data)
+
+    def refresh(self):
+        """Called before each prompt. Does nothing."""
+
+    def close(self, raise_exc=False):
+        """Wait for a running compaction, sync, and close the log.
+        If ``raise_exc`` is True, an error is allowed to propagate.
+        """
+        if self.compactor is not None:
+            self.compactor.join()
+            self.compactor = None
+        if self.file is not None:
+            with self.lock:
+                try:
+                    os.fsync(self.file.fileno())
+                    self.write_offsets()
+                except (IOError, OSError) as e:
+                    self.error = e
+                finally:
+                    if self.map is not None:
+                        self.map.close()
+                        self.map = None
+                    self.file.close()
+                    self.file = None
+        if raise_exc and self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def start_compaction(self):
+        """Run :meth:`compact` in a background thread."""
+        if self.compactor is None or not self.compactor.is_alive():
+            self.compactor = threading.Thread(target=self.compact)
+            self.compactor.daemon = True
+            self.compactor.start()
+
+    def compact(self):
+        """Rewrite the log without duplicate entries.
+        Entries appended while the compaction runs are preserved.
+        The log is replaced by renaming, so a failed compaction leaves
+        the old log in place. Errors are stored in :attr:`error`.
+        """
+        tmpname = self.filename + '.compact'
+        try:
+            with self.lock:
+                # Use a private map, remap() closes the shared one
+                m = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                offsets = self.offsets
+                count = len(offsets)
+                end = self.end
+            try:
+                self.rewrite(m, offsets, count, end, tmpname)
+            finally:
+                m.close()
+        except Exception as e:
+            self.error = e
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+    def rewrite(self, m, offsets, count, end, tmpname):
+        # Walk backwards, keeping the most recent occurrence of each entry
+        seen = set()
+        kept = array(OFFSET_TYPE)
+        for i in range(count-1, -1, -1):
+            # Not MD5, which is unavailable in FIPS mode
+            key = hashlib.sha1(self.raw(offsets[i], m)).digest()
+            if key not in seen:
+                seen.add(key)
+                kept.append(i)
+        kept.reverse()
+        seen = None
+
+        with open(tmpname, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(kept)))
+            for i in kept:
+                pos = offsets[i]
+                f.write(m[pos:pos + RECORD.size + RECORD.unpack_from(m, pos)[0]])
+            with self.lock:
+                if self.end > end:
+                    self.remap()
+                    f.write(self.map[end:self.end])
+                f.flush()
+                os.fsync(f.fileno())
+                replace(tmpname, self.filename)
+                # Translate the readline window to the new numbering
+                if self.loaded < count:
+                    self.loaded = bisect.bisect_left(kept, self.loaded)
+                else:
+                    self.loaded += len(kept) - count
+                self.map.close()
+                self.map = None
+                self.file.close()
+                self.file = None
+                self.open()
@@ -0,0 +1,346 @@
+"""Indexed history search.
+
+A :class:`~kmd.histindex.HistoryIndex` is a SQLite database of distinct
+history entries and the trigrams they contain. It is updated
+incrementally from a history file and answers substring and prefix
+queries without scanning the history::
+
+    from kmd.histindex import HistoryIndex
+
+    index = HistoryIndex('history.idx')
+    index.update('history')
+    index.search('commit')
+
+Matches are ranked by whether they start with the query, then by
+recency of use.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import sqlite3
+import hashlib
+
+from array import array
+
+from kmd.histfile import is_timestamp
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    line TEXT UNIQUE NOT NULL,
+    last_used INTEGER NOT NULL,
+    count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE INDEX IF NOT EXISTS entries_line_last_used ON entries (line, last_used);
+CREATE TABLE IF NOT EXISTS postings (
+    gram TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    ids BLOB NOT NULL,
+    PRIMARY KEY (gram, segment)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS grams (
+    gram TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+#: Bytes preceding the indexed offset used to detect a rewritten file.
+CHECK_SIZE = 64
+
+#: Number of posting segments per trigram before they are merged.
+MAX_SEGMENTS = 16
+
+#: Candidate sets up to this size are fetched and sorted, larger ones
+#: are filtered while walking the entries by recency.
+MAX_FETCH = 1000
+
+if sys.version_info[0] >= 3:
+    text_type = str
+else:
+    text_type = unicode
+
+
+def trigrams(line):
+    """Return the set of trigrams in ``line``."""
+    return set(line[i:i+3] for i in range(len(line)-2))
+
+
+def pack(ids):
+    if sys.version_info[0] >= 3:
+        return array('i', ids).tobytes()
+    return buffer(array('i', ids).tostring())
+
+
+def unpack(blob):
+    ids = array('i')
+    if sys.version_info[0] >= 3:
+        ids.frombytes(blob)
+    else:
+        ids.fromstring(str(blob))
+    return ids
+
+
+def decode(line):
+    if isinstance(line, text_type):
+        return line
+    return line.decode('utf-8', 'replace')
+
+
+class HistoryIndex(object):
+    """A trigram index of history entries stored in SQLite database
+    ``filename``.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self.db = sqlite3.connect(self.filename)
+        # The index can be rebuilt from the history file
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.executescript(SCHEMA)
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def close(self):
+        """Close the database."""
+        self.db.close()
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        return row[0]
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def clear(self):
+        """Remove all entries."""
+        with self.db:
+            self.db.execute('DELETE FROM postings')
+            self.db.execute('DELETE FROM grams')
+            self.db.execute('DELETE FROM entries')
+            self.db.execute('DELETE FROM meta')
+
+    def add(self, lines):
+        """Add ``lines`` to the index, in order of use."""
+        with self.db:
+            self._add(lines)
+
+    def _add(self, lines):
+        seq = int(self.get_meta('seq', 0))
+        execute = self.db.execute
+        postings = {}
+        for line in lines:
+            line = decode(line)
+            if not line:
+                continue
+            seq += 1
+            cursor = execute('INSERT OR IGNORE INTO entries (line, last_used, count) '
+                             'VALUES (?, ?, 1)', (line, seq))
+            if cursor.rowcount == 1:
+                entry = cursor.lastrowid
+                for gram in trigrams(line):
+                    if gram in postings:
+                        postings[gram].append(entry)
+                    else:
+                        postings[gram] = [entry]
+            else:
+                execute('UPDATE entries SET last_used = ?, count = count + 1 '
+                        'WHERE line = ?', (seq, line))
+        self.set_meta('seq', str(seq))
+        if postings:
+            # Each update adds one segment of postings per trigram
+            segment = int(self.get_meta('segments', 0))
+            self.db.executemany('INSERT INTO postings (gram, segment, ids) VALUES (?, ?, ?)',
+                                ((gram, segment, pack(ids)) for gram, ids in postings.items()))
+            self.db.executemany('INSERT OR IGNORE INTO grams (gram, count) VALUES (?, 0)',
+                                ((gram,) for gram in postings))
+            self.db.executemany('UPDATE grams SET count = count + ? WHERE gram = ?',
+                                ((len(ids), gram) for gram, ids in postings.items()))
+            self.set_meta('segments', str(segment + 1))
+            if segment + 1 >= MAX_SEGMENTS:
+                self._compact()
+
+    def compact(self):
+        """Merge the posting segments of each trigram."""
+        with self.db:
+            self._compact()
+
+    def _compact(self):
+        merged = {}
+        for gram, blob in self.db.execute('SELECT gram, ids FROM postings ORDER BY gram, segment'):
+            if gram in merged:
+                merged[gram].extend(unpack(blob))
+            else:
+                merged[gram] = unpack(blob)
+        self.db.execute('DELETE FROM postings')
+        self.db.executemany('INSERT INTO postings (gram, segment, ids) VALUES (?, 0, ?)',
+                            ((gram, pack(ids)) for gram, ids in merged.items()))
+        self.set_meta('segments', '1')
+
+    def postings(self, gram):
+        """Return the set of entry ids containing ``gram``."""
+        ids = set()
+        for blob, in self.db.execute('SELECT ids FROM postings WHERE gram = ?', (gram,)):
+            ids.update(unpack(blob))
+        return ids
+
+    def update(self, history_file):
+        """Add the lines appended to ``history_file`` since the last update.
+        If the file was rewritten in a different way, it is indexed again
+        from the start. Returns the number of lines read.
+        """
+        history_file = os.path.expanduser(history_file)
+        try:
+            f = open(history_file, 'rb')
+        except (IOError, OSError):
+            return 0
+        with f:
+            offset = int(self.get_meta('offset', 0))
+            check = self.get_meta('check', '')
+            f.seek(0, 2)
+            size = f.tell()
+            if offset > size or self.checksum(f, offset) != check:
+                self.clear()
+                offset = 0
+            f.seek(offset)
+            data = f.read(size - offset)
+            # Leave an incomplete last line for the next update
+            end = data.rfind(b'\n') + 1
+            lines = [x for x in data[:end].split(b'\n')[:-1] if not is_timestamp(x)]
+            offset += end
+            with self.db:
+                self._add(lines)
+                self.set_meta('offset', str(offset))
+                self.set_meta('check', self.checksum(f, offset))
+        return len(lines)
+
+    def checksum(self, f, offset):
+        start = max(0, offset - CHECK_SIZE)
+        f.seek(start)
+        # Not MD5, which is unavailable in FIPS mode
+        return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+    def search(self, query, limit=20, prefix=False):
+        """Return up to ``limit`` entries containing ``query``, or starting
+        with ``query`` if ``prefix`` is True. Best matches come first.
+        """
+        query = decode(query)
+        if not query:
+            return []
+        bounds = (query, query + u'\U0010ffff')
+        # Sorting all entries with a short prefix by recency is slow
+        found = self.db.execute(
+            'SELECT last_used, line FROM entries WHERE line >= ? AND line < ? '
+            'LIMIT ?', bounds + (MAX_FETCH + 1,)).fetchall()
+        if len(found) <= MAX_FETCH:
+            found.sort(reverse=True)
+            matches = [line for last_used, line in found[:limit]]
+        else:
+            matches = [row[0] for row in self.db.execute(
+                'SELECT line FROM entries INDEXED BY entries_last_used '
+                'WHERE line >= ? AND line < ? ORDER BY last_used DESC LIMIT ?',
+                bounds + (limit,))]
+        if prefix or len(matches) == limit:
+            return matches
+        limit -= len(matches)
+        if len(query) < 3:
+            candidates = None
+        else:
+            # Intersect the postings of the rarest trigrams of the query
+            grams = sorted(trigrams(query))
+            counts = dict(self.db.execute(
+                'SELECT gram, count FROM grams WHERE gram IN (%s)'
+                % ', '.join('?' * len(grams)), grams))
+            if len(counts) < len(grams):
+                return matches
+            grams.sort(key=counts.get)
+            candidates = self.postings(grams[0])
+            for gram in grams[1:3]:
+                candidates.intersection_update(self.postings(gram))
+        if candidates is not None and len(candidates) <= MAX_FETCH:
+            found = []
+            candidates = list(candidates)
+            for i in range(0, len(candidates), 500):
+                chunk = candidates[i:i+500]
+                found.extend(self.db.execute(
+                    'SELECT last_used, line FROM entries WHERE id IN (%s) '
+                    'AND instr(line, ?) > 1' % ', '.join('?' * len(chunk)),
+                    chunk + [query]))
+            found.sort(reverse=True)
+            matches.extend(line for last_used, line in found[:limit])
+        else:
+            # Walk the entries by recency until enough matches are found.
+            # Entries containing the query contain all of its trigrams.
+            matches.extend(row[0] for row in self.db.execute(
+                'SELECT line FROM entries INDEXED BY entries_last_used '
+                'WHERE instr(line, ?) > 1 ORDER BY last_used DESC LIMIT ?',
+                (query, limit)))
+        return matches
+
+
+class HistorySearch(object):
+    """Mixin adding an indexed ``history search`` command to a
+    :class:`~kmd.Kmd` subclass.
+
+    The index is stored in :attr:`history_index_file` and updated from
+    the :attr:`~kmd.Kmd.history_file` in :meth:`postloop` and before
+    each search.
+
+    Example::
+
+        import kmd
+        from kmd.histindex import HistorySearch
+
+        class MyShell(HistorySearch, kmd.Kmd):
+            history_file = '~/.myshell_history'
+    """
+
+    history_index_file = ''
+    history_index = None
+    history_search_limit = 20
+
+    def get_history_index(self):
+        """Return the :class:`~kmd.histindex.HistoryIndex`, creating it if
+        necessary. The index file defaults to the history file name
+        plus ``.idx``.
+        """
+        if self.history_index is None:
+            filename = self.history_index_file or self.history_file + '.idx'
+            self.history_index = HistoryIndex(filename)
+        return self.history_index
+
+    def postloop(self):
+        """Update the history index."""
+        super(HistorySearch, self).postloop()
+        if self.history_file:
+            self.get_history_index().update(self.history_file)
+
+    def do_history(self, args):
+        """Usage: history search [--prefix] <text>
+
+        Show the most recent history entries containing, or starting with,
+        the text.
+        """
+        words = args.split(None, 1)
+        prefix = False
+        if len(words) == 2 and words[0] == 'search':
+            args = words[1]
+            if args.startswith('--prefix '):
+                prefix = True
+                args = args[9:].lstrip()
+            if args and self.history_file:
+                index = self.get_history_index()
+                index.update(self.history_file)
+                for line in index.search(args, self.history_search_limit, prefix):
+                    self.stdout.write(line + '\n')
+                return
+        self.stderr.write('*** Usage: history search [--prefix] <text>\n')
@@ -0,0 +1,113 @@
+"""Command name index."""
+
+from __future__ import absolute_import
+
+import weakref
+
+from bisect import bisect_left
+
+from kmd.kmd import COMMAND_PREFIXES
+
+_index_cache = weakref.WeakKeyDictionary()
+
+
+def prefix_range(names, prefix):
+    """Return the slice bounds of the entries in the sorted list ``names``
+    starting with ``prefix``.
+    """
+    lo = bisect_left(names, prefix)
+    if not prefix:
+        return lo, len(names)
+    # The smallest string greater than all strings starting with prefix
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return lo, bisect_left(names, upper, lo)
+
+
+class CommandIndex(object):
+    """A sorted index of ``do_``, ``complete_``, and ``help_`` attribute
+    names.
+    Resolves aliases, unique prefixes, and ambiguity by binary search
+    instead of scanning the full list of names.
+    """
+
+    def __init__(self, names):
+        self.names = sorted(set(names))
+        self.tables = {}
+        for prefix in COMMAND_PREFIXES:
+            lo, hi = prefix_range(self.names, prefix)
+            size = len(prefix)
+            self.tables[prefix] = [x[size:] for x in self.names[lo:hi]]
+
+    def __contains__(self, name):
+        i = bisect_left(self.names, name)
+        return i < len(self.names) and self.names[i] == name
+
+    def match(self, prefix, text):
+        """Return the sorted list of names starting with ``text``.
+        ``prefix`` selects the table and is not included in the results.
+        """
+        table = self.tables[prefix]
+        lo, hi = prefix_range(table, text)
+        return table[lo:hi]
+
+    def expand(self, prefix, cmd, aliases=None):
+        """Expand alias or unique abbreviation ``cmd`` and return the
+        full attribute name. Returns None if ``cmd`` is unknown or ambiguous.
+        """
+        table = self.tables[prefix]
+        if aliases:
+            expanded = aliases.get(cmd, cmd)
+        else:
+            expanded = cmd
+        i = bisect_left(table, expanded)
+        if i < len(table) and table[i] == expanded:
+            return prefix + expanded
+        lo, hi = prefix_range(table, cmd)
+        if hi - lo == 1:
+            return prefix + table[lo]
+        return None
+
+
+def class_signature(cls):
+    """Return a value that changes when commands are added to or
+    removed from ``cls`` or any of its bases.
+    For :class:`~kmd.Kmd` classes this is the
+    :attr:`~kmd.kmd.KmdType.commands_version` maintained by their
+    metaclass, which costs nothing to check.
+    """
+    version = getattr(type(cls), 'commands_version', None)
+    if version is not None:
+        return version
+    return tuple(tuple(c.__dict__) for c in cls.__mro__)
+
+
+def get_index(shell):
+    """Return the :class:`~kmd.index.CommandIndex` of ``shell``'s class.
+    The index is built from ``shell.get_names()`` once per class and
+    rebuilt when commands are added to or removed from the class or
+    one of its bases.
+    """
+    cls = shell.__class__
+    signature = class_signature(cls)
+    cached = _index_cache.get(cls)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    index = CommandIndex(shell.get_names())
+    _index_cache[cls] = (signature, index)
+    return index
+
+
+def invalidate(cls=None):
+    """Discard the cached index of ``cls``, or all indexes if ``cls`` is None.
+    Needed if a subclass overrides ``get_names``, or if commands are
+    added to a mixin class which is not a :class:`~kmd.Kmd` subclass.
+    Dispatch tables are rebuilt as well.
+    """
+    from kmd.kmd import KmdType
+    from kmd.kmd import invalidate_dispatch_tables
+    if cls is None:
+        _index_cache.clear()
+    else:
+        _index_cache.pop(cls, None)
+    KmdType.commands_version += 1
+    invalidate_dispatch_tables()
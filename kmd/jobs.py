@@ -0,0 +1,220 @@
+"""Background job execution.
+
+Requires :mod:`concurrent.futures <py3k:concurrent.futures>`
+(the ``futures`` backport on Python 2).
+"""
+
+from __future__ import absolute_import
+
+import sys
+import copy
+import traceback
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd.quoting import QUOTE_CHARACTERS
+from kmd.quoting import char_is_quoted
+
+
+def run_job(shell, line):
+    """Execute ``line`` in ``shell`` and return the captured output as
+    a (stdout, stderr) tuple. ``shell`` may also be a Kmd class, in which
+    case a new instance is created.
+    """
+    if isinstance(shell, type):
+        shell = shell()
+    shell.stdout = StringIO()
+    shell.stderr = StringIO()
+    shell.onecmd(line)
+    return shell.stdout.getvalue(), shell.stderr.getvalue()
+
+
+class Job(object):
+    """A command executing in the background."""
+
+    def __init__(self, number, line, future):
+        self.number = number
+        self.line = line
+        self.future = future
+
+    @property
+    def status(self):
+        """One of 'Pending', 'Running', 'Cancelled', 'Failed', or 'Done'."""
+        if self.future.cancelled():
+            return 'Cancelled'
+        if not self.future.done():
+            if self.future.running():
+                return 'Running'
+            return 'Pending'
+        if self.future.exception() is not None:
+            return 'Failed'
+        return 'Done'
+
+
+class JobControl(object):
+    """Mixin adding job control to a :class:`~kmd.Kmd` subclass.
+
+    A command line ending with ``&`` is executed in the background,
+    on the executor returned by :meth:`~kmd.jobs.JobControl.get_job_executor`.
+    The output of a background command is buffered and shown when
+    the job is reported as finished, which happens before the next command
+    executes and in the ``jobs`` and ``wait`` commands.
+
+    With a thread pool, jobs run in a shallow copy of the shell.
+    With a process pool, jobs run in a new instance of the shell class
+    which must be importable by the worker processes.
+
+    Example::
+
+        import kmd
+        from kmd.jobs import JobControl
+
+        class MyShell(JobControl, kmd.Kmd):
+            job_pool = 'process'
+    """
+
+    job_pool = 'thread'
+    job_max_workers = None
+    job_executor = None
+    jobs = None
+    job_count = 0
+
+    def get_job_executor(self):
+        """Return the executor for background jobs.
+        By default creates a thread or process pool, depending on
+        :attr:`job_pool`, with :attr:`job_max_workers` workers.
+        """
+        if self.job_executor is None:
+            from concurrent import futures
+            if self.job_pool == 'process':
+                self.job_executor = futures.ProcessPoolExecutor(self.job_max_workers)
+            else:
+                self.job_executor = futures.ThreadPoolExecutor(self.job_max_workers)
+        return self.job_executor
+
+    def onecmd(self, line):
+        """Interpret a command line.
+        If the line ends with an unquoted ``&`` execute it in the background.
+        """
+        self.report_jobs()
+        stripped = line.strip()
+        if (stripped[-1:] == '&' and stripped[:1] != '#' and
+            not char_is_quoted(stripped, len(stripped)-1, QUOTE_CHARACTERS)):
+            return self.background(stripped)
+        return super(JobControl, self).onecmd(line)
+
+    def postloop(self):
+        """Cancel pending jobs, wait for running jobs, and shut down
+        the job executor. The output of finished jobs is shown.
+        """
+        for job in (self.jobs or {}).values():
+            job.future.cancel()
+        if self.job_executor is not None:
+            self.job_executor.shutdown()
+            self.job_executor = None
+        self.report_jobs()
+        super(JobControl, self).postloop()
+
+    def background(self, line):
+        """Submit ``line``, minus the trailing ``&``, to the job executor
+        and print the job number.
+        """
+        from concurrent import futures
+        cmd, arg, job = self.parseline(line[:-1])
+        if not cmd:
+            return self.default(line)
+        line = job
+        executor = self.get_job_executor()
+        if isinstance(executor, futures.ProcessPoolExecutor):
+            future = executor.submit(run_job, self.__class__, line)
+        else:
+            shell = copy.copy(self)
+            shell.jobs = None
+            shell.dispatch_table = None
+            future = executor.submit(run_job, shell, line)
+        if self.jobs is None:
+            self.jobs = {}
+        self.job_count = self.job_count+1
+        self.jobs[self.job_count] = Job(self.job_count, line, future)
+        self.lastcmd = ''
+        self.stdout.write('[%d] %s\n' % (self.job_count, line))
+
+    def report_jobs(self, numbers=None):
+        """Print status and output of finished jobs and forget about them."""
+        if not self.jobs:
+            return
+        for number in sorted(self.jobs):
+            job = self.jobs[number]
+            if not job.future.done():
+                continue
+            if numbers is not None and number not in numbers:
+                continue
+            del self.jobs[number]
+            status = job.status
+            self.stdout.write('[%d] %-9s %s\n' % (number, status, job.line))
+            if status == 'Done':
+                stdout, stderr = job.future.result()
+                self.stdout.write(stdout)
+                self.stderr.write(stderr)
+            elif status == 'Failed':
+                exc = job.future.exception()
+                error = traceback.format_exception_only(exc.__class__, exc)
+                self.stderr.write('*** %s' % error[-1])
+
+    def parse_job_numbers(self, args):
+        """Return the job numbers in ``args``, or all job numbers if ``args``
+        is empty. Unknown job numbers are reported to stderr and omitted.
+        """
+        jobs = self.jobs or {}
+        if not args:
+            return sorted(jobs)
+        numbers = []
+        for arg in args.split():
+            try:
+                number = int(arg.lstrip('%'))
+            except ValueError:
+                number = None
+            if number in jobs:
+                numbers.append(number)
+            else:
+                self.stderr.write('*** No such job: %s\n' % (arg,))
+        return numbers
+
+    def do_jobs(self, args):
+        """Usage: jobs
+
+        List background jobs.
+        """
+        self.report_jobs()
+        for number in sorted(self.jobs or {}):
+            job = self.jobs[number]
+            self.stdout.write('[%d] %-9s %s\n' % (number, job.status, job.line))
+
+    def do_wait(self, args):
+        """Usage: wait [<job> ...]
+
+        Wait for background jobs to finish and show their output.
+        Without arguments, wait for all jobs.
+        """
+        from concurrent import futures
+        numbers = self.parse_job_numbers(args)
+        futures.wait([self.jobs[x].future for x in numbers])
+        self.report_jobs(numbers)
+
+    def do_kill(self, args):
+        """Usage: kill <job> ...
+
+        Cancel background jobs that have not started running yet.
+        Running jobs cannot be stopped; they are reported and
+        continue until they finish.
+        """
+        if not args:
+            self.stderr.write('*** Usage: kill <job> ...\n')
+            return
+        for number in self.parse_job_numbers(args):
+            if not self.jobs[number].future.cancel():
+                self.stderr.write('*** Cannot kill running job: %d\n' % (number,))
+        self.report_jobs()
@@ -2,8 +2,13 @@
 
 from __future__ import absolute_import
 
+import os
+import re
 import sys
 import cmd
+import time
+
+from functools import partial
 
 from rl import completer
 from rl import completion
@@ -15,10 +20,107 @@ from kmd.quoting import WORD_BREAK_CHARACTERS
 from kmd.quoting import FILENAME_QUOTE_CHARACTERS
 from kmd.quoting import char_is_quoted
 from kmd.quoting import is_fully_quoted
-from kmd.quoting import backslash_quote
+from kmd.quoting import get_quoter
+from kmd.quoting import tokenize
+from kmd.quoting import split_words
+
+if sys.version_info[0] >= 3:
+    string_types = (str,)
+else:
+    string_types = (basestring,)
+
+timer = getattr(time, 'perf_counter', time.time)
+
+#: Attribute prefixes of command methods.
+COMMAND_PREFIXES = ('do_', 'complete_', 'help_')
+
+
+class KmdType(type):
+    """Metaclass of :class:`~kmd.Kmd`.
+    Counts changes to command methods in :attr:`commands_version`, so that
+    command indexes and dispatch tables can be invalidated without
+    rescanning classes.
+    """
+
+    #: Incremented when a command method is added to, replaced in, or
+    #: removed from any Kmd class.
+    commands_version = 0
+
+    def __setattr__(cls, name, value):
+        super(KmdType, cls).__setattr__(name, value)
+        if name.startswith(COMMAND_PREFIXES):
+            KmdType.commands_version += 1
+            invalidate_dispatch_tables()
+
+    def __delattr__(cls, name):
+        super(KmdType, cls).__delattr__(name)
+        if name.startswith(COMMAND_PREFIXES):
+            KmdType.commands_version += 1
+            invalidate_dispatch_tables()
+
+
+#: Shells owning a dispatch table, created on first use.
+_dispatch_shells = None
 
 
-class Kmd(cmd.Cmd, object):
+def invalidate_dispatch_tables():
+    """Discard the dispatch tables of all shells. They are rebuilt on
+    next use. Called when commands or aliases change.
+    """
+    if _dispatch_shells:
+        for shell in list(_dispatch_shells):
+            shell.dispatch_table = None
+
+
+class Aliases(dict):
+    """Dictionary of command aliases which discards dispatch tables
+    when it is changed.
+    """
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        invalidate_dispatch_tables()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        invalidate_dispatch_tables()
+
+    def clear(self):
+        dict.clear(self)
+        invalidate_dispatch_tables()
+
+    def pop(self, *args):
+        try:
+            return dict.pop(self, *args)
+        finally:
+            invalidate_dispatch_tables()
+
+    def popitem(self):
+        try:
+            return dict.popitem(self)
+        finally:
+            invalidate_dispatch_tables()
+
+    def setdefault(self, key, default=None):
+        try:
+            return dict.setdefault(self, key, default)
+        finally:
+            invalidate_dispatch_tables()
+
+    def update(self, *args, **kw):
+        dict.update(self, *args, **kw)
+        invalidate_dispatch_tables()
+
+
+def with_metaclass(meta, *bases):
+    """Create a base class with metaclass ``meta`` (Python 2 and 3)."""
+    class metaclass(meta):
+        def __new__(cls, name, this_bases, d):
+            return meta(name, bases, d)
+    return type.__new__(metaclass, 'temporary_class', (), {})
+
+
+class Kmd(with_metaclass(KmdType, cmd.Cmd, object)):
     """Interpreter base class.
 
     This is a subclass of the standard library's :class:`cmd.Cmd <py3k:cmd.Cmd>` class,
@@ -35,6 +137,11 @@ class Kmd(cmd.Cmd, object):
     #. Command aliases can be defined by extending the :attr:`~kmd.Kmd.aliases` dictionary.
     #. :meth:`help_*` methods optionally receive the help topic as argument.
     #. :meth:`complete_*` methods may return any kind of iterable, not just lists.
+    #. The :attr:`cmdqueue <py3k:cmd.Cmd.cmdqueue>` is a :class:`~kmd.cmdqueue.CommandQueue`
+       and may be fed lazily via :meth:`~kmd.Kmd.feed`.
+    #. Commands may be provided by lazily loaded :attr:`~kmd.Kmd.plugins`.
+    #. Commands may optionally be dispatched via a precompiled table, see
+       :attr:`~kmd.Kmd.use_dispatch_table`.
 
     Example::
 
@@ -54,7 +161,18 @@ class Kmd(cmd.Cmd, object):
     shell_escape_chars = '!'
     history_file = ''
     history_max_entries = -1
+    history_class = None
+    history_backend = None
     hidden = ('EOF',)
+    use_dispatch_table = False
+    dispatch_table = None
+    completion_timeout = None
+    completion_tasks = None
+    cache_completions = False
+    completion_cache = None
+    plugins = None
+    command_stats = None
+    completion_profiler = None
 
     def __init__(self, completekey='TAB', stdin=None, stdout=None, stderr=None):
         """Instantiate a line-oriented interpreter framework.
@@ -66,6 +184,8 @@ class Kmd(cmd.Cmd, object):
         sys.stdin, sys.stdout, and sys.stderr are used.
         """
         super(Kmd, self).__init__(completekey, stdin, stdout)
+        from kmd.cmdqueue import CommandQueue
+        self.cmdqueue = CommandQueue()
 
         if stderr is not None:
             self.stderr = stderr
@@ -73,12 +193,16 @@ class Kmd(cmd.Cmd, object):
             self.stderr = sys.stderr
 
         # Add escape chars to aliases so they show up in help
-        self.aliases = {'?': 'help'}
+        self.aliases = Aliases({'?': 'help'})
 
         if hasattr(self, 'do_shell'):
             for char in self.shell_escape_chars:
                 self.aliases[char] = 'shell'
 
+        if os.environ.get('KMD_PROFILE_COMPLETION'):
+            from kmd.profiling import get_profiler
+            self.completion_profiler = get_profiler()
+
     def cmdloop(self, intro=None):
         """Repeatedly issue a prompt, accept input, parse an initial prefix
         off the received input, and dispatch to action methods, passing them
@@ -114,6 +238,16 @@ class Kmd(cmd.Cmd, object):
         finally:
             self.postloop()
 
+    def feed(self, iterable):
+        """Queue the lines of ``iterable`` for execution by the
+        :meth:`~kmd.Kmd.cmdloop`. Lines are read one at a time, as they
+        are needed, so ``iterable`` may be a file or generator of any size.
+        """
+        from kmd.cmdqueue import CommandQueue
+        if not isinstance(self.cmdqueue, CommandQueue):
+            self.cmdqueue = CommandQueue(self.cmdqueue)
+        self.cmdqueue.feed(iterable)
+
     def preloop(self):
         """Called when the :meth:`~kmd.Kmd.cmdloop` method is entered. Configures the
         readline completer and loads the history file.
@@ -123,7 +257,11 @@ class Kmd(cmd.Cmd, object):
                 history.max_entries = self.history_max_entries
 
             if self.history_file:
-                history.read_file(self.history_file)
+                if self.history_class is not None:
+                    self.history_backend = self.history_class(self.history_file)
+                    self.history_backend.load()
+                else:
+                    history.read_file(self.history_file)
 
             if self.completekey:
                 self.clear_hooks()
@@ -138,12 +276,18 @@ class Kmd(cmd.Cmd, object):
 
     def postloop(self):
         """Called when the :meth:`~kmd.Kmd.cmdloop` method is exited. Resets the readline
-        completer and saves the history file.
+        completer and saves the history file. History backend errors
+        are reported to stderr.
         Note that :meth:`~kmd.Kmd.postloop` is called even if :meth:`~kmd.Kmd.cmdloop`
         exits with an exception!
         """
         if self.use_rawinput:
-            if self.history_file:
+            if self.history_backend is not None:
+                backend, self.history_backend = self.history_backend, None
+                backend.close()
+                if getattr(backend, 'error', None) is not None:
+                    self.stderr.write('*** Error writing history file: %s\n' % (backend.error,))
+            elif self.history_file:
                 history.write_file(self.history_file)
 
             if self.completekey:
@@ -155,11 +299,18 @@ class Kmd(cmd.Cmd, object):
         """Read a line from the keyboard using :func:`input() <py3k:input>`
         (or :func:`raw_input() <py:raw_input>` in Python 2).
         When the user presses the TAB key, invoke the readline completer.
+        Before reading, the :attr:`~kmd.Kmd.history_backend` is refreshed;
+        non-empty lines are appended to it.
         """
+        if self.history_backend is not None:
+            self.history_backend.refresh()
         if sys.version_info[0] >= 3:
-            return input(prompt)
+            line = input(prompt)
         else:
-            return raw_input(prompt)
+            line = raw_input(prompt)
+        if line and self.history_backend is not None:
+            self.history_backend.append(line)
+        return line
 
     @print_exc
     def word_break_hook(self, begidx, endidx):
@@ -171,22 +322,20 @@ class Kmd(cmd.Cmd, object):
         """
         # This has a flaw as we cannot complete names that contain
         # the new word break character.
-        origline = completion.line_buffer
-        line = origline.lstrip()
-        stripped = len(origline) - len(line)
-        begidx = begidx - stripped
-        if begidx == 0:
-            if line[0] == '?' or (hasattr(self, 'do_shell') and line[0] in self.shell_escape_chars):
-                if line[0] not in completer.word_break_characters:
-                    return line[0] + completer.word_break_characters
+        line = completion.line_buffer
+        words = tokenize(line)
+        if words and begidx == words[0].start:
+            c = line[begidx]
+            if c == '?' or (hasattr(self, 'do_shell') and c in self.shell_escape_chars):
+                if c not in completer.word_break_characters:
+                    return c + completer.word_break_characters
 
     @print_exc
     def complete(self, text, state):
         """complete(text, state)
         Return the next possible completion for ``text``.
 
-        If a command has not been entered, complete against the command list.
-        Otherwise try to call :meth:`complete_\<command\>` to get a list of completions.
+        Calls :meth:`~kmd.Kmd.completions` with the current line buffer.
         Installed as :attr:`rl.completer.completer <rl:rl.Completer.completer>`.
         """
         if state == 0:
@@ -195,23 +344,72 @@ class Kmd(cmd.Cmd, object):
             stripped = len(origline) - len(line)
             begidx = completion.begidx - stripped
             endidx = completion.endidx - stripped
-            if begidx == 0:
-                compfunc = self.completenames
-            else:
-                cmd, arg, foo = self.parseline(line)
-                if not cmd:
-                    compfunc = self.completedefault
-                else:
-                    try:
-                        compfunc = getattr(self, 'complete_' + cmd)
-                    except AttributeError:
-                        compfunc = self.completedefault
-            self.completion_matches = iter(compfunc(text, line, begidx, endidx))
+            self.completion_matches = iter(self.completions(text, line, begidx, endidx))
         try:
             return next(self.completion_matches)
         except StopIteration:
             return None
 
+    def completions(self, text, line, begidx, endidx):
+        """Return an iterable of completions for ``text``.
+
+        If a command has not been entered, complete against the command list.
+        Otherwise try to call :meth:`complete_\<command\>` to get a list of completions.
+        Results of cacheable completion functions are stored in the
+        :attr:`~kmd.Kmd.completion_cache`, unless the function requested
+        readline's filename completion.
+        If a :attr:`~kmd.Kmd.completion_timeout` is set, thread-safe completion
+        functions run in a background thread.
+        If a :attr:`~kmd.Kmd.completion_profiler` is set, the completion function
+        is timed.
+        """
+        if begidx == 0:
+            compfunc = self.completenames
+        else:
+            cmd, arg, foo = self.parseline(line)
+            if not cmd:
+                compfunc = self.completedefault
+            else:
+                try:
+                    compfunc = getattr(self, 'complete_' + cmd)
+                except AttributeError:
+                    compfunc = self.completedefault
+
+        callback = None
+        cacheable = getattr(compfunc, 'cacheable', None)
+        if cacheable or (cacheable is None and self.cache_completions):
+            if self.completion_cache is None:
+                from kmd.caching import CompletionCache
+                self.completion_cache = CompletionCache()
+            # Key by function so that shells sharing a cache share entries
+            key = (getattr(compfunc, '__func__', compfunc), line[:begidx])
+            # Only cacheable functions promise subset behavior
+            matches = self.completion_cache.get(key, text, bool(cacheable))
+            if matches is not None:
+                return matches
+            callback = partial(self.completion_cache.put, key, text)
+
+        # Readline-backed completion functions must run on the main thread
+        background = self.completion_timeout is not None and getattr(compfunc, 'threadsafe', False)
+
+        if self.completion_profiler is not None:
+            compfunc = self.completion_profiler.wrap(compfunc)
+
+        if not background:
+            matches = compfunc(text, line, begidx, endidx)
+            # Filename completion has side effects on readline (appending
+            # slashes, quoting, dequoting text) that a cache hit cannot replay
+            if callback is not None and not completion.filename_completion_desired:
+                matches = list(matches)
+                callback(matches)
+        else:
+            if self.completion_tasks is None:
+                from kmd.background import CompletionTasks
+                self.completion_tasks = CompletionTasks()
+            matches = self.completion_tasks.complete(
+                self.completion_timeout, compfunc, text, line, begidx, endidx, callback)
+        return matches
+
     def onecmd(self, line):
         """Interpret a command line.
 
@@ -239,12 +437,20 @@ class Kmd(cmd.Cmd, object):
             self.lastcmd = ''
         if cmd == '':
             return self.default(line)
+        if self.use_dispatch_table:
+            table = self.dispatch_table
+            if table is None:
+                self.build_dispatch_table()
+                table = self.dispatch_table
+            dofunc = table.get(cmd)
         else:
-            try:
-                dofunc = getattr(self, 'do_' + cmd)
-            except AttributeError:
-                return self.default(line)
-            return dofunc(arg)
+            dofunc = getattr(self, 'do_' + cmd, None)
+        if dofunc is None:
+            return self.default(line)
+        if self.command_stats is not None:
+            name = self.get_index().expand('do_', cmd, self.aliases) or 'do_' + cmd
+            return self.command_stats.call(name[3:], dofunc, arg)
+        return dofunc(arg)
 
     def parseline(self, line):
         """Parse the line into a command name and a string containing
@@ -263,9 +469,7 @@ class Kmd(cmd.Cmd, object):
                 line = 'shell ' + line[1:]
             else:
                 return None, None, line
-        i, n = 0, len(line)
-        while i < n and line[i] in self.identchars:
-            i = i+1
+        i = get_ident_pattern(self.identchars).match(line).end()
         cmd, arg = line[:i], line[i:].strip()
         return cmd, arg, line
 
@@ -288,7 +492,7 @@ class Kmd(cmd.Cmd, object):
         self.stderr.write('*** Unknown syntax: %s\n' % (line,))
 
     def completenames(self, text, *ignored):
-        cmds = super(Kmd, self).completenames(text, *ignored)
+        cmds = self.get_index().match('do_', text)
         return [x for x in cmds if x not in self.hidden]
 
     def do_help(self, topic=''):
@@ -299,11 +503,10 @@ class Kmd(cmd.Cmd, object):
                 helpfunc = getattr(self, 'help_' + topic)
             except AttributeError:
                 try:
-                    dofunc = getattr(self, 'do_' + topic)
+                    doc = self.get_doc(topic)
                 except AttributeError:
                     pass
                 else:
-                    doc = dofunc.__doc__
                     if doc:
                         self.stdout.write("%s\n" % doc)
                         return
@@ -316,11 +519,28 @@ class Kmd(cmd.Cmd, object):
         else:
             self.help()
 
+    def get_doc(self, cmd, unknown=AttributeError):
+        """Return the docstring of command ``cmd``.
+        Does not import plugins if their help text is known. If it is not,
+        returns ``unknown``, unless ``unknown`` is the default, in which case
+        the plugin is loaded. Raises AttributeError if there is no such command.
+        """
+        if self.plugins is not None:
+            name = self.get_index().expand('do_', cmd, self.aliases)
+            if name is not None and not hasattr(self.__class__, name):
+                plugin = self.plugins.get(name[3:])
+                if plugin is not None and plugin.func is None:
+                    if plugin.doc is not None:
+                        return plugin.doc
+                    if unknown is not AttributeError:
+                        return unknown
+        return getattr(self, 'do_' + cmd).__doc__ or ''
+
     def help(self):
         """Print the default help screen. Empty sections and sections with
         empty headers are omitted.
         """
-        names = self.get_names()
+        names = list(self.get_index().names)
         cmds_doc = []
         cmds_undoc = []
         help = {}
@@ -340,7 +560,7 @@ class Kmd(cmd.Cmd, object):
                 if cmd in help:
                     cmds_doc.append(cmd)
                     del help[cmd]
-                elif getattr(self, name).__doc__:
+                elif self.get_doc(cmd, None) != '':
                     cmds_doc.append(cmd)
                 else:
                     cmds_undoc.append(cmd)
@@ -354,17 +574,21 @@ class Kmd(cmd.Cmd, object):
         if self.undoc_header:
             self.print_topics(self.undoc_header, cmds_undoc, 15, 80)
 
-    def run(self, args=None):
+    def run(self, args=None, script=None, stop_on_error=False):
         """Run the Kmd.
 
         If ``args`` is None it defaults to ``sys.argv[1:]``.
         If arguments are present they are executed via :meth:`~kmd.Kmd.onecmd`.
         Without arguments, enters the :meth:`~kmd.Kmd.cmdloop`.
+        If a ``script`` is given, it is executed via :meth:`~kmd.Kmd.runscript`
+        and ``args`` are ignored.
         """
         if args is None:
             args = sys.argv[1:]
         try:
-            if args:
+            if script is not None:
+                return self.runscript(script, stop_on_error)
+            elif args:
                 self.onecmd(self.rejoin(args))
             else:
                 self.cmdloop()
@@ -373,15 +597,54 @@ class Kmd(cmd.Cmd, object):
             return 1
         return 0
 
+    def runscript(self, script, stop_on_error=False):
+        """Execute the commands in ``script``, which may be a filename,
+        a file object, or any other iterable of lines.
+
+        Lines are passed through :meth:`precmd() <py3k:cmd.Cmd.precmd>`,
+        :meth:`~kmd.Kmd.onecmd`, and :meth:`postcmd() <py3k:cmd.Cmd.postcmd>`
+        without issuing prompts. If a command raises an exception, the error
+        is reported and execution continues with the next line, unless
+        ``stop_on_error`` is True.
+        Reports the number of lines per second to stderr when done.
+        Returns 1 if an error occurred, 0 otherwise.
+        """
+        if isinstance(script, string_types):
+            with open(script, 'rt') as f:
+                return self.runscript(f, stop_on_error)
+
+        run = ScriptRun(self, stop_on_error)
+        with run:
+            for line in run.lines(script):
+                try:
+                    line = self.precmd(line)
+                    stop = self.onecmd(line)
+                    stop = self.postcmd(stop, line)
+                except Exception:
+                    if run.error():
+                        break
+                    continue
+                if stop:
+                    break
+        return run.status
+
     def rejoin(self, args):
         """Rejoin command line arguments."""
+        quote = get_quoter(FILENAME_QUOTE_CHARACTERS)
         line = []
         for arg in args:
             if not is_fully_quoted(arg, FILENAME_QUOTE_CHARACTERS):
-                arg = backslash_quote(arg, FILENAME_QUOTE_CHARACTERS)
+                arg = quote(arg)
             line.append(arg)
         return ' '.join(line)
 
+    def splitargs(self, args):
+        """Split command arguments into a list of dequoted words.
+        Uses the same quote characters regardless of the completer
+        configuration, like :meth:`~kmd.Kmd.rejoin` does.
+        """
+        return split_words(args, QUOTE_CHARACTERS, FILENAME_QUOTE_CHARACTERS)
+
     def __getattr__(self, name):
         """Expand aliases and incomplete command names."""
         if name[:3] == 'do_':
@@ -392,15 +655,88 @@ class Kmd(cmd.Cmd, object):
             prefix, cmd = name[:5], name[5:]
         else:
             raise AttributeError(name)
-        names = self.get_names()
-        expanded = prefix + self.aliases.get(cmd, cmd)
-        if expanded in names:
+        expanded = self.get_index().expand(prefix, cmd, self.aliases)
+        if expanded is not None:
+            if self.plugins is not None and prefix == 'do_':
+                if expanded not in self.__dict__ and not hasattr(self.__class__, expanded):
+                    # Load the plugin and cache the bound method
+                    dofunc = self.plugins.bind(expanded[3:], self)
+                    self.__dict__[expanded] = dofunc
+                    return dofunc
             return getattr(self, expanded)
-        expanded = set(x for x in names if x.startswith(name))
-        if len(expanded) == 1:
-            return getattr(self, expanded.pop())
         raise AttributeError(name)
 
+    def get_names(self):
+        """Return the attribute names of the class, plus a ``do_`` name for
+        each plugin command.
+        """
+        names = super(Kmd, self).get_names()
+        if self.plugins is not None:
+            names.extend('do_' + x for x in self.plugins.names())
+        return names
+
+    def build_dispatch_table(self):
+        """Build the :attr:`~kmd.Kmd.dispatch_table`, mapping command names,
+        aliases, and unique abbreviations to bound :meth:`do_\<command\>` methods.
+        Called automatically on first use, and again when commands are
+        added to or removed from the class or the aliases change.
+        """
+        index = self.get_index()
+        names = index.tables['do_']
+        table = {}
+        # Unique abbreviations differ from both neighbors in the sorted list
+        for i, name in enumerate(names):
+            dofunc = self.get_dispatch_func(name)
+            shared = 0
+            for other in names[i-1:i] + names[i+1:i+2]:
+                shared = max(shared, common_prefix_length(name, other))
+            for j in range(shared + 1, len(name)):
+                table[name[:j]] = dofunc
+        for alias, name in self.aliases.items():
+            if 'do_' + name in index:
+                table[alias] = self.get_dispatch_func(name)
+        for name in names:
+            table[name] = self.get_dispatch_func(name)
+        global _dispatch_shells
+        if _dispatch_shells is None:
+            from weakref import WeakSet
+            _dispatch_shells = WeakSet()
+        _dispatch_shells.add(self)
+        self.dispatch_table = table
+
+    @property
+    def aliases(self):
+        """Dictionary mapping alias names to command names.
+        Assigned dictionaries are converted to :class:`~kmd.kmd.Aliases`.
+        """
+        return self._aliases
+
+    @aliases.setter
+    def aliases(self, value):
+        if not isinstance(value, Aliases):
+            value = Aliases(value)
+        self._aliases = value
+        self.dispatch_table = None
+
+    def get_dispatch_func(self, name):
+        """Return the :attr:`~kmd.Kmd.dispatch_table` entry for command ``name``.
+        Plugin commands are loaded when first called.
+        """
+        if (self.plugins is not None and name in self.plugins and
+            not hasattr(self.__class__, 'do_' + name)):
+            def dofunc(arg):
+                return getattr(self, 'do_' + name)(arg)
+            return dofunc
+        return getattr(self, 'do_' + name)
+
+    def get_index(self):
+        """Return the :class:`~kmd.index.CommandIndex` of this class.
+        The index is built on first use and rebuilt when methods are
+        added to the class.
+        """
+        from kmd.index import get_index
+        return get_index(self)
+
     def clear_hooks(self):
         """Clear all completer callbacks and hooks."""
         completer.completer = None
@@ -418,6 +754,78 @@ class Kmd(cmd.Cmd, object):
         completer.ignore_some_completions_function = None
 
 
+class ScriptRun(object):
+    """Bookkeeping for :meth:`~kmd.Kmd.runscript`.
+
+    Entering the run calls :meth:`~kmd.Kmd.preloop` with
+    :attr:`use_rawinput` turned off. Leaving it calls
+    :meth:`~kmd.Kmd.postloop` and reports the number of lines
+    per second to stderr.
+    """
+
+    def __init__(self, shell, stop_on_error=False):
+        self.shell = shell
+        self.stop_on_error = stop_on_error
+        self.status = 0
+        self.count = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.use_rawinput = self.shell.use_rawinput
+        self.shell.use_rawinput = False
+        self.shell.preloop()
+        self.start = timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.seconds = timer() - self.start
+            self.shell.postloop()
+        finally:
+            self.shell.use_rawinput = self.use_rawinput
+        if exc_info[0] is None:
+            rate = self.count / self.seconds if self.seconds else 0.0
+            self.shell.stderr.write('%d lines in %.3f seconds (%.0f lines/sec)\n' % (
+                self.count, self.seconds, rate))
+
+    def lines(self, script):
+        """Yield the lines of ``script`` without line endings."""
+        for line in script:
+            self.count += 1
+            yield line.rstrip('\r\n')
+
+    def error(self):
+        """Report the current exception.
+        Returns True if execution should stop.
+        """
+        import traceback
+        self.status = 1
+        error = traceback.format_exception_only(*sys.exc_info()[:2])
+        self.shell.stderr.write('*** Error in line %d: %s' % (self.count, error[-1]))
+        return self.stop_on_error
+
+
+_ident_patterns = {}
+
+
+def get_ident_pattern(identchars):
+    """Return a regex matching a run of ``identchars``."""
+    pattern = _ident_patterns.get(identchars)
+    if pattern is None:
+        chars = ''.join(re.escape(c) for c in sorted(set(identchars)))
+        pattern = re.compile(chars and '[%s]*' % chars or '')
+        _ident_patterns[identchars] = pattern
+    return pattern
+
+
+def common_prefix_length(a, b):
+    """Return the length of the common prefix of ``a`` and ``b``."""
+    i, n = 0, min(len(a), len(b))
+    while i < n and a[i] == b[i]:
+        i = i+1
+    return i
+
+
 def main(args=None):
     shell = Kmd()
     return shell.run(args)
@@ -0,0 +1,167 @@
+"""Parallel batch execution.
+
+A :class:`~kmd.parallel.ParallelRunner` executes independent command
+lines in a pool of worker processes. Each worker creates one instance
+of the shell class and runs its :meth:`~kmd.Kmd.preloop` once; the
+instance then executes every line sent to the worker. Outputs are
+returned in input order::
+
+    from kmd.parallel import ParallelRunner
+    from myshell import MyShell
+
+    runner = ParallelRunner(MyShell, processes=8, chunksize=64)
+    with open('commands.txt') as f:
+        runner.run(f)
+
+The shell class must be importable by the worker processes.
+Command lines cannot depend on each other, and the stop flag returned
+by commands is ignored.
+"""
+
+from __future__ import absolute_import
+
+import sys
+import time
+import traceback
+import multiprocessing
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from multiprocessing.util import Finalize
+
+timer = getattr(time, 'perf_counter', time.time)
+
+_shell = None
+
+
+class BatchResult(object):
+    """The outcome of executing a command line."""
+
+    def __init__(self, number, line, stdout, stderr, error):
+        self.number = number
+        self.line = line
+        self.stdout = stdout
+        self.stderr = stderr
+        self.error = error
+
+    def __repr__(self):
+        return '<BatchResult %d %r>' % (self.number, self.line)
+
+
+def init_worker(shell_class):
+    """Create the worker's shell and run its preloop.
+    The postloop runs when the worker exits.
+    """
+    global _shell
+    _shell = shell_class(stdout=StringIO(), stderr=StringIO())
+    _shell.use_rawinput = False
+    _shell.preloop()
+    Finalize(_shell, _shell.postloop, exitpriority=10)
+
+
+def execute(item):
+    """Execute a numbered command line in the worker's shell."""
+    number, line = item
+    shell = _shell
+    shell.stdout = StringIO()
+    shell.stderr = StringIO()
+    error = False
+    try:
+        line = shell.precmd(line)
+        stop = shell.onecmd(line)
+        shell.postcmd(stop, line)
+    except Exception:
+        error = True
+        exc = traceback.format_exception_only(*sys.exc_info()[:2])
+        shell.stderr.write('*** Error in line %d: %s' % (number, exc[-1]))
+    return BatchResult(number, line, shell.stdout.getvalue(), shell.stderr.getvalue(), error)
+
+
+class ParallelRunner(object):
+    """Execute command lines with instances of ``shell_class`` in
+    ``processes`` worker processes, which defaults to the number
+    of CPUs. Lines are sent to the workers in chunks of ``chunksize``.
+    """
+
+    def __init__(self, shell_class, processes=None, chunksize=1):
+        self.shell_class = shell_class
+        self.processes = processes
+        self.chunksize = chunksize
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    @property
+    def rate(self):
+        """Lines per second achieved by the last batch."""
+        return self.count / self.seconds if self.seconds else 0.0
+
+    def map(self, lines):
+        """Execute ``lines`` and yield a :class:`~kmd.parallel.BatchResult`
+        for each, in input order.
+        """
+        self.count = self.errors = 0
+        self.seconds = 0.0
+        items = enumerate((line.rstrip('\r\n') for line in lines), 1)
+        start = timer()
+        pool = multiprocessing.Pool(self.processes, init_worker, (self.shell_class,))
+        try:
+            for result in pool.imap(execute, items, self.chunksize):
+                self.count += 1
+                if result.error:
+                    self.errors += 1
+                yield result
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            # Joining runs the workers' postloops
+            pool.join()
+            self.seconds = timer() - start
+
+    def run(self, lines, stdout=None, stderr=None):
+        """Execute ``lines``, writing their output to ``stdout`` and
+        ``stderr`` in input order.
+        Reports the number of lines per second to stderr when done.
+        Returns 1 if an error occurred, 0 otherwise.
+        """
+        stdout = stdout or sys.stdout
+        stderr = stderr or sys.stderr
+        for result in self.map(lines):
+            stdout.write(result.stdout)
+            stderr.write(result.stderr)
+        stderr.write('%d lines in %.3f seconds (%.0f lines/sec)\n' % (
+            self.count, self.seconds, self.rate))
+        return self.errors and 1 or 0
+
+
+def main(args=None):
+    """Usage: python -m kmd.parallel [--processes <n>] [--chunksize <n>] <module>:<class> [<script>]"""
+    import getopt
+    from kmd.server import load_class
+    if args is None:
+        args = sys.argv[1:]
+    try:
+        options, args = getopt.getopt(args, '', ['processes=', 'chunksize='])
+        config = dict((name[2:], int(value)) for name, value in options)
+    except (getopt.GetoptError, ValueError):
+        args = []
+    if len(args) not in (1, 2):
+        sys.stderr.write(main.__doc__ + '\n')
+        return 2
+    runner = ParallelRunner(load_class(args[0]), **config)
+    try:
+        if len(args) == 2:
+            with open(args[1], 'rt') as f:
+                return runner.run(f)
+        return runner.run(sys.stdin)
+    except KeyboardInterrupt:
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
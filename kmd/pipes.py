@@ -0,0 +1,165 @@
+"""Command pipelines.
+
+The :class:`~kmd.pipes.Pipelines` mixin connects commands with ``|``.
+A command may return a generator of lines or records, which is passed
+on to the next command in the pipeline. Commands decorated with
+:func:`~kmd.pipes.consumer` receive the previous command's output as
+an iterator::
+
+    import kmd
+    from kmd.pipes import Pipelines, consumer
+
+    class MyShell(Pipelines, kmd.Kmd):
+
+        def do_numbers(self, args):
+            for i in range(int(args)):
+                yield i
+
+        @consumer
+        def do_even(self, args, input):
+            for item in input:
+                if item % 2 == 0:
+                    yield item
+
+    MyShell().onecmd('numbers 1000000 | even')
+
+Items are produced one at a time, as the next command asks for them,
+so pipelines run in constant memory regardless of the amount of data
+flowing through them.
+"""
+
+from __future__ import absolute_import
+
+import sys
+import inspect
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd.quoting import QUOTE_CHARACTERS
+from kmd.quoting import char_is_quoted
+
+
+_end = object()
+
+
+def consumer(func):
+    """Decorator marking a command as reading the output of the previous
+    command in a pipeline. The command is called with an iterator as
+    second argument, which is empty if there is no previous command.
+    """
+    def dofunc(self, args):
+        input = self.pipeline_input
+        self.pipeline_input = None
+        if input is None:
+            input = iter(())
+        return func(self, args, input)
+
+    dofunc.__name__ = func.__name__
+    dofunc.__doc__ = func.__doc__
+    dofunc.consumer = True
+    return dofunc
+
+
+def split_pipeline(line):
+    """Split ``line`` at unquoted ``|`` characters."""
+    stages = []
+    start = 0
+    for i, c in enumerate(line):
+        if c == '|' and not char_is_quoted(line, i, QUOTE_CHARACTERS):
+            stages.append(line[start:i])
+            start = i+1
+    stages.append(line[start:])
+    return stages
+
+
+class Pipelines(object):
+    """Mixin adding command pipelines to a :class:`~kmd.Kmd` subclass.
+
+    A command line containing unquoted ``|`` characters is executed as a
+    pipeline. Generators returned by commands are consumed by the next
+    command, or written to stdout one item per line by the last command.
+    Output written to stdout by commands other than the last is
+    buffered and passed on as lines, including output written while a
+    generator is being consumed.
+    """
+
+    pipeline_input = None
+
+    def onecmd(self, line):
+        """Interpret a command line.
+        If the line contains unquoted ``|`` characters execute it as a pipeline.
+        """
+        stripped = line.strip()
+        if stripped[:1] == '#' or stripped[:1] in self.shell_escape_chars:
+            stages = [line]
+        else:
+            stages = split_pipeline(line)
+        if len(stages) > 1:
+            if not all(x.strip() for x in stages):
+                return self.default(stripped)
+            return self.pipeline(stages, stripped)
+        result = super(Pipelines, self).onecmd(line)
+        if inspect.isgenerator(result):
+            self.write_items(result)
+            return None
+        return result
+
+    def pipeline(self, stages, line):
+        """Execute the commands in ``stages``, connecting the output of
+        each command to the input of the next.
+        """
+        onecmd = super(Pipelines, self).onecmd
+        input = None
+        try:
+            for stage in stages[:-1]:
+                self.pipeline_input = input
+                stdout = self.stdout
+                self.stdout = StringIO()
+                try:
+                    result = onecmd(stage)
+                    output = self.stdout.getvalue()
+                finally:
+                    self.stdout = stdout
+                if inspect.isgenerator(result):
+                    input = self.redirect_items(result, output)
+                else:
+                    input = iter(output.splitlines())
+            self.pipeline_input = input
+            result = onecmd(stages[-1])
+        finally:
+            self.pipeline_input = None
+        self.lastcmd = line
+        if inspect.isgenerator(result):
+            self.write_items(result)
+            return None
+        return result
+
+    def redirect_items(self, items, output=''):
+        """Iterate over the generator ``items`` with stdout redirected.
+        Lines written to stdout by the generator are passed on
+        before the item it yields next.
+        """
+        for line in output.splitlines():
+            yield line
+        while True:
+            stdout = self.stdout
+            self.stdout = StringIO()
+            try:
+                item = next(items, _end)
+                output = self.stdout.getvalue()
+            finally:
+                self.stdout = stdout
+            for line in output.splitlines():
+                yield line
+            if item is _end:
+                return
+            yield item
+
+    def write_items(self, items):
+        """Write ``items`` to stdout, one item per line."""
+        write = self.stdout.write
+        for item in items:
+            write('%s\n' % (item,))
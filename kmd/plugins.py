@@ -0,0 +1,195 @@
+"""Lazily loaded command plugins.
+
+A plugin command is a function taking the same arguments as a
+:meth:`do_*` method::
+
+    def do_greet(self, args):
+        \"\"\"Usage: greet <name>\"\"\"
+        self.stdout.write('Hello %s\\n' % args)
+
+Plugin commands are declared in a name to module map, or discovered from
+entry points, and attached to a :class:`~kmd.Kmd` subclass via its
+:attr:`~kmd.Kmd.plugins` attribute::
+
+    import kmd
+    from kmd.plugins import PluginRegistry
+
+    class MyShell(kmd.Kmd):
+        plugins = PluginRegistry({'greet': 'myshell.greet:do_greet'})
+
+Command name completion, abbreviation expansion, and the help screen
+work from the registry's metadata. A plugin module is imported when one
+of its commands is first dispatched.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import types
+
+from importlib import import_module
+
+from kmd.index import invalidate
+
+
+def default_cache_dir():
+    """Return the directory for plugin caches."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_home, 'kmd')
+
+
+def path_fingerprint():
+    """Return a value that changes when distributions are installed into
+    or removed from a site directory on ``sys.path``.
+    """
+    fingerprint = []
+    for path in sys.path:
+        if os.path.basename(path) in ('site-packages', 'dist-packages'):
+            try:
+                fingerprint.append([path, os.stat(path).st_mtime])
+            except OSError:
+                pass
+    return fingerprint
+
+
+def iter_entry_points(group):
+    """Yield (name, target) tuples for the entry points in ``group``."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        import pkg_resources
+        for ep in pkg_resources.iter_entry_points(group):
+            yield ep.name, '%s:%s' % (ep.module_name, '.'.join(ep.attrs))
+    else:
+        eps = metadata.entry_points()
+        if hasattr(eps, 'select'):
+            eps = eps.select(group=group)
+        else:
+            eps = eps.get(group, ())
+        for ep in eps:
+            yield ep.name, ep.value
+
+
+class Plugin(object):
+    """A command implemented by function ``target``, given as
+    ``'module:function'``. ``doc`` is the help text, or None if unknown.
+    """
+
+    def __init__(self, name, target, doc=None):
+        self.name = name
+        self.target = target
+        self.doc = doc
+        self.func = None
+
+    def load(self):
+        """Import and return the function implementing the command."""
+        if self.func is None:
+            modname, attr = self.target.split(':', 1)
+            obj = import_module(modname)
+            for part in attr.split('.'):
+                obj = getattr(obj, part)
+            self.func = obj
+            self.doc = obj.__doc__ or ''
+        return self.func
+
+
+class PluginRegistry(object):
+    """A collection of lazily loaded plugin commands.
+
+    ``commands`` maps command names to ``'module:function'`` strings,
+    or to ``('module:function', doc)`` tuples.
+    If an entry point ``group`` is given, its entry points are added as
+    well. The result of entry point discovery is cached in ``cache_file``,
+    which defaults to a file in ``$XDG_CACHE_HOME/kmd``.
+    """
+
+    def __init__(self, commands=None, group=None, cache_file=None):
+        self.plugins = {}
+        self.group = group
+        self.cache_file = cache_file
+        if group and not cache_file:
+            self.cache_file = os.path.join(default_cache_dir(), 'plugins-%s.json' % group)
+        if group:
+            self.discover()
+        for name, target in (commands or {}).items():
+            if isinstance(target, tuple):
+                self.register(name, *target)
+            else:
+                self.register(name, target)
+
+    def __contains__(self, name):
+        return name in self.plugins
+
+    def get(self, name):
+        """Return the :class:`~kmd.plugins.Plugin` for ``name``, or None."""
+        return self.plugins.get(name)
+
+    def names(self):
+        """Return the list of command names."""
+        return list(self.plugins)
+
+    def register(self, name, target, doc=None):
+        """Add the command ``name`` implemented by ``target``."""
+        self.plugins[name] = Plugin(name, target, doc)
+        invalidate()
+
+    def discover(self):
+        """Add the commands found in the entry point group, using the
+        cache file if it is up to date.
+        """
+        fingerprint = path_fingerprint()
+        data = self.read_cache()
+        if data is None or data.get('fingerprint') != fingerprint:
+            commands = {}
+            for name, target in iter_entry_points(self.group):
+                commands[name] = {'target': target, 'doc': None}
+            data = {'fingerprint': fingerprint, 'commands': commands}
+            self.write_cache(data)
+        for name, info in data['commands'].items():
+            self.plugins[name] = Plugin(name, info['target'], info['doc'])
+        invalidate()
+
+    def load(self, name):
+        """Import and return the function implementing ``name``.
+        The docstring of entry point commands is remembered in the cache file.
+        """
+        plugin = self.plugins[name]
+        if plugin.func is None:
+            plugin.load()
+            if self.group:
+                self.update_cache(name, plugin.doc)
+        return plugin.func
+
+    def bind(self, name, shell):
+        """Return the command ``name`` as bound method of ``shell``."""
+        return types.MethodType(self.load(name), shell)
+
+    def read_cache(self):
+        if self.cache_file:
+            try:
+                with open(self.cache_file, 'rt') as f:
+                    return json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+        return None
+
+    def write_cache(self, data):
+        if self.cache_file:
+            try:
+                dirname = os.path.dirname(self.cache_file)
+                if dirname and not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                tmpname = self.cache_file + '.%d' % os.getpid()
+                with open(tmpname, 'wt') as f:
+                    json.dump(data, f)
+                os.rename(tmpname, self.cache_file)
+            except (IOError, OSError):
+                pass
+
+    def update_cache(self, name, doc):
+        data = self.read_cache()
+        if data is not None and name in data.get('commands', {}):
+            data['commands'][name]['doc'] = doc
+            self.write_cache(data)
@@ -0,0 +1,340 @@
+"""Pre-forked session pool.
+
+A :class:`~kmd.prefork.ForkServer` warms the caches of a :class:`~kmd.Kmd`
+subclass in a parent process and forks a pool of worker processes
+that accept connections on a shared socket. Starting a session costs
+no more than waking an idle worker, which inherits the parent's imports
+and caches::
+
+    from kmd.prefork import ForkServer
+    from myshell import MyShell
+
+    server = ForkServer(MyShell, '/tmp/myshell.sock', min_idle=2, max_idle=8)
+    server.serve_forever()
+
+Sessions speak the protocol of :mod:`kmd.server` and are served by
+:mod:`kmd.client`. Unlike sessions of a :class:`~kmd.server.KmdServer`,
+every session runs in a process of its own. Workers exit after
+``max_sessions`` sessions and are replaced by fresh forks of the
+parent. Requires ``os.fork``.
+"""
+
+from __future__ import absolute_import
+
+import os
+import gc
+import sys
+import errno
+import socket
+import select
+import signal
+import struct
+import threading
+
+from kmd.caching import CompletionCache
+from kmd.server import Session
+from kmd.server import check_address
+from kmd.server import bind_socket
+from kmd.server import remove_socket
+
+#: Messages sent by workers to the parent: pid and state.
+STATUS = struct.Struct('=iB')
+
+IDLE = 0
+BUSY = 1
+RETIRING = 2
+
+
+def retry(func, *args):
+    """Call ``func`` until it is not interrupted by a signal."""
+    while True:
+        try:
+            return func(*args)
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+
+class ForkServer(object):
+    """Serve sessions of ``shell_class`` on ``address`` from a pool of
+    pre-forked worker processes. ``address`` is either the path of a
+    Unix domain socket or a (host, port) tuple for TCP. TCP addresses
+    must be on a loopback interface.
+
+    The pool keeps at least ``min_idle`` and at most ``max_idle``
+    workers waiting for connections, and no more than ``max_workers``
+    workers in total. A worker exits after ``max_sessions`` sessions;
+    0 means never.
+    """
+
+    min_idle = 2
+    max_idle = 8
+    max_workers = 64
+    max_sessions = 100
+
+    def __init__(self, shell_class, address, min_idle=None, max_idle=None,
+                 max_workers=None, max_sessions=None):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError('ForkServer requires os.fork')
+        check_address(address)
+        self.shell_class = shell_class
+        self.address = address
+        # Workers inherit the server object but don't own the socket file
+        self.owner = os.getpid()
+        if min_idle is not None:
+            self.min_idle = min_idle
+        if max_idle is not None:
+            self.max_idle = max_idle
+        if max_workers is not None:
+            self.max_workers = max_workers
+        if max_sessions is not None:
+            self.max_sessions = max_sessions
+        if not 0 < self.min_idle <= self.max_idle <= self.max_workers:
+            raise ValueError('Expected 0 < min_idle <= max_idle <= max_workers')
+        self.completion_cache = CompletionCache()
+        self.workers = {}
+        self.controls = {}
+        self.sessions = 0
+        self.spawned = 0
+        self.running = True
+        self.stopped = threading.Event()
+        self.stopped.set()
+        self.status_r, self.status_w = os.pipe()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+
+        if isinstance(address, tuple):
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            remove_socket(address)
+        bind_socket(self.socket, address)
+        self.socket.listen(128)
+        # Idle workers wait in select and race for accept
+        self.socket.setblocking(False)
+
+    @property
+    def server_address(self):
+        """The address the server is bound to."""
+        return self.socket.getsockname()
+
+    @property
+    def idle(self):
+        """The number of idle workers."""
+        return len([x for x in self.workers.values() if x == IDLE])
+
+    def make_shell(self, stdin, stdout, stderr):
+        """Return a new shell for a session."""
+        shell = self.shell_class(stdin=stdin, stdout=stdout, stderr=stderr)
+        shell.use_rawinput = False
+        shell.completion_cache = self.completion_cache
+        return shell
+
+    def warm(self):
+        """Prepare the shell class before workers are forked.
+        Builds the command index and imports all plugin commands.
+        Override to warm application caches as well.
+        """
+        shell = self.make_shell(sys.stdin, sys.stdout, sys.stderr)
+        shell.get_index()
+        if shell.plugins is not None:
+            for name in shell.plugins.names():
+                shell.plugins.load(name)
+
+    def serve_forever(self, poll_interval=0.5):
+        """Warm up, fork workers, and maintain the pool until
+        :meth:`shutdown` is called.
+        """
+        self.stopped.clear()
+        try:
+            self.warm()
+            while self.running:
+                self.reap()
+                self.adjust()
+                ready = retry(select.select, [self.status_r, self.wakeup_r], [], [], poll_interval)[0]
+                if self.status_r in ready:
+                    self.read_status()
+                if self.wakeup_r in ready:
+                    os.read(self.wakeup_r, 512)
+        finally:
+            self.stop_workers()
+            self.stopped.set()
+
+    def start(self, poll_interval=0.5):
+        """Maintain the pool in a background thread."""
+        self.stopped.clear()
+        thread = threading.Thread(target=self.serve_forever, args=(poll_interval,))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        """Stop :meth:`serve_forever`, terminate the workers, and close
+        the socket.
+        """
+        self.running = False
+        os.write(self.wakeup_w, b'x')
+        self.stopped.wait()
+        self.close()
+
+    def close(self):
+        """Close the socket."""
+        self.socket.close()
+        for fd in (self.status_r, self.status_w, self.wakeup_r, self.wakeup_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if not isinstance(self.address, tuple) and os.getpid() == self.owner:
+            remove_socket(self.address)
+
+    def adjust(self):
+        """Fork or retire workers to keep the number of idle workers
+        between ``min_idle`` and ``max_idle``.
+        """
+        idle = sorted(pid for pid, state in self.workers.items() if state == IDLE)
+        for i in range(self.min_idle - len(idle)):
+            if len(self.workers) >= self.max_workers:
+                break
+            self.spawn()
+        for pid in idle[:max(0, len(idle) - self.max_idle)]:
+            self.retire(pid)
+
+    def spawn(self):
+        """Fork a new worker."""
+        control_r, control_w = os.pipe()
+        if hasattr(gc, 'freeze'):
+            # Keep the worker's garbage collector from touching shared pages
+            gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                os.close(control_w)
+                self.run_worker(control_r)
+                status = 0
+            finally:
+                # Never return into the parent's code
+                os._exit(status)
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+        os.close(control_r)
+        self.workers[pid] = IDLE
+        self.controls[pid] = control_w
+        self.spawned += 1
+        return pid
+
+    def retire(self, pid):
+        """Ask worker ``pid`` to exit when it is done with its session."""
+        self.workers[pid] = RETIRING
+        os.close(self.controls.pop(pid))
+
+    def reap(self):
+        """Forget workers that have exited."""
+        for pid in list(self.workers):
+            try:
+                done = os.waitpid(pid, os.WNOHANG)[0]
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                done = pid
+            if done:
+                del self.workers[pid]
+                if pid in self.controls:
+                    os.close(self.controls.pop(pid))
+
+    def read_status(self):
+        data = os.read(self.status_r, STATUS.size * 512)
+        for i in range(0, len(data) - STATUS.size + 1, STATUS.size):
+            pid, state = STATUS.unpack(data[i:i+STATUS.size])
+            if state == BUSY:
+                self.sessions += 1
+            if self.workers.get(pid) in (IDLE, BUSY):
+                self.workers[pid] = state
+
+    def stop_workers(self):
+        for pid in list(self.controls):
+            os.close(self.controls.pop(pid))
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+                retry(os.waitpid, pid, 0)
+            except OSError:
+                pass
+        self.workers.clear()
+
+    def report(self, state):
+        os.write(self.status_w, STATUS.pack(os.getpid(), state))
+
+    def run_worker(self, control):
+        """Serve sessions until ``max_sessions`` is reached or the parent
+        closes the ``control`` pipe.
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        for fd in list(self.controls.values()) + [self.status_r, self.wakeup_r, self.wakeup_w]:
+            os.close(fd)
+        self.controls = {}
+        self.workers = {}
+        sessions = 0
+        while not self.max_sessions or sessions < self.max_sessions:
+            ready = retry(select.select, [self.socket, control], [], [])[0]
+            if control in ready:
+                break
+            try:
+                conn, address = self.socket.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    # Another worker got the connection
+                    continue
+                raise
+            self.report(BUSY)
+            try:
+                conn.setblocking(True)
+                Session(conn, address, self)
+            except (IOError, OSError):
+                pass
+            finally:
+                conn.close()
+            sessions += 1
+            if not self.max_sessions or sessions < self.max_sessions:
+                self.report(IDLE)
+
+
+def main(args=None):
+    """Usage: python -m kmd.prefork [--min-idle <n>] [--max-idle <n>] [--max-workers <n>]
+                           [--max-sessions <n>] [<module>:<class>] <socket-path> | <host>:<port>
+    """
+    import getopt
+    from kmd.server import load_class
+    from kmd.server import parse_address
+    if args is None:
+        args = sys.argv[1:]
+    try:
+        options, args = getopt.getopt(args, '', ['min-idle=', 'max-idle=', 'max-workers=', 'max-sessions='])
+        config = dict((name[2:].replace('-', '_'), int(value)) for name, value in options)
+    except (getopt.GetoptError, ValueError):
+        args = []
+    if len(args) not in (1, 2):
+        sys.stderr.write(main.__doc__.strip() + '\n')
+        return 2
+    if len(args) == 2:
+        shell_class = load_class(args[0])
+    else:
+        from kmd import Kmd
+        shell_class = Kmd
+    try:
+        server = ForkServer(shell_class, parse_address(args[-1]), **config)
+    except (ValueError, RuntimeError) as e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
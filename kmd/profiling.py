@@ -0,0 +1,190 @@
+"""Completion profiling.
+
+Set the environment variable ``KMD_PROFILE_COMPLETION`` to profile
+completion functions. Every call of a ``complete_*`` method,
+:meth:`~kmd.Kmd.completenames`, or :meth:`~cmd.Cmd.completedefault`
+is timed, excluding the time readline
+spends filtering and displaying the matches. A report is written to
+stderr at exit, or, if the variable is set to a file name, exported to
+that file in JSON format::
+
+    $ KMD_PROFILE_COMPLETION=1 python -m kmd.examples.myshell
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import atexit
+import threading
+import types
+
+from kmd.stats import Histogram
+from kmd.stats import timer
+
+ENVIRONMENT_VARIABLE = 'KMD_PROFILE_COMPLETION'
+
+_end = object()
+
+
+class CompleterStat(object):
+    """Statistics of a single completion function."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.matches = 0
+        self.max_matches = 0
+        self.wall = Histogram()
+        self.first_match = Histogram()
+
+    def as_dict(self):
+        """Return a summary suitable for JSON export."""
+        return {
+            'calls': self.calls,
+            'matches': self.matches,
+            'max_matches': self.max_matches,
+            'wall': self.wall.as_dict(),
+            'first_match': self.first_match.as_dict(),
+        }
+
+
+class CompletionProfiler(object):
+    """Records call time, time to first match, and number of matches
+    per completion function.
+    """
+
+    def __init__(self):
+        self.completers = {}
+        self.wrappers = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self.completers
+
+    def get(self, name):
+        """Return the :class:`~kmd.profiling.CompleterStat` for ``name``, or None."""
+        return self.completers.get(name)
+
+    def record(self, name, wall, first_match, matches):
+        """Record one call of completion function ``name``.
+        ``first_match`` is None if the function produced no matches.
+        """
+        with self.lock:
+            stat = self.completers.get(name)
+            if stat is None:
+                stat = self.completers[name] = CompleterStat(name)
+            stat.calls += 1
+            stat.matches += matches
+            stat.max_matches = max(stat.max_matches, matches)
+            stat.wall.add(wall)
+            if first_match is not None:
+                stat.first_match.add(first_match)
+
+    def wrap(self, compfunc, name=None):
+        """Return a profiled version of ``compfunc``.
+        The wrapper returns a generator timing ``compfunc`` as its matches
+        are consumed. Wrappers are reused, so that equal functions map to
+        equal wrappers.
+        """
+        # Key by function so that wrappers do not keep shells alive
+        func = getattr(compfunc, '__func__', compfunc)
+        wrapper = self.wrappers.get(func)
+        if wrapper is None:
+            if name is None:
+                name = getattr(func, '__name__', func.__class__.__name__)
+
+            def wrapper(*args):
+                return self.profile(name, func, args)
+
+            wrapper.__name__ = name
+            self.wrappers[func] = wrapper
+        if func is not compfunc:
+            return types.MethodType(wrapper, compfunc.__self__)
+        return wrapper
+
+    def profile(self, name, func, args):
+        """Iterate over ``func(*args)``, recording the time spent in
+        ``func`` when the iteration ends.
+        """
+        wall = 0.0
+        first_match = None
+        matches = 0
+        try:
+            start = timer()
+            iterator = iter(func(*args))
+            wall += timer() - start
+            while True:
+                start = timer()
+                match = next(iterator, _end)
+                wall += timer() - start
+                if match is _end:
+                    break
+                if first_match is None:
+                    first_match = wall
+                matches += 1
+                yield match
+        finally:
+            self.record(name, wall, first_match, matches)
+
+    def clear(self):
+        """Forget all statistics."""
+        with self.lock:
+            self.completers.clear()
+
+    def as_dict(self):
+        """Return a dict mapping completion function names to summaries."""
+        return dict((name, stat.as_dict()) for name, stat in self.completers.items())
+
+    def export(self, filename):
+        """Write the statistics to ``filename`` in JSON format."""
+        with open(filename, 'wt') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    def format(self):
+        """Return the statistics as a table with times in milliseconds."""
+        names = sorted(self.completers)
+        width = max([len('completer')] + [len(x) for x in names])
+        lines = ['%-*s %7s %9s %9s %9s %9s %9s' % (
+            width, 'completer', 'calls', 'matches', 'first', 'p50', 'p95', 'p99')]
+        for name in names:
+            stat = self.completers[name]
+            first_match = stat.first_match.quantile(0.5)
+            lines.append('%-*s %7d %9.1f %9.3f %9.3f %9.3f %9.3f' % (
+                width, name, stat.calls, float(stat.matches) / stat.calls,
+                (first_match or 0.0) * 1000,
+                stat.wall.quantile(0.5) * 1000,
+                stat.wall.quantile(0.95) * 1000,
+                stat.wall.quantile(0.99) * 1000))
+        return '\n'.join(lines) + '\n'
+
+    def report(self, target):
+        """Write the report to stderr if ``target`` is '1' or '-',
+        else export it to the file ``target``.
+        """
+        if not self.completers:
+            return
+        if target in ('1', '-'):
+            sys.stderr.write(self.format())
+        else:
+            self.export(target)
+
+
+_profiler = None
+
+
+def get_profiler():
+    """Return the process-wide :class:`~kmd.profiling.CompletionProfiler` if
+    ``KMD_PROFILE_COMPLETION`` is set, else None.
+    The report is written at exit.
+    """
+    global _profiler
+    target = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not target:
+        return None
+    if _profiler is None:
+        _profiler = CompletionProfiler()
+        atexit.register(_profiler.report, target)
+    return _profiler
@@ -1,7 +1,11 @@
 """String and filename quoting support."""
 
 import os
+import re
 import sys
+import threading
+
+from collections import OrderedDict
 
 from rl import completer
 from rl import completion
@@ -43,20 +47,103 @@ WHITESPACE_CHARACTERS = BASH_WHITESPACE_CHARACTERS
 SLASHIFY_IN_QUOTES = BASH_SLASHIFY_IN_QUOTES
 
 
+_quoters = {}
+_dequoters = {}
+
+#: Matches each backslash and captures the character following it.
+ESCAPED_CHARACTER = re.compile(r'\\(?=(.))', re.S)
+
+
+def char_set_key(chars):
+    if isinstance(chars, (set, frozenset)):
+        return ''.join(sorted(chars))
+    return chars
+
+
+def get_quoter(chars):
+    """Return a function backslash-quoting ``chars`` in its argument.
+    Functions are cached per character set.
+    """
+    key = char_set_key(chars)
+    quoter = _quoters.get(key)
+    if quoter is None:
+        if chars:
+            search = re.compile('[%s]' % ''.join(re.escape(c) for c in sorted(set(chars)))).search
+        else:
+            search = lambda text: None
+        quote_backslash = '\\' in chars
+        others = [c for c in chars if c != '\\']
+
+        def quoter(text):
+            # Most names contain none of the characters
+            if search(text) is None:
+                return text
+            if quote_backslash and '\\' in text:
+                text = text.replace('\\', '\\\\')
+            for c in others:
+                if c in text:
+                    text = text.replace(c, '\\'+c)
+            return text
+
+        _quoters[key] = quoter
+    return quoter
+
+
+def get_dequoter(chars=None):
+    """Return a function backslash-dequoting ``chars`` in its argument.
+    If ``chars`` is None, use the default characters of
+    :func:`~kmd.quoting.backslash_dequote`. Functions are cached per
+    character set.
+    """
+    if chars is None:
+        key = (completer.filename_quote_characters,)
+    else:
+        key = char_set_key(chars)
+    dequoter = _dequoters.get(key)
+    if dequoter is None:
+        if chars is None:
+            chars = set(completer.filename_quote_characters).union(BASH_FILENAME_QUOTE_CHARACTERS)
+        dequote_backslash = '\\' in chars
+        others = [c for c in chars if c != '\\']
+        if len(set(others)) == len(others):
+            # Quoted characters cannot overlap, so the order of
+            # replacements does not matter
+            others = frozenset(others)
+        findall = ESCAPED_CHARACTER.findall
+        many = len(others) * 4
+
+        def dequoter(text):
+            if '\\' not in text:
+                return text
+            if dequote_backslash:
+                text = text.replace('\\\\', '\\')
+            if text.count('\\') > many:
+                # Finding the quoted characters would cost more
+                # than trying them all
+                candidates = others
+            elif isinstance(others, frozenset):
+                # Only replace characters that actually occur quoted
+                candidates = others.intersection(findall(text))
+            else:
+                escaped = set(findall(text))
+                candidates = [c for c in others if c in escaped]
+            for c in candidates:
+                text = text.replace('\\'+c, c)
+            return text
+
+        _dequoters[key] = dequoter
+    return dequoter
+
+
 def backslash_dequote(text, chars=''):
     """Backslash-dequote all
     :attr:`rl.completer.filename_quote_characters <rl:rl.Completer.filename_quote_characters>`
     in ``text``.
     If ``chars`` is given, only characters in ``chars`` are dequoted.
     """
-    if not chars:
-        chars = set(completer.filename_quote_characters).union(BASH_FILENAME_QUOTE_CHARACTERS)
-    if '\\' in chars:
-        text = text.replace('\\\\', '\\')
-    for c in chars:
-        if c != '\\':
-            text = text.replace('\\'+c, c)
-    return text
+    if '\\' not in text:
+        return text
+    return get_dequoter(chars or None)(text)
 
 
 def backslash_quote(text, chars=''):
@@ -67,12 +154,7 @@ def backslash_quote(text, chars=''):
     """
     if not chars:
         chars = completer.filename_quote_characters
-    if '\\' in chars:
-        text = text.replace('\\', '\\\\')
-    for c in chars:
-        if c != '\\':
-            text = text.replace(c, '\\'+c)
-    return text
+    return get_quoter(chars)(text)
 
 
 def is_fully_quoted(text, chars=''):
@@ -98,41 +180,137 @@ def is_fully_quoted(text, chars=''):
     return True
 
 
-def char_is_quoted(text, index):
-    """Return True if the character at ``index`` is quoted."""
-    skip_next = False
-    quote_char = ''
-    for i in range(index):
-        c = text[i]
-        if skip_next:
-            skip_next = False
-        elif quote_char != "'" and c == '\\':
-            skip_next = True
-            if i == index-1:
-                return True
-        elif quote_char != '':
-            if c == quote_char:
-                quote_char = ''
-        elif c in completer.quote_characters:
-            quote_char = c
-    # A closing quote character is never quoted
-    if index < len(text) and text[index] == quote_char:
-        return False
-    return bool(quote_char)
+class QuoteScanner(object):
+    """The quoting state of every position in ``text``, computed in a
+    single pass. The scanner can be extended as characters are appended
+    to the text, and answers queries in constant time.
+    """
 
+    def __init__(self, text='', quote_characters=None):
+        if quote_characters is None:
+            quote_characters = completer.quote_characters
+        self.quote_characters = quote_characters
+        self.text = text[:0]
+        # The state at each position: the open quote character and
+        # whether the character is backslash-quoted
+        self.states = bytearray(1)
+        self.escapes = bytearray(1)
+        self.quote_char = ''
+        self.skip_next = False
+        self.escape_next = False
+        self.extend(text)
+
+    def copy(self, size=None):
+        """Return a scanner for the first ``size`` characters of the text."""
+        if size is None:
+            size = len(self.text)
+        scanner = self.__class__(self.text[:0], self.quote_characters)
+        scanner.text = self.text[:size]
+        scanner.states = self.states[:size+1]
+        scanner.escapes = self.escapes[:size+1]
+        state = scanner.states[size]
+        scanner.quote_char = state > 1 and self.quote_characters[(state >> 1) - 1] or ''
+        scanner.skip_next = bool(state & 1)
+        scanner.escape_next = bool(scanner.escapes[size])
+        return scanner
+
+    def extend(self, text):
+        """Scan the characters appended to the text. ``text`` must start
+        with the current text.
+        """
+        quote_characters = self.quote_characters
+        quote_char = self.quote_char
+        skip_next = self.skip_next
+        escape_next = self.escape_next
+        append_state = self.states.append
+        append_escape = self.escapes.append
+        state = self.states[-1] & ~1
+        for c in text[len(self.text):]:
+            if escape_next:
+                escape_next = False
+            elif c == '\\':
+                escape_next = True
+            if skip_next:
+                skip_next = False
+            elif quote_char != "'" and c == '\\':
+                skip_next = True
+            elif quote_char != '':
+                if c == quote_char:
+                    quote_char = ''
+                    state = 0
+            elif c in quote_characters:
+                quote_char = c
+                state = (quote_characters.index(c) + 1) << 1
+            append_state(state | skip_next)
+            append_escape(escape_next)
+        self.text = text
+        self.quote_char = quote_char
+        self.skip_next = skip_next
+        self.escape_next = escape_next
+
+    def is_quoted(self, index):
+        """Return True if the character at ``index`` is quoted."""
+        if index < 0:
+            return False
+        state = self.states[index]
+        if state & 1:
+            return True
+        if state < 2:
+            return False
+        # A closing quote character is never quoted
+        quote_char = self.quote_characters[(state >> 1) - 1]
+        return not (index < len(self.text) and self.text[index] == quote_char)
+
+    def is_backslash_quoted(self, index):
+        """Return True if the character at ``index`` is backslash-quoted."""
+        if index < 0:
+            return False
+        return bool(self.escapes[index])
 
-def char_is_backslash_quoted(text, index):
-    """Return True if the character at ``index`` is backslash-quoted."""
-    skip_next = False
-    for i in range(index):
-        c = text[i]
-        if skip_next:
-            skip_next = False
-        elif c == '\\':
-            skip_next = True
-            if i == index-1:
-                return True
-    return False
+
+_scanner = None
+_scanner_lock = threading.Lock()
+
+
+def get_scanner(text, quote_characters=None):
+    """Return a :class:`~kmd.quoting.QuoteScanner` for ``text``.
+    The last scanner is remembered and reused when the text grows or
+    shrinks at the end, as it does while the user is typing.
+    ``quote_characters`` defaults to the readline completer's.
+    """
+    global _scanner
+    if quote_characters is None:
+        quote_characters = completer.quote_characters
+    with _scanner_lock:
+        scanner = _scanner
+        if scanner is None or scanner.quote_characters != quote_characters:
+            scanner = QuoteScanner(text, quote_characters)
+        elif scanner.text == text:
+            return scanner
+        elif text.startswith(scanner.text):
+            # Scanners may be in use by other threads
+            scanner = scanner.copy()
+            scanner.extend(text)
+        elif scanner.text.startswith(text):
+            scanner = scanner.copy(len(text))
+        else:
+            scanner = QuoteScanner(text, quote_characters)
+        _scanner = scanner
+        return scanner
+
+
+def char_is_quoted(text, index, quote_characters=None):
+    """Return True if the character at ``index`` is quoted.
+    ``quote_characters`` defaults to the readline completer's.
+    """
+    return get_scanner(text, quote_characters).is_quoted(index)
+
+
+def char_is_backslash_quoted(text, index, quote_characters=None):
+    """Return True if the character at ``index`` is backslash-quoted.
+    ``quote_characters`` defaults to the readline completer's.
+    """
+    return get_scanner(text, quote_characters).is_backslash_quoted(index)
 
 
 def backslash_dequote_string(text, quote_char=''):
@@ -232,3 +410,263 @@ def backslash_quote_filename(text, single_match=True, quote_char=''):
             text = backslash_quote(text)
     return text
 
+
+#: Directories with at least this many names to check are listed with
+#: :func:`os.scandir` instead of calling :func:`os.path.isdir` per name.
+SCANDIR_THRESHOLD = 8
+
+
+def find_directories(paths):
+    """Return the set of ``paths`` that are directories.
+    Paths are grouped by parent directory, and each parent with many
+    paths is listed once instead of calling ``stat`` on every path.
+    """
+    scandir = getattr(os, 'scandir', None)
+    groups = {}
+    found = set()
+    for path in paths:
+        head, sep, name = path.rpartition(os.sep)
+        parent = head + sep
+        if name in ('', '.', '..') or scandir is None:
+            if os.path.isdir(path):
+                found.add(path)
+        elif parent in groups:
+            groups[parent].append((name, path))
+        else:
+            groups[parent] = [(name, path)]
+    for parent, names in groups.items():
+        if len(names) < SCANDIR_THRESHOLD:
+            for name, path in names:
+                if os.path.isdir(path):
+                    found.add(path)
+            continue
+        try:
+            # DirEntry.is_dir follows symlinks, like os.path.isdir
+            directories = set(entry.name for entry in scandir(parent or os.curdir) if entry.is_dir())
+        except OSError:
+            continue
+        for name, path in names:
+            if name in directories:
+                found.add(path)
+    return found
+
+
+def quote_filenames(matches, single_match=True, quote_char='', directories=None):
+    """Return a list of ``quote_char``-quoted versions of ``matches``,
+    as returned by :func:`~kmd.quoting.quote_filename` for each match.
+    If ``directories`` is given, it is the set of matches known to be
+    directories, and the file system is not accessed. Otherwise,
+    directories are found with :func:`~kmd.quoting.find_directories`.
+    Unlike :func:`~kmd.quoting.quote_filename`, does not modify
+    :attr:`rl.completion.suppress_quote <rl:rl.Completion.suppress_quote>`.
+    """
+    qc = quote_char or completer.quote_characters[:1]
+    quote = get_quoter(SLASHIFY_IN_QUOTES)
+    expand_tilde = not quote_char and completion.expand_tilde
+    quoted = []
+    needs_closing = []
+    for match in matches:
+        text = match
+        if text:
+            # Don't backslash-quote single-quotes between single-quotes
+            if qc == "'":
+                text = text.replace("'", "'\\''")
+            else:
+                text = quote(text)
+            # Don't add quotes if the filename is already fully quoted
+            if qc == "'" or quote_char or not is_fully_quoted(text):
+                # Quoting inhibits tilde-expansion by the shell so we
+                # must expand any tildes before adding quotes
+                if expand_tilde and text.startswith('~'):
+                    text = expand_tilde(text)
+                if single_match:
+                    needs_closing.append((len(quoted), match, text))
+                text = qc + text
+        quoted.append(text)
+    if needs_closing and not completion.suppress_quote:
+        if directories is None:
+            expanduser = os.path.expanduser
+            paths = [text[:1] == '~' and expanduser(text) or text for i, match, text in needs_closing]
+            found = find_directories(paths)
+            is_directory = [path in found for path in paths]
+        else:
+            is_directory = [match in directories for i, match, text in needs_closing]
+        for (i, match, text), is_dir in zip(needs_closing, is_directory):
+            # Don't append closing quotes to directory names
+            if not is_dir:
+                quoted[i] = quoted[i] + qc
+    return quoted
+
+
+def backslash_quote_filenames(matches, single_match=True, quote_char='', directories=None):
+    """Return a list of backslash-quoted versions of ``matches``.
+    If a ``quote_char`` is given, behave like :func:`~kmd.quoting.quote_filenames`.
+    """
+    # If the user has typed a quote character, use it.
+    if quote_char:
+        return quote_filenames(matches, single_match, quote_char, directories)
+    quote = get_quoter(completer.filename_quote_characters)
+    return [quote(match) for match in matches]
+
+
+class Word(object):
+    """A word of a command line, as found by :func:`~kmd.quoting.tokenize`.
+
+    ``text`` is the word as typed and ``value`` the word with quotes
+    and backslash-quoting removed. ``start`` and ``end`` are the span
+    of the word in the line. ``quote_char`` is the first quote character
+    used in the word, if any, and ``closed`` is False if the word ends
+    in an unclosed quote or a trailing backslash.
+    """
+
+    def __init__(self, text, start, end, value, quote_char='', closed=True):
+        self.text = text
+        self.start = start
+        self.end = end
+        self.value = value
+        self.quote_char = quote_char
+        self.closed = closed
+
+    def __repr__(self):
+        return '<Word %r %d:%d>' % (self.text, self.start, self.end)
+
+
+_segment_patterns = {}
+
+
+def get_segment_pattern(quote_characters):
+    """Return a regex matching runs of whitespace, backslash-quoted
+    characters, quoted strings, and unquoted text.
+    """
+    pattern = _segment_patterns.get(quote_characters)
+    if pattern is None:
+        alternatives = ['[%s]+' % BASH_WHITESPACE_CHARACTERS, r'\\.?']
+        for q in quote_characters:
+            if q == "'":
+                # No backslash-quoting between single-quotes
+                alternatives.append("'[^']*'?")
+            else:
+                q = re.escape(q)
+                alternatives.append(r'%s(?:[^%s\\]|\\.?)*%s?' % (q, q, q))
+        alternatives.append(r'[^%s\\%s]+' % (BASH_WHITESPACE_CHARACTERS,
+            ''.join(re.escape(q) for q in quote_characters)))
+        pattern = re.compile('|'.join(alternatives), re.S)
+        _segment_patterns[quote_characters] = pattern
+    return pattern
+
+
+#: Matches a backslash and the character following it.
+BACKSLASH_QUOTED = re.compile(r'\\(.)', re.S)
+
+
+def dequote_escapes(text, chars):
+    """Remove backslashes quoting characters in ``chars`` from ``text``."""
+    if '\\' not in text:
+        return text
+    return BACKSLASH_QUOTED.sub(lambda m: m.group(1) in chars and m.group(1) or m.group(), text)
+
+
+def is_closed(segment):
+    """Return True if the quoted ``segment`` ends with its closing quote."""
+    if len(segment) < 2 or segment[-1] != segment[0]:
+        return False
+    if segment[0] == "'":
+        return True
+    # The last quote is escaped if preceded by an odd number of backslashes
+    inner = segment[1:-1]
+    return (len(inner) - len(inner.rstrip('\\'))) % 2 == 0
+
+
+def scan_words(line, quote_characters, dequote_characters):
+    """Split ``line`` into a list of :class:`~kmd.quoting.Word` objects."""
+    words = []
+    start = None
+    for m in get_segment_pattern(quote_characters).finditer(line):
+        segment = m.group()
+        c = segment[0]
+        if c in BASH_WHITESPACE_CHARACTERS:
+            if start is not None:
+                words.append(Word(line[start:m.start()], start, m.start(),
+                                  ''.join(value), quote_char, closed))
+                start = None
+            continue
+        if start is None:
+            start = m.start()
+            value = []
+            quote_char = ''
+            closed = True
+        if c == '\\':
+            if len(segment) == 1:
+                closed = False
+            elif segment[1] in dequote_characters:
+                segment = segment[1]
+            value.append(segment)
+        elif c in quote_characters:
+            quote_char = quote_char or c
+            if is_closed(segment):
+                segment = segment[1:-1]
+            else:
+                segment = segment[1:]
+                closed = False
+            if c != "'":
+                segment = dequote_escapes(segment, SLASHIFY_IN_QUOTES + c)
+            value.append(segment)
+        else:
+            value.append(segment)
+    if start is not None:
+        words.append(Word(line[start:], start, len(line), ''.join(value), quote_char, closed))
+    return words
+
+
+_tokens = OrderedDict()
+_tokens_lock = threading.Lock()
+
+#: The number of lines for which :func:`~kmd.quoting.tokenize` remembers
+#: the result.
+TOKENIZE_CACHE_SIZE = 32
+
+
+def tokenize(line, quote_characters=None, filename_quote_characters=None):
+    """Split ``line`` into shell words in a single pass.
+    Returns a tuple of :class:`~kmd.quoting.Word` objects.
+
+    Words are separated by unquoted whitespace. The quote characters
+    default to :attr:`rl.completer.quote_characters <rl:rl.Completer.quote_characters>`,
+    and backslash-quoting is removed from the values like
+    :func:`~kmd.quoting.backslash_dequote_string` does.
+    Results are cached per line.
+    """
+    if quote_characters is None:
+        quote_characters = completer.quote_characters
+    if filename_quote_characters is None:
+        filename_quote_characters = completer.filename_quote_characters
+    key = (line, quote_characters, filename_quote_characters)
+    with _tokens_lock:
+        words = _tokens.pop(key, None)
+        if words is not None:
+            _tokens[key] = words
+            return words
+    words = tuple(scan_words(line, quote_characters,
+        frozenset(filename_quote_characters).union(BASH_FILENAME_QUOTE_CHARACTERS)))
+    with _tokens_lock:
+        _tokens[key] = words
+        while len(_tokens) > TOKENIZE_CACHE_SIZE:
+            _tokens.popitem(last=False)
+    return words
+
+
+def split_words(line, quote_characters=None, filename_quote_characters=None):
+    """Split ``line`` into a list of dequoted words."""
+    return [word.value for word in tokenize(line, quote_characters, filename_quote_characters)]
+
+
+def find_word(line, index):
+    """Return the :class:`~kmd.quoting.Word` of ``line`` containing or
+    ending at ``index``, or None if ``index`` is between words.
+    """
+    for word in tokenize(line):
+        if word.start <= index <= word.end:
+            return word
+        if word.start > index:
+            break
+    return None
@@ -0,0 +1,389 @@
+"""Serving Kmd sessions over sockets.
+
+A :class:`~kmd.server.KmdServer` hosts concurrent sessions of a
+:class:`~kmd.Kmd` subclass in one long-lived process. Each connection
+gets its own shell instance with its own stdin, stdout, and stderr
+streams. Class-level state, like the command index and loaded plugins,
+and the :attr:`~kmd.Kmd.completion_cache` are shared by all sessions::
+
+    from kmd.server import KmdServer
+    from myshell import MyShell
+
+    server = KmdServer(MyShell, '/tmp/myshell.sock')
+    server.serve_forever()
+
+Connect with the client in :mod:`kmd.client`, which provides line
+editing and TAB completion::
+
+    $ python -m kmd.client /tmp/myshell.sock
+
+TCP servers only accept loopback addresses, as anyone able to connect
+can run commands.
+
+Messages are JSON objects, one per line. The client sends
+``{"line": ...}`` to execute a command line, and
+``{"complete": [text, line, begidx, endidx, state]}`` to request
+completions, where ``state`` holds the client's readline quoting state.
+The server sends ``{"completer": {...}}`` with the completer configuration
+when a session starts, ``{"prompt": ...}`` when it is ready for the next line,
+``{"stdout": ...}`` and ``{"stderr": ...}`` for output,
+``{"matches": [...]}`` in response to completion requests, with
+``"filenames": true`` if the matches are filenames,
+``{"readline": true}`` when a command reads from stdin,
+``{"error": ...}`` in response to malformed messages, and
+``{"exit": true}`` when the session ends.
+Unix domain sockets are created with mode 0600.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import stat
+import socket
+import threading
+import traceback
+
+if sys.version_info[0] >= 3:
+    import socketserver
+else:
+    import SocketServer as socketserver
+
+from rl import completer
+from rl import completion
+
+from kmd.caching import CompletionCache
+from kmd.quoting import QUOTE_CHARACTERS
+
+#: Serializes server-side completion, as the readline completion
+#: state is process-global.
+completion_lock = threading.Lock()
+
+#: Readline state sent by the client with completion requests.
+COMPLETION_STATE = ('found_quote', 'quote_character')
+
+
+def is_loopback(host):
+    """Return True if ``host`` only resolves to loopback addresses."""
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.error:
+        return False
+    for family, type, proto, canonname, sockaddr in infos:
+        address = sockaddr[0]
+        if family == socket.AF_INET and address.startswith('127.'):
+            continue
+        if family == getattr(socket, 'AF_INET6', None) and address in ('::1', '::ffff:127.0.0.1'):
+            continue
+        return False
+    return bool(infos)
+
+
+def check_address(address):
+    """Raise ValueError if ``address`` is a TCP address on a
+    non-loopback interface.
+    """
+    if isinstance(address, tuple) and not is_loopback(address[0]):
+        raise ValueError('TCP address must be a loopback address: %r' % (address[0],))
+
+
+def parse_address(address):
+    """Convert ``'host:port'`` to a (host, port) tuple.
+    Socket paths are returned unchanged.
+    """
+    if ':' in address and not os.sep in address:
+        host, port = address.rsplit(':', 1)
+        return (host, int(port))
+    return address
+
+
+def bind_socket(sock, address):
+    """Bind ``sock`` to ``address``. Unix domain sockets are created
+    with mode 0600, so that only the owner can connect.
+    """
+    if isinstance(address, tuple):
+        sock.bind(address)
+        return
+    umask = os.umask(0o177)
+    try:
+        sock.bind(address)
+    finally:
+        os.umask(umask)
+    os.chmod(address, 0o600)
+
+
+def remove_socket(path):
+    """Remove the Unix domain socket at ``path``.
+    Does nothing if ``path`` does not exist or is not a socket.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except OSError:
+        return
+    if stat.S_ISSOCK(mode):
+        os.remove(path)
+
+
+def send(wfile, message, lock=None):
+    """Write ``message`` to ``wfile`` as a line of JSON."""
+    data = (json.dumps(message) + '\n').encode('utf-8')
+    if lock is None:
+        wfile.write(data)
+        wfile.flush()
+    else:
+        with lock:
+            wfile.write(data)
+            wfile.flush()
+
+
+def receive(rfile):
+    """Read a message from ``rfile``. Returns None at end of file.
+    Raises ValueError if the message is not a JSON object.
+    """
+    data = rfile.readline()
+    if not data:
+        return None
+    message = json.loads(data.decode('utf-8'))
+    if not isinstance(message, dict):
+        raise ValueError('Expected a JSON object')
+    return message
+
+
+class SessionOutput(object):
+    """A stream sending everything written to it to the client."""
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+
+    def write(self, text):
+        if text:
+            self.session.send({self.name: text})
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+
+class SessionInput(object):
+    """A stream reading lines from the client."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def readline(self):
+        self.session.send({'readline': True})
+        message = self.session.receive()
+        if message is None or message.get('line') is None:
+            return ''
+        return message['line'] + '\n'
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+class Session(socketserver.StreamRequestHandler):
+    """A connection executing commands in its own shell."""
+
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        send(self.wfile, message, self.lock)
+
+    def receive(self):
+        """Return the next message from the client.
+        Malformed messages are answered with an error and skipped.
+        """
+        while True:
+            try:
+                return receive(self.rfile)
+            except ValueError as e:
+                self.send({'error': 'Malformed message: %s' % (e,)})
+
+    def handle(self):
+        shell = self.server.make_shell(SessionInput(self), SessionOutput(self, 'stdout'),
+                                       SessionOutput(self, 'stderr'))
+        shell.preloop()
+        try:
+            self.send({'completer': self.completer_config(shell)})
+            if shell.intro:
+                shell.stdout.write(str(shell.intro)+'\n')
+            stop = None
+            while not stop:
+                self.send({'prompt': shell.prompt})
+                message = self.receive()
+                while message is not None and 'complete' in message:
+                    self.send(self.complete(shell, *message['complete']))
+                    message = self.receive()
+                if message is None or message.get('line') is None:
+                    # The session ends at end of file, even if do_EOF
+                    # does not stop the shell
+                    self.execute(shell, 'EOF')
+                    break
+                stop = self.execute(shell, message['line'])
+        except (IOError, OSError):
+            # The client went away
+            return
+        finally:
+            shell.postloop()
+        self.send({'exit': True})
+
+    def execute(self, shell, line):
+        """Execute ``line`` in ``shell`` and return the stop flag.
+        Errors are reported to the client.
+        """
+        try:
+            line = shell.precmd(line)
+            stop = shell.onecmd(line)
+            return shell.postcmd(stop, line)
+        except (IOError, OSError):
+            raise
+        except Exception:
+            error = traceback.format_exception_only(*sys.exc_info()[:2])
+            shell.stderr.write('*** %s' % error[-1])
+
+    def completer_config(self, shell):
+        """Return the completer configuration for the client."""
+        shell_escape_chars = ''
+        if hasattr(shell, 'do_shell'):
+            shell_escape_chars = shell.shell_escape_chars
+        return {
+            'quote_characters': completer.quote_characters or QUOTE_CHARACTERS,
+            'shell_escape_chars': shell_escape_chars,
+        }
+
+    def complete(self, shell, text, line, begidx, endidx, state=None):
+        """Return the completions for ``text`` as a ``matches`` message.
+        Completion functions may use readline, so completions are computed
+        one at a time, with the readline state set from the client's.
+        """
+        stripped = len(line) - len(line.lstrip())
+        with completion_lock:
+            completion.line_buffer = line
+            completion.begidx = begidx
+            completion.endidx = endidx
+            completion.filename_completion_desired = False
+            for name in COMPLETION_STATE:
+                if state and name in state:
+                    setattr(completion, name, state[name])
+            try:
+                matches = list(shell.completions(text, line[stripped:], begidx-stripped, endidx-stripped))
+            except Exception:
+                matches = []
+            filenames = completion.filename_completion_desired
+        message = {'matches': matches}
+        if filenames:
+            message['filenames'] = True
+        return message
+
+
+class KmdServer(object):
+    """Serve sessions of ``shell_class`` on ``address``, which is either
+    the path of a Unix domain socket or a (host, port) tuple for TCP.
+    TCP hosts must be loopback addresses.
+
+    ``shell_class`` is called with ``stdin``, ``stdout``, and ``stderr``
+    keyword arguments. Sessions share a :class:`~kmd.caching.CompletionCache`.
+    """
+
+    def __init__(self, shell_class, address):
+        check_address(address)
+        self.shell_class = shell_class
+        self.address = address
+        self.completion_cache = CompletionCache()
+        if isinstance(address, tuple):
+            base = socketserver.TCPServer
+        else:
+            base = socketserver.UnixStreamServer
+            remove_socket(address)
+
+        class Server(socketserver.ThreadingMixIn, base):
+            daemon_threads = True
+            allow_reuse_address = True
+
+            def server_bind(self):
+                if isinstance(self.server_address, tuple):
+                    base.server_bind(self)
+                else:
+                    bind_socket(self.socket, self.server_address)
+                    self.server_address = self.socket.getsockname()
+
+        self.server = Server(address, Session)
+        self.server.make_shell = self.make_shell
+
+    @property
+    def server_address(self):
+        """The address the server is bound to."""
+        return self.server.server_address
+
+    def make_shell(self, stdin, stdout, stderr):
+        """Return a new shell for a session."""
+        shell = self.shell_class(stdin=stdin, stdout=stdout, stderr=stderr)
+        shell.use_rawinput = False
+        shell.completion_cache = self.completion_cache
+        return shell
+
+    def serve_forever(self, poll_interval=0.5):
+        """Handle connections until :meth:`shutdown` is called."""
+        self.server.serve_forever(poll_interval)
+
+    def start(self, poll_interval=0.5):
+        """Handle connections in a background thread."""
+        thread = threading.Thread(target=self.serve_forever, args=(poll_interval,))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        """Stop :meth:`serve_forever` and close the socket."""
+        self.server.shutdown()
+        self.close()
+
+    def close(self):
+        """Close the socket."""
+        self.server.server_close()
+        if not isinstance(self.address, tuple):
+            remove_socket(self.address)
+
+
+def load_class(target):
+    """Import ``'module:Class'`` and return the class."""
+    from importlib import import_module
+    modname, attr = target.split(':', 1)
+    return getattr(import_module(modname), attr)
+
+
+def main(args=None):
+    """Usage: python -m kmd.server [<module>:<class>] <socket-path> | <host>:<port>"""
+    if args is None:
+        args = sys.argv[1:]
+    if len(args) not in (1, 2):
+        sys.stderr.write(main.__doc__ + '\n')
+        return 2
+    if len(args) == 2:
+        shell_class = load_class(args[0])
+    else:
+        from kmd import Kmd
+        shell_class = Kmd
+    try:
+        server = KmdServer(shell_class, parse_address(args[-1]))
+    except ValueError as e:
+        sys.stderr.write('%s\n' % e)
+        return 2
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""Command statistics.
+
+Per-command wall and CPU time, call counts, and error counts are
+recorded by :meth:`~kmd.Kmd.onecmd` when the shell's
+:attr:`~kmd.Kmd.command_stats` attribute is set::
+
+    import kmd
+    from kmd.stats import CommandStats
+
+    shell = kmd.Kmd()
+    shell.command_stats = CommandStats()
+
+The :class:`~kmd.stats.Statistics` mixin does this for you and adds
+a ``stats`` command.
+"""
+
+from __future__ import absolute_import
+
+import json
+import math
+import time
+
+timer = getattr(time, 'perf_counter', time.time)
+cputimer = getattr(time, 'process_time', None) or time.clock
+
+
+class Histogram(object):
+    """A log-linear histogram of durations in seconds.
+
+    Values are counted in buckets growing by a factor of ``2**(1/8)``,
+    giving quantiles within 9% of the exact value at a constant
+    memory cost.
+    """
+
+    resolution = 8
+    min_value = 1e-6
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """Record ``value``."""
+        if value > self.min_value:
+            index = int(math.log(value / self.min_value, 2) * self.resolution) + 1
+        else:
+            index = 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def upper_bound(self, index):
+        return self.min_value * 2 ** (float(index) / self.resolution)
+
+    def quantile(self, q):
+        """Return the approximate ``q`` quantile, where ``0 <= q <= 1``.
+        Returns None if the histogram is empty.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return max(self.min, min(self.max, self.upper_bound(index)))
+        return self.max
+
+    @property
+    def mean(self):
+        """The arithmetic mean, or None if the histogram is empty."""
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def as_dict(self):
+        """Return a summary suitable for JSON export."""
+        return {
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class CommandStat(object):
+    """Statistics of a single command."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.wall = Histogram()
+        self.cpu = Histogram()
+
+    def as_dict(self):
+        """Return a summary suitable for JSON export."""
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'wall': self.wall.as_dict(),
+            'cpu': self.cpu.as_dict(),
+        }
+
+
+class CommandStats(object):
+    """Statistics of all commands executed by a shell."""
+
+    def __init__(self):
+        self.commands = {}
+
+    def __contains__(self, name):
+        return name in self.commands
+
+    def get(self, name):
+        """Return the :class:`~kmd.stats.CommandStat` for ``name``, or None."""
+        return self.commands.get(name)
+
+    def record(self, name, wall, cpu, error=False):
+        """Record one execution of command ``name``."""
+        stat = self.commands.get(name)
+        if stat is None:
+            stat = self.commands[name] = CommandStat(name)
+        stat.calls += 1
+        if error:
+            stat.errors += 1
+        stat.wall.add(wall)
+        stat.cpu.add(cpu)
+
+    def call(self, name, func, arg):
+        """Call ``func(arg)`` and record its execution under ``name``."""
+        error = True
+        start, cpustart = timer(), cputimer()
+        try:
+            result = func(arg)
+            error = False
+            return result
+        finally:
+            self.record(name, timer() - start, cputimer() - cpustart, error)
+
+    def clear(self):
+        """Forget all statistics."""
+        self.commands.clear()
+
+    def as_dict(self):
+        """Return a dict mapping command names to summaries."""
+        return dict((name, stat.as_dict()) for name, stat in self.commands.items())
+
+    def export(self, filename):
+        """Write the statistics to ``filename`` in JSON format."""
+        with open(filename, 'wt') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    def format(self):
+        """Return the statistics as a table with wall times in milliseconds."""
+        names = sorted(self.commands)
+        width = max([len('command')] + [len(x) for x in names])
+        lines = ['%-*s %7s %7s %9s %9s %9s %9s' % (
+            width, 'command', 'calls', 'errors', 'p50', 'p95', 'p99', 'cpu')]
+        for name in names:
+            stat = self.commands[name]
+            lines.append('%-*s %7d %7d %9.3f %9.3f %9.3f %9.3f' % (
+                width, name, stat.calls, stat.errors,
+                stat.wall.quantile(0.5) * 1000,
+                stat.wall.quantile(0.95) * 1000,
+                stat.wall.quantile(0.99) * 1000,
+                stat.cpu.total * 1000))
+        return '\n'.join(lines) + '\n'
+
+
+class Statistics(object):
+    """Mixin adding command statistics to a :class:`~kmd.Kmd` subclass.
+
+    Enables :attr:`~kmd.Kmd.command_stats` and adds the ``stats`` command.
+    If :attr:`stats_file` is set, the statistics are exported to
+    this file in :meth:`postloop`.
+
+    Example::
+
+        import kmd
+        from kmd.stats import Statistics
+
+        class MyShell(Statistics, kmd.Kmd):
+            stats_file = 'stats.json'
+    """
+
+    stats_file = ''
+
+    def __init__(self, *args, **kw):
+        super(Statistics, self).__init__(*args, **kw)
+        self.command_stats = CommandStats()
+
+    def postloop(self):
+        """Export the statistics if :attr:`stats_file` is set."""
+        super(Statistics, self).postloop()
+        if self.stats_file:
+            self.command_stats.export(self.stats_file)
+
+    def do_stats(self, args):
+        """Usage: stats [reset | export <file>]
+
+        Show per-command call counts, error counts, wall time quantiles,
+        and total CPU time in milliseconds.
+        """
+        args = args.split()
+        if not args:
+            self.stdout.write(self.command_stats.format())
+        elif args == ['reset']:
+            self.command_stats.clear()
+        elif args[0] == 'export' and len(args) == 2:
+            self.command_stats.export(args[1])
+        else:
+            self.stderr.write('*** Usage: stats [reset | export <file>]\n')
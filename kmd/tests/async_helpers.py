@@ -0,0 +1,24 @@
+"""Coroutines used by test_asynckmd.
+
+Kept in a separate module because ``async def`` is a syntax error
+on Python 2.
+"""
+
+import asyncio
+
+
+async def run_lines(shell, *lines):
+    for line in lines:
+        await shell.onecmd(line)
+
+
+async def ticker(ticks):
+    while True:
+        ticks.append(1)
+        await asyncio.sleep(0)
+
+
+async def cmdloop_with_ticker(shell, ticks):
+    task = asyncio.ensure_future(ticker(ticks))
+    await shell.cmdloop()
+    task.cancel()
@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+# Test code must remain importable on Python 2
+if sys.version_info >= (3, 7):
+    import asyncio
+    from kmd.asynckmd import AsyncKmd
+    from kmd.tests.async_helpers import run_lines
+    from kmd.tests.async_helpers import cmdloop_with_ticker
+else:
+    AsyncKmd = object
+
+
+class TestKmd(AsyncKmd):
+
+    use_rawinput = False
+
+    def do_echo(self, args):
+        self.stdout.write(args + '\n')
+
+    def do_sleep(self, args):
+        # Returns a coroutine
+        return asyncio.sleep(0, result=None)
+
+    def do_later(self, args):
+        return self.write_later(args)
+
+    def write_later(self, args):
+        future = asyncio.get_running_loop().create_future()
+        def done():
+            self.stdout.write(args + '\n')
+            future.set_result(None)
+        asyncio.get_running_loop().call_soon(done)
+        return future
+
+    def do_fail(self, args):
+        raise ValueError(args)
+
+    def do_quit(self, args):
+        return asyncio.sleep(0, result=True)
+
+    def do_EOF(self, args):
+        return True
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'requires Python 3.7')
+class AsyncKmdTests(unittest.TestCase):
+
+    def test_onecmd_plain(self):
+        shell = TestKmd(stdout=StringIO())
+        result = asyncio.run(shell.onecmd('echo a'))
+        self.assertEqual(result, None)
+        self.assertEqual(shell.stdout.getvalue(), 'a\n')
+
+    def test_onecmd_awaitable(self):
+        shell = TestKmd(stdout=StringIO())
+        asyncio.run(shell.onecmd('later a'))
+        self.assertEqual(shell.stdout.getvalue(), 'a\n')
+
+    def test_onecmd_returns_stop(self):
+        shell = TestKmd(stdout=StringIO())
+        self.assertEqual(asyncio.run(shell.onecmd('quit')), True)
+
+    def test_emptyline(self):
+        shell = TestKmd(stdout=StringIO())
+        asyncio.run(run_lines(shell, 'later a', ''))
+        self.assertEqual(shell.stdout.getvalue(), 'a\na\n')
+
+    def test_default(self):
+        shell = TestKmd(stderr=StringIO())
+        asyncio.run(shell.onecmd('foo'))
+        self.assertEqual(shell.stderr.getvalue(), '*** Unknown syntax: foo\n')
+
+    def test_cmdloop(self):
+        shell = TestKmd(stdin=StringIO('later a\nsleep\nquit\necho b\n'), stdout=StringIO())
+        asyncio.run(shell.cmdloop())
+        self.assertEqual(shell.stdout.getvalue(), '(Kmd) a\n(Kmd) (Kmd) ')
+
+    def test_cmdloop_eof(self):
+        shell = TestKmd(stdin=StringIO('echo a\n'), stdout=StringIO())
+        asyncio.run(shell.cmdloop())
+        self.assertEqual(shell.stdout.getvalue(), '(Kmd) a\n(Kmd) ')
+
+    def test_input_in_daemon_thread(self):
+        threads = []
+        class Input(StringIO):
+            def readline(self):
+                threads.append(threading.current_thread())
+                return StringIO.readline(self)
+        shell = TestKmd(stdin=Input('echo a\n'), stdout=StringIO())
+        self.assertEqual(asyncio.run(shell.async_input('')), 'echo a')
+        self.assertIsNot(threads[0], threading.current_thread())
+        self.assertTrue(threads[0].daemon)
+
+    def test_blocked_input_does_not_hang(self):
+        r, w = os.pipe()
+        stdin = os.fdopen(r, 'rt')
+        shell = TestKmd(stdin=stdin, stdout=StringIO())
+        start = time.time()
+        try:
+            self.assertRaises(asyncio.TimeoutError, asyncio.run,
+                              asyncio.wait_for(shell.async_input(''), 0.05))
+            self.assertTrue(time.time() - start < 2)
+        finally:
+            # Release the reader thread
+            os.write(w, b'\n')
+            os.close(w)
+
+    def test_input_error(self):
+        class Input(object):
+            def readline(self):
+                raise IOError('bad')
+        shell = TestKmd(stdin=Input(), stdout=StringIO())
+        self.assertRaises(IOError, asyncio.run, shell.async_input(''))
+
+    def test_other_tasks_run(self):
+        shell = TestKmd(stdin=StringIO('sleep\nsleep\nquit\n'), stdout=StringIO())
+        ticks = []
+        asyncio.run(cmdloop_with_ticker(shell, ticks))
+        self.assertTrue(len(ticks) > 1)
+
+    def test_run_args(self):
+        shell = TestKmd(stdout=StringIO())
+        self.assertEqual(shell.run(['later', 'a']), 0)
+        self.assertEqual(shell.stdout.getvalue(), 'a\n')
+
+    def test_run_script(self):
+        shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(shell.run(script=['later a', 'quit', 'echo b']), 0)
+        self.assertEqual(shell.stdout.getvalue(), 'a\n')
+
+    def test_run_script_errors(self):
+        shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(shell.run(script=['fail x', 'later a', 'fail y']), 1)
+        self.assertEqual(shell.stdout.getvalue(), 'a\n')
+        errors = shell.stderr.getvalue().splitlines()
+        self.assertEqual(errors[:2], ['*** Error in line 1: ValueError: x', '*** Error in line 3: ValueError: y'])
+        self.assertTrue(errors[2].startswith('3 lines in '))
+
+    def test_run_script_stop_on_error(self):
+        shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(shell.run(script=['fail x', 'later a'], stop_on_error=True), 1)
+        self.assertEqual(shell.stdout.getvalue(), '')
@@ -0,0 +1,152 @@
+import threading
+import unittest
+
+from rl import completion
+from rl import readline
+
+from kmd import Kmd
+from kmd.testing import reset
+from kmd.background import CompletionTask
+from kmd.background import CompletionTasks
+from kmd.background import threadsafe
+
+TAB = '\t'
+
+
+class Completer(object):
+
+    def __init__(self, matches):
+        self.calls = 0
+        self.matches = matches
+        self.release = threading.Event()
+
+    def __call__(self, text, line, begidx, endidx):
+        self.calls += 1
+        # Produce the first match immediately, the rest when released
+        for i, match in enumerate(self.matches):
+            if i == 1:
+                self.release.wait(5)
+            if match.startswith(text):
+                yield match
+
+
+class TestKmd(Kmd):
+
+    completion_timeout = 0.05
+
+    def __init__(self):
+        Kmd.__init__(self)
+        self.completer = Completer(['alpha', 'beta'])
+
+    @threadsafe
+    def complete_slow(self, text, line, begidx, endidx):
+        return self.completer(text, line, begidx, endidx)
+
+    def complete_thread(self, text, *ignored):
+        return [threading.current_thread().name]
+
+
+class CompletionTaskTests(unittest.TestCase):
+
+    def test_finished(self):
+        task = CompletionTask(lambda text: [text, text], ('a',))
+        self.assertEqual(task.wait(5), ['a', 'a'])
+        self.assertTrue(task.done.is_set())
+
+    def test_callback(self):
+        results = []
+        task = CompletionTask(lambda text: [text, text], ('a',), results.append)
+        task.wait(5)
+        self.assertEqual(results, [['a', 'a']])
+
+    def test_partial(self):
+        completer = Completer(['a1', 'a2'])
+        task = CompletionTask(completer, ('a', 'a', 0, 1))
+        self.assertEqual(task.wait(0.05), ['a1'])
+        completer.release.set()
+        self.assertEqual(task.wait(5), ['a1', 'a2'])
+
+    def test_error(self):
+        def compfunc(text):
+            raise ValueError(text)
+        results = []
+        task = CompletionTask(compfunc, ('a',), results.append)
+        self.assertEqual(task.wait(5), [])
+        self.assertEqual(results, [])
+        self.assertTrue(isinstance(task.error, ValueError))
+
+
+class CompletionTasksTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tasks = CompletionTasks(maxsize=2)
+        self.completer = Completer(['a1', 'a2'])
+
+    def tearDown(self):
+        self.completer.release.set()
+
+    def test_resume(self):
+        # A single partial match is withheld
+        self.assertEqual(self.tasks.complete(0.05, self.completer, 'a', 'a', 0, 1), [])
+        self.completer.release.set()
+        self.assertEqual(self.tasks.complete(5, self.completer, 'a', 'a', 0, 1), ['a1', 'a2'])
+        self.assertEqual(self.completer.calls, 1)
+
+    def test_finished_tasks_are_dropped(self):
+        self.completer.release.set()
+        self.assertEqual(self.tasks.complete(5, self.completer, 'a', 'a', 0, 1), ['a1', 'a2'])
+        self.assertEqual(len(self.tasks.tasks), 0)
+        self.tasks.complete(5, self.completer, 'a', 'a', 0, 1)
+        self.assertEqual(self.completer.calls, 2)
+
+    def test_single_partial_match(self):
+        self.completer.matches = ['a1', 'b2']
+        self.assertEqual(self.tasks.complete(0.05, self.completer, 'a', 'a', 0, 1), [])
+        self.completer.release.set()
+        self.assertEqual(self.tasks.complete(5, self.completer, 'a', 'a', 0, 1), ['a1'])
+
+    def test_maxsize(self):
+        for text in ('a', 'b', 'c'):
+            self.tasks.complete(0, self.completer, text, text, 0, 1)
+        self.assertEqual(len(self.tasks.tasks), 2)
+
+
+class KmdCompleteTests(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        self.cmd = TestKmd()
+        self.cmd.preloop()
+
+    def tearDown(self):
+        self.cmd.completer.release.set()
+        self.cmd.postloop()
+
+    def complete(self, text):
+        completion.line_buffer = text
+        readline.complete_internal(TAB)
+        return completion.line_buffer
+
+    def test_partial_matches(self):
+        self.cmd.completer.matches = ['alpha', 'alpine']
+        # The single partial match is not accepted as unique
+        self.assertEqual(self.complete('slow al'), 'slow al')
+
+    def test_timeout_passed(self):
+        self.cmd.completer.matches = ['alpha', 'alpine']
+        self.complete('slow al')
+        self.assertEqual(len(self.cmd.completion_tasks.tasks), 1)
+        self.cmd.completer.release.set()
+        self.cmd.completion_timeout = 5
+        self.assertEqual(self.complete('slow al'), 'slow alp')
+        self.assertEqual(self.cmd.completer.calls, 1)
+
+    def test_single_match_when_finished(self):
+        self.cmd.completer.matches = ['alpha', 'beta']
+        self.cmd.completer.release.set()
+        self.cmd.completion_timeout = 5
+        self.assertEqual(self.complete('slow al'), 'slow alpha ')
+
+    def test_not_threadsafe_runs_on_main_thread(self):
+        self.assertEqual(self.complete('thread '), 'thread %s ' % threading.current_thread().name)
+        self.assertEqual(self.cmd.completion_tasks, None)
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd.testing import JailSetup
+from kmd.bench import Bench
+from kmd.bench import compare
+from kmd.bench import main
+from kmd.bench import time_preloop
+from kmd.bench import bench_sessions
+from kmd.bench import bench_quoting
+from kmd.bench import bench_roundtrip
+from kmd.bench import RATE
+from kmd.bench import SECONDS
+
+LAZY_SCRIPT = """\
+import sys
+import kmd.completions
+before = sorted(m for m in sys.modules if m.startswith('kmd.completions.'))
+kmd.completions.FilenameCompletion
+after = sorted(m for m in sys.modules if m.startswith('kmd.completions.'))
+print(before, after)
+"""
+
+OPTIONAL_SCRIPT = """\
+import sys
+import kmd
+optional = ('kmd.index', 'kmd.cmdqueue', 'kmd.background', 'kmd.caching')
+before = sorted(m for m in optional if m in sys.modules)
+kmd.Kmd().completenames('he')
+after = sorted(m for m in optional if m in sys.modules)
+print(before, after)
+"""
+
+TRACEBACK_SCRIPT = """\
+import sys
+before = 'traceback' in sys.modules
+import kmd
+print(before or 'traceback' not in sys.modules)
+"""
+
+
+
+class CompareTests(unittest.TestCase):
+
+    def test_rate(self):
+        baseline = {'a': 100.0, 'b': 100.0, 'c': 100.0}
+        results = {'a': 90.0, 'b': 70.0, 'd': 1.0}
+        self.assertEqual(compare(results, baseline, RATE, 25), ['b'])
+
+    def test_seconds(self):
+        baseline = {'a': 1.0, 'b': 1.0}
+        results = {'a': 1.2, 'b': 1.3}
+        self.assertEqual(compare(results, baseline, SECONDS, 25), ['b'])
+
+
+class BaselineTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.shell = Bench(stdout=StringIO(), stderr=StringIO())
+
+    def test_save(self):
+        status = self.shell.report({'x': 2.0}, RATE, self.shell.parse_options('--save b.json')[0])
+        self.assertEqual(status, 0)
+        with open('b.json', 'rt') as f:
+            self.assertEqual(json.load(f), {'unit': '/s', 'results': {'x': 2.0}})
+
+    def test_compare(self):
+        self.shell.report({'x': 0.001}, SECONDS, self.shell.parse_options('--save b.json')[0])
+        options = self.shell.parse_options('--compare b.json --tolerance 10')[0]
+        self.assertEqual(self.shell.report({'x': 0.00105}, SECONDS, options), 0)
+        self.assertEqual(self.shell.report({'x': 0.002}, SECONDS, options), 1)
+        self.assertEqual(self.shell.stderr.getvalue(), '*** Regression: x 0.001 -> 0.002\n')
+
+    def test_status_is_not_stop_flag(self):
+        self.assertEqual(self.shell.onecmd('dispatch --save b.json 10 5'), None)
+        self.assertEqual(self.shell.status, 0)
+        with open('b.json', 'rt') as f:
+            baseline = json.load(f)
+        for name in baseline['results']:
+            baseline['results'][name] *= 1000000
+        with open('b.json', 'wt') as f:
+            json.dump(baseline, f)
+        self.assertEqual(self.shell.onecmd('dispatch --compare b.json 10 5'), None)
+        self.assertEqual(self.shell.status, 1)
+
+    def test_main_status(self):
+        with open('b.json', 'wt') as f:
+            json.dump({'unit': RATE, 'results': {'dispatch/getattr/full': 1e12}}, f)
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = StringIO()
+        try:
+            self.assertEqual(main(['dispatch', '--compare', 'b.json', '10', '5']), 1)
+            self.assertEqual(main(['dispatch', '10', '5']), 0)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def test_bad_arguments(self):
+        for args in ('dispatch x', 'history 1.5', 'quoting --tolerance high'):
+            self.shell.stderr = StringIO()
+            self.assertEqual(self.shell.onecmd(args), None)
+            self.assertEqual(self.shell.status, 2)
+            self.assertTrue(self.shell.stderr.getvalue().startswith('Usage: %s ' % args.split()[0]))
+
+    def test_main_bad_arguments(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self.assertEqual(main(['dispatch', 'many']), 2)
+            self.assertEqual(sys.stderr.getvalue(),
+                'Usage: dispatch [<options>] [<number> [<commands>]]\n\n'
+                'Compare onecmd via getattr and via the dispatch table.\n')
+        finally:
+            sys.stderr = stderr
+
+    def test_parse_options(self):
+        options, params = self.shell.parse_options('10 --save "my file" 20')
+        self.assertEqual(options['save'], 'my file')
+        self.assertEqual(options['tolerance'], 25.0)
+        self.assertEqual(params, ['10', '20'])
+
+    def test_time_preloop(self):
+        self.assertTrue(time_preloop(100, 1) > 0)
+
+    def test_bench_quoting(self):
+        results = bench_quoting(10, 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue('quoting/quote 10 matches' in results)
+
+    def test_bench_roundtrip(self):
+        results = bench_roundtrip(100, 1)
+        self.assertEqual(len(results), 9)
+        self.assertTrue(results['roundtrip/rejoin and split'] > 0)
+
+    @unittest.skipIf(not hasattr(os, 'fork'), 'Requires fork')
+    def test_bench_sessions(self):
+        results = bench_sessions(1)
+        self.assertEqual(sorted(results), ['session/cold start', 'session/in-process', 'session/prefork'])
+
+
+class LazyImportTests(unittest.TestCase):
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'Requires Python 3.7')
+    def test_submodules_imported_on_access(self):
+        output = subprocess.check_output([sys.executable, '-c', LAZY_SCRIPT])
+        self.assertEqual(output.decode('ascii').strip(), "[] ['kmd.completions.filename']")
+
+    def test_optional_features_not_imported(self):
+        output = subprocess.check_output([sys.executable, '-c', OPTIONAL_SCRIPT])
+        self.assertEqual(output.decode('ascii').strip(), "[] ['kmd.cmdqueue', 'kmd.index']")
+
+    def test_traceback_not_imported(self):
+        output = subprocess.check_output([sys.executable, '-c', TRACEBACK_SCRIPT])
+        self.assertEqual(output.decode('ascii').strip(), 'True')
+
+    def test_from_import(self):
+        from kmd.completions import CommandCompletion
+        self.assertEqual(CommandCompletion.__module__, 'kmd.completions.command')
+
+    def test_unknown(self):
+        import kmd.completions
+        self.assertRaises(AttributeError, getattr, kmd.completions, 'FooCompletion')
@@ -0,0 +1,201 @@
+import unittest
+
+from rl import completion
+from rl import readline
+
+from kmd import Kmd
+from kmd.testing import reset
+from kmd.testing import JailSetup
+from kmd.completions import FilenameCompletion
+from kmd.caching import CompletionCache
+from kmd.caching import cacheable
+from kmd.caching import uncacheable
+
+import kmd.caching
+
+TAB = '\t'
+
+
+class TestKmd(Kmd):
+
+    def __init__(self):
+        Kmd.__init__(self)
+        self.calls = []
+
+    @cacheable
+    def complete_cached(self, text, *ignored):
+        self.calls.append(text)
+        return [x for x in ('alpha', 'alpine', 'beta') if x.startswith(text)]
+
+    def complete_plain(self, text, *ignored):
+        self.calls.append(text)
+        return [x for x in ('alpha', 'alpine', 'beta') if x.startswith(text)]
+
+    @uncacheable
+    def complete_never(self, text, *ignored):
+        self.calls.append(text)
+        return [x for x in ('alpha', 'alpine', 'beta') if x.startswith(text)]
+
+
+class CompletionCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = CompletionCache(maxsize=2, ttl=60)
+
+    def test_miss(self):
+        self.assertEqual(self.cache.get('k', 'a'), None)
+
+    def test_hit(self):
+        self.cache.put('k', 'a', ['ab', 'ac'])
+        self.assertEqual(self.cache.get('k', 'a'), ['ab', 'ac'])
+
+    def test_narrowing(self):
+        self.cache.put('k', 'a', ['ab', 'ac'])
+        self.assertEqual(self.cache.get('k', 'ab'), ['ab'])
+        self.assertEqual(self.cache.get('k', 'ax'), [])
+        # The broader entry is kept
+        self.assertEqual(self.cache.get('k', 'a'), ['ab', 'ac'])
+
+    def test_new_component_misses(self):
+        self.cache.put('k', 'a', ['adir', 'abc'])
+        self.assertEqual(self.cache.get('k', 'adir/'), None)
+        self.assertEqual(self.cache.get('k', 'adi'), ['adir'])
+
+    def test_subset_narrows_new_component(self):
+        self.cache.put('k', 'a', ['a/b', 'a/c'])
+        self.assertEqual(self.cache.get('k', 'a/b', True), ['a/b'])
+
+    def test_shorter_text_misses(self):
+        self.cache.put('k', 'ab', ['ab'])
+        self.assertEqual(self.cache.get('k', 'a'), None)
+
+    def test_returns_copy(self):
+        self.cache.put('k', 'a', ['ab'])
+        self.cache.get('k', 'a').append('x')
+        self.assertEqual(self.cache.get('k', 'a'), ['ab'])
+
+    def test_lru(self):
+        self.cache.put('k1', '', ['1'])
+        self.cache.put('k2', '', ['2'])
+        self.cache.get('k1', '')
+        self.cache.put('k3', '', ['3'])
+        self.assertEqual(self.cache.get('k2', ''), None)
+        self.assertEqual(self.cache.get('k1', ''), ['1'])
+        self.assertEqual(len(self.cache), 2)
+
+    def test_ttl(self):
+        timer = kmd.caching.timer
+        try:
+            kmd.caching.timer = lambda: 100.0
+            self.cache.put('k', 'a', ['ab'])
+            kmd.caching.timer = lambda: 160.0
+            self.assertEqual(self.cache.get('k', 'a'), ['ab'])
+            kmd.caching.timer = lambda: 160.5
+            self.assertEqual(self.cache.get('k', 'a'), None)
+            self.assertEqual(len(self.cache), 0)
+        finally:
+            kmd.caching.timer = timer
+
+
+class KmdCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        self.cmd = TestKmd()
+        self.cmd.preloop()
+
+    def tearDown(self):
+        self.cmd.postloop()
+
+    def complete(self, text):
+        completion.line_buffer = text
+        readline.complete_internal(TAB)
+        return completion.line_buffer
+
+    def test_cacheable(self):
+        self.assertEqual(self.complete('cached a'), 'cached alp')
+        self.assertEqual(self.complete('cached alpi'), 'cached alpine ')
+        self.assertEqual(self.complete('cached alph'), 'cached alpha ')
+        self.assertEqual(self.cmd.calls, ['a'])
+
+    def test_other_argument(self):
+        self.complete('cached a')
+        self.complete('cached alpha a')
+        self.assertEqual(self.cmd.calls, ['a', 'a'])
+
+    def test_not_cached_by_default(self):
+        self.complete('plain a')
+        self.complete('plain alpi')
+        self.assertEqual(self.cmd.calls, ['a', 'alpi'])
+
+    def test_cache_completions(self):
+        self.cmd.cache_completions = True
+        self.complete('plain a')
+        self.complete('plain alpi')
+        self.assertEqual(self.cmd.calls, ['a'])
+
+    def test_uncacheable(self):
+        self.cmd.cache_completions = True
+        self.complete('never a')
+        self.complete('never alpi')
+        self.assertEqual(self.cmd.calls, ['a', 'alpi'])
+
+    def test_with_timeout(self):
+        self.cmd.completion_timeout = 5
+        self.assertEqual(self.complete('cached a'), 'cached alp')
+        self.assertEqual(self.complete('cached alpi'), 'cached alpine ')
+        self.assertEqual(self.cmd.calls, ['a'])
+
+
+class FileKmd(Kmd):
+
+    def preloop(self):
+        Kmd.preloop(self)
+        self.completefilename = FilenameCompletion()
+        self.calls = []
+
+    def complete_ls(self, text, *ignored):
+        self.calls.append(text)
+        return self.completefilename(text)
+
+
+class FilenameCacheTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        reset()
+        self.mkdir('adir')
+        self.mkfile('adir/x')
+        self.mkfile('abc')
+        self.mkfile('a b')
+        self.cmd = FileKmd()
+        self.cmd.cache_completions = True
+        self.cmd.preloop()
+
+    def tearDown(self):
+        self.cmd.postloop()
+        JailSetup.tearDown(self)
+
+    def complete(self, text):
+        completion.line_buffer = text
+        readline.complete_internal(TAB)
+        return completion.line_buffer
+
+    def test_not_cached(self):
+        self.complete('ls a')
+        self.complete('ls ab')
+        self.assertEqual(self.cmd.calls, ['a', 'ab'])
+        self.assertEqual(len(self.cmd.completion_cache), 0)
+
+    def test_directory_slash(self):
+        self.assertEqual(self.complete('ls ad'), 'ls adir/')
+        self.assertEqual(self.complete('ls ad'), 'ls adir/')
+
+    def test_directory_contents(self):
+        self.assertEqual(self.complete('ls a'), 'ls a')
+        self.assertEqual(self.complete('ls adir/'), 'ls adir/x ')
+
+    def test_quoted_text(self):
+        self.assertEqual(self.complete('ls a'), 'ls a')
+        self.assertEqual(self.complete('ls a\\ '), 'ls a\\ b ')
+        self.assertEqual(self.complete('ls "a '), 'ls "a b" ')
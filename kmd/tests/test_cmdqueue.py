@@ -0,0 +1,207 @@
+import sys
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+from kmd.cmdqueue import CommandQueue
+
+
+class TestKmd(Kmd):
+
+    use_rawinput = False
+
+    def do_echo(self, args):
+        self.stdout.write(args + '\n')
+
+    def do_push(self, args):
+        self.cmdqueue.append('echo pushed')
+
+    def do_EOF(self, args):
+        return True
+
+
+class CommandQueueTests(unittest.TestCase):
+
+    def test_pop_compat(self):
+        queue = CommandQueue(['a', 'b', 'c', 'd'])
+        self.assertEqual(queue.pop(0), 'a')
+        self.assertEqual(queue.pop(), 'd')
+        self.assertEqual(queue.pop(-1), 'c')
+        self.assertEqual(list(queue), ['b'])
+
+    def test_pop_index(self):
+        queue = CommandQueue(['a', 'b', 'c'])
+        self.assertEqual(queue.pop(1), 'b')
+        self.assertEqual(list(queue), ['a', 'c'])
+
+    def test_list_api(self):
+        queue = CommandQueue()
+        queue.append('a')
+        queue.extend(['b', 'c'])
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue[0], 'a')
+
+    def test_slicing(self):
+        queue = CommandQueue(['a', 'b', 'c', 'd'])
+        self.assertEqual(queue[1:3], ['b', 'c'])
+        self.assertEqual(queue[::-1], ['d', 'c', 'b', 'a'])
+        self.assertEqual(queue[-1], 'd')
+        del queue[:2]
+        self.assertEqual(queue, ['c', 'd'])
+        queue[:0] = ['x', 'y']
+        self.assertEqual(queue, ['x', 'y', 'c', 'd'])
+        self.assertEqual(queue.pop(0), 'x')
+
+    def test_insert(self):
+        queue = CommandQueue(['a', 'b'])
+        queue.insert(0, 'x')
+        queue.insert(2, 'y')
+        queue.insert(10, 'z')
+        queue.insert(-1, 'w')
+        self.assertEqual(list(queue), ['x', 'a', 'y', 'b', 'w', 'z'])
+        expected = ['x', 'a', 'y', 'b', 'w', 'z']
+        expected.insert(-10, 'v')
+        queue.insert(-10, 'v')
+        self.assertEqual(list(queue), expected)
+
+    def test_more_list_api(self):
+        queue = CommandQueue(['a', 'b', 'a'])
+        self.assertTrue('b' in queue)
+        self.assertEqual(queue.index('b'), 1)
+        self.assertEqual(queue.count('a'), 2)
+        queue.remove('a')
+        self.assertEqual(queue, ['b', 'a'])
+        self.assertNotEqual(queue, ['a', 'b'])
+        self.assertEqual(repr(queue), "CommandQueue(['b', 'a'])")
+        queue.feed(['c'])
+        queue.clear()
+        self.assertFalse(queue)
+
+    def test_len_consistent_with_bool(self):
+        queue = CommandQueue()
+        queue.feed(['a', 'b'])
+        self.assertEqual(len(queue), 1)
+        self.assertTrue(queue)
+        self.assertEqual(queue.pop(0), 'a')
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.pop(0), 'b')
+        self.assertEqual(len(queue), 0)
+        self.assertFalse(queue)
+
+    def test_pop_reads_feed(self):
+        queue = CommandQueue()
+        queue.feed(['a'])
+        self.assertEqual(queue.pop(0), 'a')
+
+    def test_getitem_reads_feed(self):
+        queue = CommandQueue()
+        queue.feed(['a\n', 'b\n', 'c\n'])
+        self.assertTrue(queue)
+        self.assertEqual(queue[0], 'a')
+        self.assertEqual(queue[1], 'b')
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue[-1], 'c')
+        self.assertEqual(queue, ['a', 'b', 'c'])
+        self.assertRaises(IndexError, queue.__getitem__, 3)
+
+    def test_getitem_slice_reads_feeds(self):
+        queue = CommandQueue(['a'])
+        queue.feed(['b'])
+        queue.feed(['c'])
+        self.assertEqual(queue[1:], ['b', 'c'])
+
+    def test_pop_last_reads_feeds(self):
+        queue = CommandQueue()
+        queue.feed(['a', 'b'])
+        queue.feed(['c'])
+        self.assertEqual(queue.pop(), 'c')
+        self.assertEqual(queue.pop(-1), 'b')
+        self.assertEqual(queue, ['a'])
+
+    def test_pop_last_after_queued_lines(self):
+        queue = CommandQueue(['a'])
+        queue.feed(['b'])
+        self.assertEqual(queue.pop(), 'b')
+        self.assertEqual(queue.pop(), 'a')
+        self.assertFalse(queue)
+
+    def test_setitem_delitem_read_feed(self):
+        queue = CommandQueue()
+        queue.feed(['a', 'b'])
+        queue[1] = 'x'
+        del queue[0]
+        self.assertEqual(queue, ['x'])
+
+    def test_empty(self):
+        queue = CommandQueue()
+        self.assertFalse(queue)
+        self.assertRaises(IndexError, queue.pop, 0)
+
+    def test_feed_lazily(self):
+        consumed = []
+        def lines():
+            for x in ('a\n', 'b\r\n', 'c'):
+                consumed.append(x)
+                yield x
+        queue = CommandQueue()
+        queue.feed(lines())
+        self.assertEqual(consumed, [])
+        self.assertTrue(queue)
+        self.assertEqual(consumed, ['a\n'])
+        self.assertEqual(queue.pop(0), 'a')
+        self.assertTrue(queue)
+        self.assertEqual(queue.pop(0), 'b')
+        self.assertTrue(queue)
+        self.assertEqual(queue.pop(0), 'c')
+        self.assertFalse(queue)
+
+    def test_queued_lines_first(self):
+        queue = CommandQueue(['a'])
+        queue.feed(['b'])
+        self.assertTrue(queue)
+        self.assertEqual(queue.pop(0), 'a')
+        self.assertTrue(queue)
+        self.assertEqual(queue.pop(0), 'b')
+
+    def test_multiple_feeds(self):
+        queue = CommandQueue()
+        queue.feed([])
+        queue.feed(['a'])
+        queue.feed(['b'])
+        result = []
+        while queue:
+            result.append(queue.pop(0))
+        self.assertEqual(result, ['a', 'b'])
+
+
+class CmdloopTests(unittest.TestCase):
+
+    def test_cmdqueue(self):
+        shell = TestKmd(stdin=StringIO(''), stdout=StringIO())
+        shell.cmdqueue.append('echo a')
+        shell.cmdqueue.append('echo b')
+        shell.cmdloop()
+        self.assertEqual(shell.stdout.getvalue(), 'a\nb\n(Kmd) ')
+
+    def test_feed(self):
+        shell = TestKmd(stdin=StringIO(''), stdout=StringIO())
+        shell.feed('echo %d\n' % i for i in range(3))
+        shell.cmdloop()
+        self.assertEqual(shell.stdout.getvalue(), '0\n1\n2\n(Kmd) ')
+
+    def test_feed_nested(self):
+        shell = TestKmd(stdin=StringIO(''), stdout=StringIO())
+        shell.feed(['push', 'echo a'])
+        shell.cmdloop()
+        self.assertEqual(shell.stdout.getvalue(), 'pushed\na\n(Kmd) ')
+
+    def test_feed_replaced_list(self):
+        shell = TestKmd(stdin=StringIO(''), stdout=StringIO())
+        shell.cmdqueue = ['echo a']
+        shell.feed(['echo b'])
+        shell.cmdloop()
+        self.assertEqual(shell.stdout.getvalue(), 'a\nb\n(Kmd) ')
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import os
 import unittest
 
 from rl import completer
@@ -301,3 +302,52 @@ class DirectoryCompletionHookTests(JailSetup):
                                        'funny\\ dir/foo.')
         self.assertEqual(called, [('funny\\ dir/',)])
 
+
+
+class KnownDirectoriesTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        reset()
+        self.cmd = TestKmd(quote_char='"')
+        self.cmd.preloop()
+        self.mkdir('dir one')
+        for i in range(10):
+            self.mkfile('file %d' % i)
+        self.completefilename = self.cmd.completefilename
+
+    def quote(self, text, single_match=True, quote_char='"'):
+        completion.suppress_quote = False
+        isdir = os.path.isdir
+        os.path.isdir = None
+        try:
+            return self.completefilename.quote_filename(text, single_match, quote_char)
+        finally:
+            os.path.isdir = isdir
+
+    def test_known_directories(self):
+        self.completefilename('')
+        self.assertEqual(self.completefilename.known_directories('file 1'), set(['dir one']))
+        self.assertEqual(self.completefilename.known_directories('other'), None)
+
+    def test_too_few_matches(self):
+        self.completefilename('d')
+        self.assertEqual(self.completefilename.known_directories('dir one'), None)
+
+    def test_quote_without_stat(self):
+        self.completefilename('')
+        self.assertEqual(self.quote('file 1'), '"file 1"')
+        self.assertEqual(completion.suppress_quote, False)
+        self.assertEqual(self.quote('dir one'), '"dir one')
+        self.assertEqual(completion.suppress_quote, True)
+        self.assertEqual(self.quote('file 1', False), '"file 1')
+
+    def test_backslash_quoting(self):
+        self.cmd = TestKmd(quote_char='\\')
+        self.cmd.preloop()
+        self.completefilename = self.cmd.completefilename
+        self.completefilename('')
+        self.assertEqual(self.quote('dir one', quote_char=''), 'dir\\ one')
+        self.assertEqual(completion.suppress_quote, False)
+        self.assertEqual(self.quote('dir one', quote_char="'"), "'dir one")
+        self.assertEqual(completion.suppress_quote, True)
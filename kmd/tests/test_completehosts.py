@@ -2,6 +2,7 @@
 
 import unittest
 import os
+import threading
 
 from os.path import join
 
@@ -13,6 +14,7 @@ from rl import print_exc
 from kmd import Kmd
 from kmd.testing import JailSetup
 from kmd.testing import reset
+from kmd.background import threadsafe
 
 from kmd.completions import HostnameCompletion
 
@@ -84,3 +86,39 @@ class CompleterTests(JailSetup):
         os.remove('hosts')
         self.assertEqual(self.complete('bar'), 'bar')
 
+
+
+class BackgroundKmd(Kmd):
+
+    completion_timeout = 5
+
+    def __init__(self, hostsfile):
+        Kmd.__init__(self)
+        self.completehostname = HostnameCompletion(hostsfile)
+        self.threads = []
+
+    @threadsafe
+    def complete_ssh(self, text, *ignored):
+        self.threads.append(threading.current_thread())
+        return self.completehostname(text)
+
+
+class BackgroundTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        reset()
+        f = open('hosts', 'wt')
+        f.write(HOSTSFILE)
+        f.close()
+        self.cmd = BackgroundKmd(join(self.tempdir, 'hosts'))
+
+    def test_threadsafe(self):
+        self.assertEqual(HostnameCompletion.threadsafe, True)
+        self.assertEqual(self.cmd.completehostname.threadsafe, True)
+
+    def test_background(self):
+        matches = self.cmd.completions('@bar', 'ssh @bar', 4, 8)
+        self.assertEqual(list(matches), ['@barney'])
+        self.assertEqual(len(self.cmd.threads), 1)
+        self.assertIsNot(self.cmd.threads[0], threading.current_thread())
@@ -0,0 +1,146 @@
+import sys
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+
+
+class TestKmd(Kmd):
+
+    use_dispatch_table = True
+
+    def __init__(self, *args, **kw):
+        Kmd.__init__(self, *args, **kw)
+        self.aliases['q'] = 'quit'
+        self.aliases['x'] = 'nosuchcommand'
+
+    def do_shell(self, args):
+        return 'shell ' + args
+
+    def do_show(self, args):
+        return 'show ' + args
+
+    def do_quit(self, args):
+        return 'quit'
+
+    def do_q(self, args):
+        return 'q'
+
+    def do_EOF(self, args):
+        return 'EOF'
+
+
+class DispatchTableTests(unittest.TestCase):
+
+    def setUp(self):
+        self.shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+
+    def test_build(self):
+        self.assertEqual(self.shell.dispatch_table, None)
+        self.shell.onecmd('show')
+        self.assertNotEqual(self.shell.dispatch_table, None)
+
+    def test_full_names(self):
+        self.assertEqual(self.shell.onecmd('shell ls'), 'shell ls')
+        self.assertEqual(self.shell.onecmd('show x'), 'show x')
+
+    def test_abbreviations(self):
+        self.assertEqual(self.shell.onecmd('she ls'), 'shell ls')
+        self.assertEqual(self.shell.onecmd('sho x'), 'show x')
+        self.assertEqual(self.shell.onecmd('qu'), 'quit')
+
+    def test_ambiguous(self):
+        self.assertEqual(self.shell.onecmd('sh'), None)
+        self.assertEqual(self.shell.stderr.getvalue(), '*** Unknown syntax: sh\n')
+
+    def test_aliases(self):
+        self.assertEqual(self.shell.onecmd('!ls'), 'shell ls')
+        self.assertEqual(self.shell.onecmd('?'), None)
+
+    def test_exact_name_beats_alias(self):
+        self.assertEqual(self.shell.onecmd('q'), 'q')
+
+    def test_alias_to_unknown_command(self):
+        self.assertEqual(self.shell.onecmd('x'), None)
+        self.assertEqual(self.shell.stderr.getvalue(), '*** Unknown syntax: x\n')
+
+    def test_unknown(self):
+        self.assertEqual(self.shell.onecmd('foo'), None)
+        self.assertEqual(self.shell.stderr.getvalue(), '*** Unknown syntax: foo\n')
+
+    def test_emptyline(self):
+        self.shell.emptyline = lambda: 'emptyline'
+        self.assertEqual(self.shell.onecmd(''), 'emptyline')
+
+    def test_eof(self):
+        self.assertEqual(self.shell.onecmd('EOF'), 'EOF')
+        self.assertEqual(self.shell.lastcmd, '')
+
+    def test_same_as_getattr(self):
+        shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+        shell.use_dispatch_table = False
+        for line in ('shell a', 'she a', 'sh', 'sho', 'q', 'qu', 'x', '!a', 'foo'):
+            self.assertEqual(self.shell.onecmd(line), shell.onecmd(line), line)
+
+    def test_command_added(self):
+        class MyKmd(TestKmd):
+            pass
+        shell = MyKmd(stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(shell.onecmd('sho x'), 'show x')
+        MyKmd.do_shower = lambda self, args: 'shower ' + args
+        self.assertEqual(shell.onecmd('shower x'), 'shower x')
+        self.assertEqual(shell.onecmd('sho x'), None)
+        del MyKmd.do_shower
+        self.assertEqual(shell.onecmd('sho x'), 'show x')
+
+    def test_command_added_and_removed(self):
+        class MyKmd(TestKmd):
+            def do_foo(self, args):
+                return 'foo'
+        shell = MyKmd(stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(shell.onecmd('f'), 'foo')
+        del MyKmd.do_foo
+        MyKmd.do_bar = lambda self, args: 'bar'
+        self.assertEqual(shell.onecmd('f'), None)
+        self.assertEqual(shell.onecmd('b'), 'bar')
+
+    def test_alias_added(self):
+        self.assertEqual(self.shell.onecmd('s x'), None)
+        self.shell.aliases['s'] = 'show'
+        self.assertEqual(self.shell.onecmd('s x'), 'show x')
+        del self.shell.aliases['s']
+        self.assertEqual(self.shell.onecmd('s x'), None)
+
+
+    def test_index_invalidated(self):
+        from kmd.index import invalidate
+        class Mixin(object):
+            pass
+        class MyKmd(Mixin, TestKmd):
+            pass
+        shell = MyKmd(stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(shell.onecmd('sho x'), 'show x')
+        Mixin.do_shower = lambda self, args: 'shower ' + args
+        invalidate()
+        self.assertEqual(shell.onecmd('shower x'), 'shower x')
+        self.assertEqual(shell.onecmd('sho x'), None)
+
+    def test_aliases_replaced(self):
+        self.assertEqual(self.shell.onecmd('s x'), None)
+        self.shell.aliases = {'s': 'show'}
+        self.assertEqual(self.shell.onecmd('s x'), 'show x')
+        self.shell.aliases.update(s='shell')
+        self.assertEqual(self.shell.onecmd('s x'), 'shell x')
+        self.shell.aliases.clear()
+        self.assertEqual(self.shell.onecmd('s x'), None)
+
+    def test_not_slower_than_getattr(self):
+        from kmd.bench import bench_dispatch
+        results = bench_dispatch(number=3000, commands=50, repeat=9)
+        # Allow for timing noise
+        self.assertTrue(results['dispatch/table/full'] >= 0.8 * results['dispatch/getattr/full'], results)
+        self.assertTrue(results['dispatch/table/abbreviated'] >= results['dispatch/getattr/abbreviated'], results)
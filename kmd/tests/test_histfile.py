@@ -0,0 +1,502 @@
+import os
+import unittest
+
+from rl import history
+
+from kmd import Kmd
+from kmd.testing import reset
+from kmd.testing import JailSetup
+from kmd.histfile import AppendOnlyHistory
+from kmd.histfile import BinaryHistory
+from kmd.histfile import SharedHistory
+from kmd.histfile import read_lines
+
+import kmd.kmd
+
+
+class ReadLinesTests(JailSetup):
+
+    def write(self, data):
+        with open('history', 'wb') as f:
+            f.write(data)
+        return open('history', 'rb')
+
+    def test_tail(self):
+        with self.write(b'one\ntwo\nthree\n') as f:
+            self.assertEqual(read_lines(f, 14, 2), (4, ['two', 'three']))
+
+    def test_all(self):
+        with self.write(b'one\ntwo\nthree\n') as f:
+            self.assertEqual(read_lines(f, 14, 10), (0, ['one', 'two', 'three']))
+
+    def test_before_offset(self):
+        with self.write(b'one\ntwo\nthree\n') as f:
+            self.assertEqual(read_lines(f, 8, 1), (4, ['two']))
+
+    def test_small_blocks(self):
+        with self.write(b''.join(b'line%d\n' % i for i in range(100))) as f:
+            offset, lines = read_lines(f, 690, 50, blocksize=7)
+            self.assertEqual(lines, ['line%d' % i for i in range(50, 100)])
+            f.seek(offset)
+            self.assertEqual(f.readline(), b'line50\n')
+
+    def test_missing_newline(self):
+        with self.write(b'one\ntwo') as f:
+            self.assertEqual(read_lines(f, 7, 1), (4, ['two']))
+
+    def test_timestamps(self):
+        with self.write(b'#1700000000\none\n#1700000001\ntwo\n') as f:
+            self.assertEqual(read_lines(f, 32, 4)[1], ['one', 'two'])
+
+    def test_empty(self):
+        with self.write(b'') as f:
+            self.assertEqual(read_lines(f, 0, 10), (0, []))
+
+
+class AppendOnlyHistoryTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        reset()
+        with open('history', 'wt') as f:
+            for i in range(10):
+                f.write('line%d\n' % i)
+
+    def read(self):
+        with open('history', 'rt') as f:
+            return f.read().splitlines()
+
+    def test_load(self):
+        AppendOnlyHistory('history', max_load=3).load()
+        self.assertEqual(list(history), ['line7', 'line8', 'line9'])
+
+    def test_load_missing_file(self):
+        AppendOnlyHistory('missing').load()
+        self.assertEqual(len(history), 0)
+
+    def test_load_more(self):
+        backend = AppendOnlyHistory('history', max_load=3)
+        backend.load()
+        self.assertEqual(backend.load_more(2), 2)
+        self.assertEqual(list(history), ['line5', 'line6', 'line7', 'line8', 'line9'])
+        self.assertEqual(backend.load_more(10), 5)
+        self.assertEqual(backend.load_more(10), 0)
+        self.assertEqual(len(history), 10)
+
+    def test_append(self):
+        backend = AppendOnlyHistory('history')
+        backend.append('foo')
+        backend.append('bar')
+        backend.flush()
+        self.assertEqual(self.read()[-2:], ['foo', 'bar'])
+        backend.close()
+        self.assertEqual(backend.thread, None)
+
+    def test_close(self):
+        backend = AppendOnlyHistory('history', sync_interval=60)
+        for i in range(100):
+            backend.append('cmd%d' % i)
+        backend.close()
+        self.assertEqual(len(self.read()), 110)
+
+    def test_write_error(self):
+        backend = AppendOnlyHistory('nodir/history')
+        backend.append('foo')
+        backend.close()
+        self.assertTrue(isinstance(backend.error, IOError))
+
+    def test_write_error_raised(self):
+        backend = AppendOnlyHistory('nodir/history')
+        backend.append('foo')
+        self.assertRaises(IOError, backend.flush, raise_exc=True)
+        self.assertEqual(backend.error, None)
+        backend.close(raise_exc=True)
+
+    def test_truncate(self):
+        backend = AppendOnlyHistory('history', max_entries=4)
+        self.assertEqual(backend.truncate(), True)
+        self.assertEqual(self.read(), ['line6', 'line7', 'line8', 'line9'])
+        self.assertEqual(backend.truncate(), False)
+        self.assertFalse(os.path.exists('history.%d' % os.getpid()))
+
+    def test_truncate_below_ratio(self):
+        backend = AppendOnlyHistory('history', max_entries=5)
+        self.assertEqual(backend.truncate(), False)
+        self.assertEqual(len(self.read()), 10)
+
+    def test_truncate_on_load(self):
+        history.max_entries = 3
+        AppendOnlyHistory('history', max_load=2).load()
+        self.assertEqual(self.read(), ['line7', 'line8', 'line9'])
+        self.assertEqual(list(history), ['line8', 'line9'])
+
+    def test_unlimited(self):
+        history.max_entries = -1
+        self.assertEqual(AppendOnlyHistory('history').truncate(), False)
+        self.assertEqual(AppendOnlyHistory('history', max_entries=0).truncate(), False)
+        self.assertEqual(AppendOnlyHistory('missing', max_entries=1).truncate(), False)
+
+
+class KmdHistoryTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        reset()
+        with open('history', 'wt') as f:
+            f.write('old\n')
+
+    def make_shell(self, lines):
+        class TestKmd(Kmd):
+            history_file = 'history'
+            history_class = AppendOnlyHistory
+            def do_EOF(self, args):
+                return True
+        shell = TestKmd()
+        lines = iter(lines)
+        def input(prompt):
+            line = next(lines)
+            if line is None:
+                raise EOFError
+            return line
+        # Shadow the builtins used by Kmd.input
+        kmd.kmd.input = kmd.kmd.raw_input = input
+        return shell
+
+    def tearDown(self):
+        del kmd.kmd.input
+        del kmd.kmd.raw_input
+        JailSetup.tearDown(self)
+
+    def test_cmdloop(self):
+        shell = self.make_shell(['help', '', 'help help', None])
+        shell.stdout = open('stdout', 'wt')
+        shell.cmdloop()
+        shell.stdout.close()
+        self.assertEqual(shell.history_backend, None)
+        with open('history', 'rt') as f:
+            self.assertEqual(f.read(), 'old\nhelp\nhelp help\n')
+
+    def test_write_error_reported(self):
+        shell = self.make_shell(['help', None])
+        shell.history_file = 'nodir/history'
+        shell.stdout = shell.stderr = open('stdout', 'wt')
+        shell.cmdloop()
+        shell.stdout.close()
+        with open('stdout', 'rt') as f:
+            self.assertTrue('*** Error writing history file: ' in f.read())
+
+    def test_binary_close_error_reported(self):
+        os.remove('history')
+        shell = self.make_shell(['help', None])
+        shell.history_class = BinaryHistory
+        shell.stdout = shell.stderr = open('stdout', 'wt')
+        def fsync(fd):
+            raise OSError('fsync failed')
+        saved = os.fsync
+        os.fsync = fsync
+        try:
+            shell.cmdloop()
+        finally:
+            os.fsync = saved
+        shell.stdout.close()
+        with open('stdout', 'rt') as f:
+            self.assertTrue('*** Error writing history file: fsync failed' in f.read())
+
+
+class BinaryHistoryTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        reset()
+
+    def make_log(self, lines, **kw):
+        backend = BinaryHistory('history', **kw)
+        backend.open()
+        for line in lines:
+            backend.append(line)
+        backend.close()
+        return BinaryHistory('history', **kw)
+
+    def test_empty(self):
+        backend = BinaryHistory('history')
+        backend.load()
+        self.assertEqual(len(backend), 0)
+        self.assertEqual(len(history), 0)
+        backend.close()
+        with open('history', 'rb') as f:
+            self.assertEqual(f.read(8), b'KMDHIST1')
+
+    def test_random_access(self):
+        backend = self.make_log(['one', 'two', u'dr\xe9i'])
+        backend.open()
+        self.assertEqual(len(backend), 3)
+        self.assertEqual(backend[0], 'one')
+        self.assertEqual(backend[-1], u'dr\xe9i')
+        backend.close()
+
+    def test_load_window(self):
+        backend = self.make_log(['line%d' % i for i in range(10)], max_load=3)
+        backend.load()
+        self.assertEqual(list(history), ['line7', 'line8', 'line9'])
+        self.assertEqual(backend.load_more(2), 2)
+        self.assertEqual(list(history)[:2], ['line5', 'line6'])
+        self.assertEqual(backend.load_more(10), 5)
+        self.assertEqual(backend.load_more(10), 0)
+        backend.close()
+
+    def test_append_after_load(self):
+        backend = BinaryHistory('history')
+        backend.load()
+        backend.append('foo')
+        self.assertEqual(backend[-1], 'foo')
+        backend.append('bar')
+        self.assertEqual(backend[-2], 'foo')
+        backend.close()
+
+    def test_ignore_repeated(self):
+        backend = self.make_log(['a', 'a', 'b', 'a'])
+        backend.open()
+        self.assertEqual(list(backend[i] for i in range(len(backend))), ['a', 'b', 'a'])
+        backend.close()
+
+    def test_truncated_entry(self):
+        self.make_log(['one', 'two'])
+        with open('history', 'ab') as f:
+            f.write(b'\x10\x00\x00\x00thr')
+        backend = BinaryHistory('history')
+        backend.open()
+        self.assertEqual(len(backend), 2)
+        backend.append('three')
+        backend.close()
+        backend.open()
+        self.assertEqual(backend[-1], 'three')
+        backend.close()
+
+    def test_migrate(self):
+        with open('history', 'wt') as f:
+            f.write('one\n#1700000000\ntwo\ntwo\n\nthree\n')
+        backend = BinaryHistory('history')
+        backend.load()
+        self.assertEqual(list(history), ['one', 'two', 'three'])
+        backend.append('four')
+        backend.close()
+        with open('history.txt', 'rt') as f:
+            self.assertEqual(f.read(), 'one\n#1700000000\ntwo\ntwo\n\nthree\n')
+        self.assertFalse(os.path.exists('history.migrate'))
+        backend.open()
+        self.assertEqual([backend[i] for i in range(len(backend))], ['one', 'two', 'three', 'four'])
+        backend.close()
+
+    def test_migrate_empty_file(self):
+        open('history', 'wb').close()
+        backend = BinaryHistory('history')
+        backend.open()
+        self.assertEqual(len(backend), 0)
+        backend.close()
+
+    def test_bad_header(self):
+        with open('history', 'wb') as f:
+            f.write(b'KMDHIST1')
+        self.assertRaises(ValueError, BinaryHistory('history').open)
+
+    def test_remap_closes_map(self):
+        backend = self.make_log(['one'])
+        backend.open()
+        m = backend.map
+        backend.remap()
+        self.assertRaises(ValueError, len, m)
+        self.assertEqual(backend[0], 'one')
+        backend.close()
+
+    def test_compact(self):
+        backend = self.make_log(['a', 'b', 'a', 'c', 'b', 'd'])
+        backend.open()
+        backend.compact()
+        self.assertEqual([backend[i] for i in range(len(backend))], ['a', 'c', 'b', 'd'])
+        self.assertEqual(backend.compacted, 4)
+        backend.close()
+
+    def test_compact_keeps_window(self):
+        backend = self.make_log(['a', 'b', 'a', 'c', 'b', 'd'], max_load=2)
+        backend.open()
+        backend.loaded = 4
+        backend.compact()
+        self.assertEqual(backend.read_older(1), ['c'])
+        backend.close()
+
+    def test_background_compaction(self):
+        backend = self.make_log(['cmd%d' % (i % 5) for i in range(20)], max_load=2)
+        backend.load()
+        backend.append('new')
+        backend.close()
+        backend.open()
+        self.assertEqual([backend[i] for i in range(len(backend))],
+            ['cmd0', 'cmd1', 'cmd2', 'cmd3', 'cmd4', 'new'])
+        backend.close()
+        self.assertFalse(os.path.exists('history.compact'))
+
+    def test_compact_without_md5(self):
+        # MD5 is unavailable in FIPS mode
+        import hashlib
+        def md5(*args, **kw):
+            raise ValueError('disabled for FIPS')
+        backend = self.make_log(['a', 'b', 'a'])
+        backend.open()
+        saved = hashlib.md5
+        hashlib.md5 = md5
+        try:
+            backend.compact()
+        finally:
+            hashlib.md5 = saved
+        self.assertEqual(backend.error, None)
+        self.assertEqual([backend[i] for i in range(len(backend))], ['b', 'a'])
+        backend.close()
+
+    def test_compaction_error(self):
+        class FailingHistory(BinaryHistory):
+            def rewrite(self, m, offsets, count, end, tmpname):
+                with open(tmpname, 'wb') as f:
+                    f.write(b'partial')
+                raise IOError('disk full')
+        backend = self.make_log(['a', 'b', 'a'])
+        backend = FailingHistory('history')
+        backend.open()
+        backend.compact()
+        self.assertEqual(str(backend.error), 'disk full')
+        self.assertFalse(os.path.exists('history.compact'))
+        backend.append('c')
+        self.assertEqual([backend[i] for i in range(len(backend))], ['a', 'b', 'a', 'c'])
+        backend.close()
+
+    def test_close_error(self):
+        backend = self.make_log(['one'])
+        backend.open()
+        def fsync(fd):
+            raise OSError('fsync failed')
+        saved = os.fsync
+        os.fsync = fsync
+        try:
+            backend.close()
+        finally:
+            os.fsync = saved
+        self.assertEqual(str(backend.error), 'fsync failed')
+        self.assertEqual(backend.file, None)
+
+    def test_close_error_raised(self):
+        backend = self.make_log(['one'])
+        backend.open()
+        backend.error = OSError('failed')
+        self.assertRaises(OSError, backend.close, raise_exc=True)
+        self.assertEqual(backend.error, None)
+
+    def test_saved_offsets(self):
+        backend = self.make_log(['one', 'two'])
+        self.assertTrue(os.path.isfile('history.offsets'))
+        backend.open()
+        self.assertEqual(list(backend.offsets), [16, 23])
+        backend.append('three')
+        backend.close()
+        backend.open()
+        self.assertEqual(backend[2], 'three')
+        backend.close()
+
+    def test_bad_saved_offsets(self):
+        backend = self.make_log(['one', 'two'])
+        with open('history.offsets', 'wb') as f:
+            f.write(b'garbage')
+        backend.open()
+        self.assertEqual(list(backend.offsets), [16, 23])
+        backend.close()
+
+
+class SharedHistoryTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        reset()
+        with open('history', 'wt') as f:
+            f.write('old\n')
+        self.a = SharedHistory('history')
+        self.b = SharedHistory('history')
+        self.a.load()
+        self.b.load()
+        history.clear()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+        JailSetup.tearDown(self)
+
+    def test_load(self):
+        self.assertEqual(self.a.position, 4)
+
+    def test_truncated_by_other_session(self):
+        self.a.append('a1')
+        self.a.flush()
+        other = SharedHistory('history', max_entries=1)
+        other.truncate_ratio = 1
+        self.assertEqual(other.truncate(), True)
+        self.b.refresh()
+        self.assertEqual(list(history), [])
+        self.a.append('a2')
+        self.a.flush()
+        self.b.refresh()
+        self.assertEqual(list(history), ['a2'])
+        with open('history', 'rt') as f:
+            self.assertEqual(f.read(), 'a1\na2\n')
+
+    def test_other_session(self):
+        self.a.append('from a')
+        self.a.flush()
+        self.b.refresh()
+        self.assertEqual(list(history), ['from a'])
+
+    def test_own_lines_skipped(self):
+        self.a.append('from a')
+        self.a.flush()
+        self.a.refresh()
+        self.assertEqual(list(history), [])
+
+    def test_interleaved(self):
+        self.a.append('a1')
+        self.a.flush()
+        self.b.append('b1')
+        self.b.flush()
+        self.a.append('a2')
+        self.a.flush()
+        self.a.refresh()
+        self.assertEqual(list(history), ['b1'])
+        self.b.refresh()
+        self.assertEqual(list(history), ['b1', 'a1', 'a2'])
+        self.assertEqual(self.a.written, [])
+        self.assertEqual(self.b.written, [])
+
+    def test_incremental(self):
+        self.b.append('b1')
+        self.b.flush()
+        self.a.refresh()
+        self.a.refresh()
+        self.b.append('b2')
+        self.b.flush()
+        self.a.refresh()
+        self.assertEqual(list(history), ['b1', 'b2'])
+
+    def test_incomplete_line(self):
+        with open('history', 'ab') as f:
+            f.write(b'partial')
+        self.a.refresh()
+        self.assertEqual(list(history), [])
+        with open('history', 'ab') as f:
+            f.write(b' line\n')
+        self.a.refresh()
+        self.assertEqual(list(history), ['partial line'])
+
+    def test_truncated(self):
+        with open('history', 'wb') as f:
+            f.write(b'')
+        self.a.refresh()
+        self.assertEqual(self.a.position, 0)
+        with open('history', 'ab') as f:
+            f.write(b'new\n')
+        self.a.refresh()
+        self.assertEqual(list(history), ['new'])
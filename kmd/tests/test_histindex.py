@@ -0,0 +1,184 @@
+import sys
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+from kmd.testing import reset
+from kmd.testing import JailSetup
+from kmd.histindex import HistoryIndex
+from kmd.histindex import HistorySearch
+
+import kmd.histindex
+
+
+class HistoryIndexTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.index = HistoryIndex('history.idx')
+
+    def tearDown(self):
+        self.index.close()
+        JailSetup.tearDown(self)
+
+    def write(self, lines, mode='wt'):
+        with open('history', mode) as f:
+            for line in lines:
+                f.write(line + '\n')
+
+    def test_substring(self):
+        self.index.add(['git status', 'git commit -a', 'make test', 'git commit --amend'])
+        self.assertEqual(self.index.search('commit'), ['git commit --amend', 'git commit -a'])
+
+    def test_prefix_first(self):
+        self.index.add(['make test', 'git commit', 'test -f foo', 'run test'])
+        self.assertEqual(self.index.search('test'), ['test -f foo', 'run test', 'make test'])
+
+    def test_prefix(self):
+        self.index.add(['make test', 'make', 'test make'])
+        self.assertEqual(self.index.search('make', prefix=True), ['make', 'make test'])
+
+    def test_short_query(self):
+        self.index.add(['ls', 'cd foo', 'ls -l'])
+        self.assertEqual(self.index.search('l'), ['ls -l', 'ls'])
+        self.assertEqual(self.index.search('-'), ['ls -l'])
+
+    def test_no_match(self):
+        self.index.add(['git status'])
+        self.assertEqual(self.index.search('commit'), [])
+        self.assertEqual(self.index.search('tus st'), [])
+        self.assertEqual(self.index.search(''), [])
+
+    def test_grams_not_adjacent(self):
+        # All trigrams of the query occur, but not the query
+        self.index.add(['abcd bcde'])
+        self.assertEqual(self.index.search('abcde'), [])
+
+    def test_recency(self):
+        self.index.add(['echo a', 'echo b', 'echo a'])
+        self.assertEqual(self.index.search('echo'), ['echo a', 'echo b'])
+        self.assertEqual(len(self.index), 2)
+
+    def test_limit(self):
+        self.index.add(['cmd%d' % i for i in range(50)])
+        self.assertEqual(self.index.search('cmd', limit=3), ['cmd49', 'cmd48', 'cmd47'])
+        self.assertEqual(self.index.search('md4', limit=2), ['cmd49', 'cmd48'])
+
+    def test_large_candidate_set(self):
+        saved = kmd.histindex.MAX_FETCH
+        kmd.histindex.MAX_FETCH = 5
+        try:
+            self.index.add(['cmd%d' % i for i in range(50)])
+            self.assertEqual(self.index.search('md1', limit=3), ['cmd19', 'cmd18', 'cmd17'])
+        finally:
+            kmd.histindex.MAX_FETCH = saved
+
+    def test_large_prefix_set(self):
+        saved = kmd.histindex.MAX_FETCH
+        kmd.histindex.MAX_FETCH = 5
+        try:
+            self.index.add(['cmd%d' % i for i in range(50)] + ['cmd3'])
+            self.assertEqual(self.index.search('cmd', limit=3), ['cmd3', 'cmd49', 'cmd48'])
+            self.assertEqual(self.index.search('cmd', limit=3, prefix=True), ['cmd3', 'cmd49', 'cmd48'])
+            self.assertEqual(self.index.search('cmd4', limit=2, prefix=True), ['cmd49', 'cmd48'])
+        finally:
+            kmd.histindex.MAX_FETCH = saved
+
+    def test_update_without_md5(self):
+        # MD5 is unavailable in FIPS mode
+        import hashlib
+        def md5(*args, **kw):
+            raise ValueError('disabled for FIPS')
+        saved = hashlib.md5
+        hashlib.md5 = md5
+        try:
+            self.write(['ls', 'cd'])
+            self.assertEqual(self.index.update('history'), 2)
+            self.assertEqual(self.index.update('history'), 0)
+        finally:
+            hashlib.md5 = saved
+
+    def test_update(self):
+        self.write(['one', 'two'])
+        self.assertEqual(self.index.update('history'), 2)
+        self.write(['three'], 'at')
+        self.assertEqual(self.index.update('history'), 1)
+        self.assertEqual(self.index.update('history'), 0)
+        self.assertEqual(self.index.search('t'), ['three', 'two'])
+
+    def test_update_incomplete_line(self):
+        with open('history', 'wt') as f:
+            f.write('one\ntw')
+        self.assertEqual(self.index.update('history'), 1)
+        with open('history', 'at') as f:
+            f.write('o\n')
+        self.assertEqual(self.index.update('history'), 1)
+        self.assertEqual(self.index.search('two'), ['two'])
+
+    def test_update_rewritten(self):
+        self.write(['one', 'two'])
+        self.index.update('history')
+        self.write(['three', 'four', 'five'])
+        self.assertEqual(self.index.update('history'), 3)
+        self.assertEqual(len(self.index), 3)
+
+    def test_update_missing_file(self):
+        self.assertEqual(self.index.update('missing'), 0)
+
+    def test_compact(self):
+        for i in range(kmd.histindex.MAX_SEGMENTS + 2):
+            self.index.add(['cmd%d' % i])
+        self.assertEqual(self.index.get_meta('segments'), '3')
+        self.index.compact()
+        self.assertEqual(self.index.db.execute(
+            'SELECT COUNT(*) FROM postings WHERE gram = ?', ('cmd',)).fetchone()[0], 1)
+        self.assertEqual(self.index.postings('cmd'), set(range(1, kmd.histindex.MAX_SEGMENTS + 3)))
+
+    def test_persistent(self):
+        self.index.add(['git status'])
+        self.index.close()
+        self.index = HistoryIndex('history.idx')
+        self.assertEqual(self.index.search('stat'), ['git status'])
+
+
+class TestKmd(HistorySearch, Kmd):
+    history_file = 'history'
+
+
+class HistorySearchTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        reset()
+        with open('history', 'wt') as f:
+            f.write('git status\ngit commit\nmake\n')
+        self.shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+
+    def tearDown(self):
+        if self.shell.history_index is not None:
+            self.shell.history_index.close()
+        JailSetup.tearDown(self)
+
+    def test_search(self):
+        self.shell.onecmd('history search git')
+        self.assertEqual(self.shell.stdout.getvalue(), 'git commit\ngit status\n')
+
+    def test_search_prefix(self):
+        self.shell.onecmd('history search --prefix ma')
+        self.assertEqual(self.shell.stdout.getvalue(), 'make\n')
+
+    def test_usage(self):
+        self.shell.onecmd('history')
+        self.shell.onecmd('history search')
+        self.assertEqual(self.shell.stderr.getvalue(),
+            '*** Usage: history search [--prefix] <text>\n' * 2)
+
+    def test_postloop(self):
+        self.shell.preloop()
+        self.shell.postloop()
+        self.assertEqual(len(self.shell.history_index), 3)
+        self.assertEqual(self.shell.history_index.search('commit'), ['git commit'])
@@ -0,0 +1,187 @@
+import unittest
+
+from kmd import Kmd
+from kmd.index import CommandIndex
+from kmd.index import prefix_range
+from kmd.index import class_signature
+from kmd.index import invalidate
+
+
+class TestKmd(Kmd):
+
+    def do_shell(self, args):
+        return 'shell'
+
+    def do_show(self, args):
+        return 'show'
+
+    def do_echo(self, args):
+        return 'echo'
+
+    def complete_echo(self, text, *ignored):
+        return ['echo']
+
+    def help_echo(self):
+        pass
+
+
+class PrefixRangeTests(unittest.TestCase):
+
+    def test_range(self):
+        names = ['a', 'ab', 'abc', 'b', 'ba']
+        self.assertEqual(prefix_range(names, 'a'), (0, 3))
+        self.assertEqual(prefix_range(names, 'ab'), (1, 3))
+        self.assertEqual(prefix_range(names, 'b'), (3, 5))
+        self.assertEqual(prefix_range(names, 'c'), (5, 5))
+
+    def test_empty_prefix(self):
+        names = ['a', 'b']
+        self.assertEqual(prefix_range(names, ''), (0, 2))
+
+
+class CommandIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = CommandIndex(['do_shell', 'do_show', 'do_echo', 'help_echo', 'foo'])
+
+    def test_tables(self):
+        self.assertEqual(self.index.tables['do_'], ['echo', 'shell', 'show'])
+        self.assertEqual(self.index.tables['help_'], ['echo'])
+        self.assertEqual(self.index.tables['complete_'], [])
+
+    def test_contains(self):
+        self.assertTrue('do_echo' in self.index)
+        self.assertFalse('do_ech' in self.index)
+
+    def test_match(self):
+        self.assertEqual(self.index.match('do_', 'sh'), ['shell', 'show'])
+        self.assertEqual(self.index.match('do_', ''), ['echo', 'shell', 'show'])
+        self.assertEqual(self.index.match('do_', 'x'), [])
+
+    def test_expand_exact(self):
+        self.assertEqual(self.index.expand('do_', 'show'), 'do_show')
+
+    def test_expand_unique(self):
+        self.assertEqual(self.index.expand('do_', 'she'), 'do_shell')
+        self.assertEqual(self.index.expand('help_', 'e'), 'help_echo')
+
+    def test_expand_ambiguous(self):
+        self.assertEqual(self.index.expand('do_', 'sh'), None)
+
+    def test_expand_unknown(self):
+        self.assertEqual(self.index.expand('do_', 'x'), None)
+
+    def test_expand_alias(self):
+        self.assertEqual(self.index.expand('do_', '!', {'!': 'shell'}), 'do_shell')
+
+
+class GetAttrTests(unittest.TestCase):
+
+    def test_abbreviation(self):
+        shell = TestKmd()
+        self.assertEqual(shell.do_e(''), 'echo')
+        self.assertEqual(shell.do_she(''), 'shell')
+        self.assertEqual(shell.complete_ec('', '', 0, 0), ['echo'])
+
+    def test_ambiguous(self):
+        shell = TestKmd()
+        self.assertRaises(AttributeError, getattr, shell, 'do_sh')
+
+    def test_alias(self):
+        shell = TestKmd()
+        self.assertEqual(getattr(shell, 'do_!')(''), 'shell')
+
+    def test_not_a_command(self):
+        shell = TestKmd()
+        self.assertRaises(AttributeError, getattr, shell, 'foo')
+
+    def test_completenames(self):
+        shell = TestKmd()
+        self.assertEqual(shell.completenames('sh'), ['shell', 'show'])
+        self.assertEqual(shell.completenames(''), ['echo', 'help', 'shell', 'show'])
+
+    def test_onecmd(self):
+        shell = TestKmd()
+        self.assertEqual(shell.onecmd('ec'), 'echo')
+        self.assertEqual(shell.onecmd('!ls'), 'shell')
+
+
+class InvalidationTests(unittest.TestCase):
+
+    def test_method_added(self):
+        class MyKmd(TestKmd):
+            pass
+        shell = MyKmd()
+        self.assertEqual(shell.onecmd('e'), 'echo')
+        MyKmd.do_exit = lambda self, args: 'exit'
+        self.assertRaises(AttributeError, getattr, shell, 'do_e')
+        self.assertEqual(shell.onecmd('ex'), 'exit')
+        self.assertEqual(shell.completenames('ex'), ['exit'])
+        del MyKmd.do_exit
+        self.assertEqual(shell.onecmd('e'), 'echo')
+
+    def test_method_added_and_removed(self):
+        class MyKmd(TestKmd):
+            def do_foo(self, args):
+                return 'foo'
+        shell = MyKmd()
+        self.assertEqual(shell.completenames('f'), ['foo'])
+        # Same number of attributes, different names
+        del MyKmd.do_foo
+        MyKmd.do_bar = lambda self, args: 'bar'
+        self.assertEqual(shell.completenames('f'), [])
+        self.assertEqual(shell.completenames('b'), ['bar'])
+        self.assertEqual(shell.onecmd('b'), 'bar')
+
+    def test_base_method_renamed(self):
+        class Base(Kmd):
+            def do_one(self, args):
+                return 'one'
+        class MyKmd(Base):
+            pass
+        shell = MyKmd()
+        self.assertEqual(shell.completenames('o'), ['one'])
+        Base.do_two = Base.do_one
+        del Base.do_one
+        self.assertEqual(shell.completenames('o'), [])
+        self.assertEqual(shell.onecmd('tw'), 'one')
+
+    def test_signature(self):
+        class MyKmd(TestKmd):
+            pass
+        signature = class_signature(MyKmd)
+        MyKmd.prompt = '> '
+        self.assertEqual(class_signature(MyKmd), signature)
+        MyKmd.help_foo = lambda self: None
+        self.assertNotEqual(class_signature(MyKmd), signature)
+        signature = class_signature(MyKmd)
+        del MyKmd.help_foo
+        self.assertNotEqual(class_signature(MyKmd), signature)
+
+    def test_index_cached(self):
+        class MyKmd(TestKmd):
+            pass
+        shell = MyKmd()
+        index = shell.get_index()
+        MyKmd.prompt = '> '
+        self.assertTrue(shell.get_index() is index)
+        TestKmd.do_extra = lambda self, args: 'extra'
+        try:
+            self.assertFalse(shell.get_index() is index)
+            self.assertEqual(shell.onecmd('ext'), 'extra')
+        finally:
+            del TestKmd.do_extra
+
+    def test_invalidate(self):
+        class Mixin(object):
+            pass
+        class MyKmd(Mixin, TestKmd):
+            pass
+        shell = MyKmd()
+        self.assertEqual(shell.completenames('mix'), [])
+        Mixin.do_mixed = lambda self, args: 'mixed'
+        invalidate()
+        self.assertEqual(shell.completenames('mix'), ['mixed'])
+
+    def test_shared_per_class(self):
+        self.assertTrue(TestKmd().get_index() is TestKmd().get_index())
@@ -0,0 +1,161 @@
+import sys
+import threading
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+from kmd.jobs import JobControl
+from kmd.jobs import run_job
+
+
+class TestKmd(JobControl, Kmd):
+
+    job_max_workers = 1
+
+    def __init__(self, *args, **kw):
+        Kmd.__init__(self, *args, **kw)
+        self.event = threading.Event()
+        self.started = threading.Event()
+
+    def do_echo(self, args):
+        self.stdout.write(args + '\n')
+
+    def do_block(self, args):
+        self.started.set()
+        self.event.wait(5)
+        self.stdout.write('unblocked\n')
+
+    def do_fail(self, args):
+        raise ValueError(args)
+
+    def do_err(self, args):
+        self.stderr.write(args + '\n')
+
+
+class ProcessKmd(TestKmd):
+
+    job_pool = 'process'
+
+
+class JobControlTests(unittest.TestCase):
+
+    def setUp(self):
+        self.shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+
+    def tearDown(self):
+        self.shell.event.set()
+        if self.shell.job_executor is not None:
+            self.shell.job_executor.shutdown()
+
+    def test_foreground(self):
+        self.shell.onecmd('echo a')
+        self.assertEqual(self.shell.stdout.getvalue(), 'a\n')
+        self.assertEqual(self.shell.jobs, None)
+
+    def test_background(self):
+        self.shell.onecmd('echo a &')
+        self.shell.onecmd('wait')
+        self.assertEqual(self.shell.stdout.getvalue(), '[1] echo a\n[1] Done      echo a\na\n')
+        self.assertEqual(self.shell.jobs, {})
+
+    def test_background_stderr(self):
+        self.shell.onecmd('err a&')
+        self.shell.onecmd('wait')
+        self.assertEqual(self.shell.stderr.getvalue(), 'a\n')
+
+    def test_quoted_ampersand(self):
+        self.shell.onecmd('echo a\\&')
+        self.assertEqual(self.shell.stdout.getvalue(), 'a\\&\n')
+
+    def test_double_quoted_ampersand(self):
+        self.shell.onecmd('echo "a &')
+        self.assertEqual(self.shell.stdout.getvalue(), '"a &\n')
+        self.assertEqual(self.shell.jobs, None)
+
+    def test_comment(self):
+        self.shell.onecmd('# echo a &')
+        self.assertEqual(self.shell.stdout.getvalue(), '')
+
+    def test_unknown_command(self):
+        self.shell.onecmd('&')
+        self.assertEqual(self.shell.stderr.getvalue(), '*** Unknown syntax: &\n')
+
+    def test_failed(self):
+        self.shell.onecmd('fail oops &')
+        self.shell.onecmd('wait')
+        self.assertEqual(self.shell.stdout.getvalue(), '[1] fail oops\n[1] Failed    fail oops\n')
+        self.assertEqual(self.shell.stderr.getvalue(), '*** ValueError: oops\n')
+
+    def test_jobs(self):
+        self.shell.onecmd('block &')
+        self.shell.onecmd('echo a &')
+        self.shell.started.wait(5)
+        self.shell.stdout = StringIO()
+        self.shell.onecmd('jobs')
+        self.assertEqual(self.shell.stdout.getvalue(),
+            '[1] Running   block\n[2] Pending   echo a\n')
+
+    def test_reported_before_next_command(self):
+        self.shell.onecmd('block &')
+        self.shell.event.set()
+        self.shell.jobs[1].future.result()
+        self.shell.onecmd('echo b')
+        self.assertEqual(self.shell.stdout.getvalue(),
+            '[1] block\n[1] Done      block\nunblocked\nb\n')
+
+    def test_kill_pending(self):
+        self.shell.onecmd('block &')
+        self.shell.onecmd('echo a &')
+        self.shell.onecmd('kill 2')
+        self.assertEqual(self.shell.stdout.getvalue(),
+            '[1] block\n[2] echo a\n[2] Cancelled echo a\n')
+
+    def test_kill_running(self):
+        self.shell.onecmd('block &')
+        self.shell.started.wait(5)
+        self.shell.onecmd('kill %1')
+        self.assertEqual(self.shell.stderr.getvalue(), '*** Cannot kill running job: 1\n')
+
+    def test_postloop(self):
+        self.shell.onecmd('block &')
+        self.shell.onecmd('echo a &')
+        self.shell.started.wait(5)
+        self.shell.event.set()
+        self.shell.postloop()
+        self.assertEqual(self.shell.job_executor, None)
+        self.assertEqual(self.shell.stdout.getvalue(),
+            '[1] block\n[2] echo a\n[1] Done      block\nunblocked\n[2] Cancelled echo a\n')
+
+    def test_no_such_job(self):
+        self.shell.onecmd('wait 7')
+        self.assertEqual(self.shell.stderr.getvalue(), '*** No such job: 7\n')
+
+    def test_not_repeated_by_emptyline(self):
+        self.shell.onecmd('echo a &')
+        self.assertEqual(self.shell.lastcmd, '')
+
+
+class ProcessPoolTests(unittest.TestCase):
+
+    def test_background(self):
+        shell = ProcessKmd(stdout=StringIO(), stderr=StringIO())
+        try:
+            shell.onecmd('echo a &')
+            shell.onecmd('wait')
+        finally:
+            shell.job_executor.shutdown()
+        self.assertEqual(shell.stdout.getvalue(), '[1] echo a\n[1] Done      echo a\na\n')
+
+
+class RunJobTests(unittest.TestCase):
+
+    def test_instance(self):
+        shell = TestKmd()
+        self.assertEqual(run_job(shell, 'echo a'), ('a\n', ''))
+
+    def test_class(self):
+        self.assertEqual(run_job(TestKmd, 'err a'), ('', 'a\n'))
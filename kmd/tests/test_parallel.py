@@ -0,0 +1,101 @@
+import os
+import sys
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+from kmd.testing import JailSetup
+from kmd.parallel import ParallelRunner
+
+
+class TestKmd(Kmd):
+
+    preloops = 0
+
+    def preloop(self):
+        super(TestKmd, self).preloop()
+        self.preloops += 1
+
+    def postloop(self):
+        super(TestKmd, self).postloop()
+        with open('postloop-%d' % os.getpid(), 'wt') as f:
+            f.write('done\n')
+
+    def do_echo(self, args):
+        self.stdout.write(args + '\n')
+
+    def do_warn(self, args):
+        self.stderr.write(args + '\n')
+
+    def do_fail(self, args):
+        raise ValueError(args)
+
+    def do_pid(self, args):
+        self.stdout.write('%d\n' % os.getpid())
+
+    def do_preloops(self, args):
+        self.stdout.write('%d\n' % self.preloops)
+
+
+class ParallelRunnerTests(JailSetup):
+
+    def test_map(self):
+        runner = ParallelRunner(TestKmd, processes=2)
+        results = list(runner.map(['echo %d\n' % i for i in range(100)]))
+        self.assertEqual([x.stdout for x in results], ['%d\n' % i for i in range(100)])
+        self.assertEqual([x.number for x in results], list(range(1, 101)))
+        self.assertEqual(results[0].line, 'echo 0')
+        self.assertEqual(runner.count, 100)
+        self.assertEqual(runner.errors, 0)
+        self.assertTrue(runner.rate > 0)
+
+    def test_chunksize(self):
+        runner = ParallelRunner(TestKmd, processes=3, chunksize=7)
+        results = list(runner.map('echo %d' % i for i in range(100)))
+        self.assertEqual([x.stdout for x in results], ['%d\n' % i for i in range(100)])
+
+    def test_worker_processes(self):
+        runner = ParallelRunner(TestKmd, processes=2)
+        pids = set(x.stdout for x in runner.map(['pid'] * 20))
+        self.assertFalse('%d\n' % os.getpid() in pids)
+
+    def test_preloop_runs_once(self):
+        runner = ParallelRunner(TestKmd, processes=2)
+        results = list(runner.map(['preloops'] * 20))
+        self.assertEqual(set(x.stdout for x in results), set(['1\n']))
+
+    def test_postloop_runs_at_exit(self):
+        runner = ParallelRunner(TestKmd, processes=2)
+        list(runner.map(['echo'] * 20))
+        self.assertTrue([x for x in os.listdir('.') if x.startswith('postloop-')])
+
+    def test_errors(self):
+        runner = ParallelRunner(TestKmd, processes=2)
+        results = list(runner.map(['echo ok', 'fail bad', 'warn oops']))
+        self.assertEqual([x.error for x in results], [False, True, False])
+        self.assertEqual(results[1].stderr, '*** Error in line 2: ValueError: bad\n')
+        self.assertEqual(results[2].stderr, 'oops\n')
+        self.assertEqual(runner.errors, 1)
+
+    def test_run(self):
+        stdout, stderr = StringIO(), StringIO()
+        runner = ParallelRunner(TestKmd, processes=2, chunksize=2)
+        self.assertEqual(runner.run(['echo a', 'warn b', 'echo c'], stdout, stderr), 0)
+        self.assertEqual(stdout.getvalue(), 'a\nc\n')
+        self.assertTrue(stderr.getvalue().startswith('b\n3 lines in '))
+        self.assertTrue(stderr.getvalue().endswith(' lines/sec)\n'))
+
+    def test_run_with_errors(self):
+        stdout, stderr = StringIO(), StringIO()
+        runner = ParallelRunner(TestKmd, processes=2)
+        self.assertEqual(runner.run(['fail x'], stdout, stderr), 1)
+
+    def test_stop_early(self):
+        runner = ParallelRunner(TestKmd, processes=2)
+        for result in runner.map(['echo'] * 1000):
+            break
+        self.assertEqual(runner.count, 1)
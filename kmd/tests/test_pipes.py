@@ -0,0 +1,192 @@
+import sys
+import itertools
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from rl import completer
+
+from kmd import Kmd
+from kmd.pipes import Pipelines
+from kmd.pipes import consumer
+from kmd.pipes import split_pipeline
+from kmd.quoting import QUOTE_CHARACTERS
+from kmd.testing import reset
+
+
+class TestKmd(Pipelines, Kmd):
+
+    def __init__(self, *args, **kw):
+        Kmd.__init__(self, *args, **kw)
+        self.events = []
+
+    def do_echo(self, args):
+        for word in args.split():
+            self.stdout.write(word + '\n')
+
+    def do_numbers(self, args):
+        for i in itertools.count():
+            if args and i >= int(args):
+                break
+            self.events.append('produce %d' % i)
+            yield i
+
+    @consumer
+    def do_even(self, args, input):
+        for item in input:
+            if item % 2 == 0:
+                yield item
+
+    @consumer
+    def do_head(self, args, input):
+        """Show the first items."""
+        for item in itertools.islice(input, int(args)):
+            self.events.append('consume %s' % item)
+            yield item
+
+    @consumer
+    def do_upper(self, args, input):
+        for line in input:
+            yield line.upper()
+
+    def do_log(self, args):
+        for word in args.split():
+            self.stdout.write('log %s\n' % word)
+            yield word
+
+    @consumer
+    def do_count(self, args, input):
+        self.stdout.write('%d\n' % sum(1 for x in input))
+
+    def do_quit(self, args):
+        return True
+
+    def do_shell(self, args):
+        self.stdout.write('shell: %s\n' % args)
+
+
+class SplitPipelineTests(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        completer.quote_characters = QUOTE_CHARACTERS
+
+    def test_split(self):
+        self.assertEqual(split_pipeline('a | b|c'), ['a ', ' b', 'c'])
+
+    def test_no_pipe(self):
+        self.assertEqual(split_pipeline('a b'), ['a b'])
+
+    def test_quoted(self):
+        self.assertEqual(split_pipeline('a "x|y" \'|\' \\| | b'), ['a "x|y" \'|\' \\| ', ' b'])
+
+
+class PipelinesTests(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        completer.quote_characters = QUOTE_CHARACTERS
+        self.shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+
+    def test_generator_output(self):
+        self.shell.onecmd('numbers 3')
+        self.assertEqual(self.shell.stdout.getvalue(), '0\n1\n2\n')
+
+    def test_pipeline(self):
+        self.shell.onecmd('numbers 10 | even')
+        self.assertEqual(self.shell.stdout.getvalue(), '0\n2\n4\n6\n8\n')
+
+    def test_three_stages(self):
+        self.shell.onecmd('numbers 100 | even | count')
+        self.assertEqual(self.shell.stdout.getvalue(), '50\n')
+
+    def test_infinite_producer(self):
+        self.shell.onecmd('numbers | head 3')
+        self.assertEqual(self.shell.stdout.getvalue(), '0\n1\n2\n')
+
+    def test_items_flow_one_at_a_time(self):
+        self.shell.onecmd('numbers | head 2')
+        self.assertEqual(self.shell.events,
+            ['produce 0', 'consume 0', 'produce 1', 'consume 1'])
+
+    def test_buffered_stdout(self):
+        self.shell.onecmd('echo a b | upper')
+        self.assertEqual(self.shell.stdout.getvalue(), 'A\nB\n')
+
+    def test_generator_stdout(self):
+        self.shell.onecmd('log a b | upper')
+        self.assertEqual(self.shell.stdout.getvalue(), 'LOG A\nA\nLOG B\nB\n')
+
+    def test_generator_stdout_restored(self):
+        stdout = self.shell.stdout
+        self.shell.onecmd('log a b | upper | count')
+        self.assertEqual(stdout.getvalue(), '4\n')
+        self.assertTrue(self.shell.stdout is stdout)
+
+    def test_consumer_without_input(self):
+        self.shell.onecmd('count')
+        self.assertEqual(self.shell.stdout.getvalue(), '0\n')
+
+    def test_last_stage_ignores_input(self):
+        self.shell.onecmd('numbers | echo x')
+        self.assertEqual(self.shell.stdout.getvalue(), 'x\n')
+        self.assertEqual(self.shell.events, [])
+
+    def test_abbreviated_commands(self):
+        self.shell.onecmd('num 4 | ev')
+        self.assertEqual(self.shell.stdout.getvalue(), '0\n2\n')
+
+    def test_dispatch_table(self):
+        self.shell.use_dispatch_table = True
+        self.shell.onecmd('numbers 4 | even')
+        self.assertEqual(self.shell.stdout.getvalue(), '0\n2\n')
+
+    def test_quoted_pipe(self):
+        self.shell.onecmd('echo "a|b"')
+        self.assertEqual(self.shell.stdout.getvalue(), '"a|b"\n')
+
+    def test_empty_stage(self):
+        self.shell.onecmd('numbers 3 |')
+        self.assertEqual(self.shell.stderr.getvalue(), '*** Unknown syntax: numbers 3 |\n')
+
+    def test_shell_escape(self):
+        self.shell.onecmd('!ls | wc')
+        self.assertEqual(self.shell.stdout.getvalue(), 'shell: ls | wc\n')
+
+    def test_stop_flag(self):
+        self.assertEqual(self.shell.onecmd('numbers 3 | quit'), True)
+
+    def test_lastcmd(self):
+        self.shell.onecmd('numbers 3 | even')
+        self.assertEqual(self.shell.lastcmd, 'numbers 3 | even')
+
+    def test_pipeline_input_reset(self):
+        self.shell.onecmd('numbers 3 | echo x')
+        self.assertEqual(self.shell.pipeline_input, None)
+
+    def test_consumer_help(self):
+        self.shell.onecmd('help head')
+        self.assertEqual(self.shell.stdout.getvalue(), 'Show the first items.\n')
+
+
+class NonInteractivePipelinesTests(unittest.TestCase):
+    # Readline's quote characters are not configured outside the cmdloop
+
+    def setUp(self):
+        reset()
+        completer.quote_characters = ''
+        self.shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+
+    def test_split_quoted(self):
+        self.assertEqual(split_pipeline('a "x|y" | b'), ['a "x|y" ', ' b'])
+
+    def test_quoted_pipe(self):
+        self.shell.onecmd('echo "a|b"')
+        self.assertEqual(self.shell.stdout.getvalue(), '"a|b"\n')
+
+    def test_script(self):
+        self.assertEqual(self.shell.run(script=['echo "a|b" \'c|d\'', 'echo x | upper']), 0)
+        self.assertEqual(self.shell.stdout.getvalue(), '"a|b"\n\'c|d\'\nX\n')
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+from kmd.testing import JailSetup
+from kmd.plugins import PluginRegistry
+
+import kmd.plugins
+
+PLUGIN = '''\
+def do_greet(self, args):
+    """Usage: greet <name>"""
+    self.stdout.write('Hello %s\\n' % args)
+
+def do_count(self, args):
+    self.stdout.write('%d\\n' % len(args.split()))
+'''
+
+
+class PluginSetup(JailSetup):
+
+    modname = 'kmdtestplugin'
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        f = open(self.modname + '.py', 'wt')
+        f.write(PLUGIN)
+        f.close()
+        sys.path.insert(0, self.tempdir)
+        sys.modules.pop(self.modname, None)
+
+    def tearDown(self):
+        sys.path.remove(self.tempdir)
+        sys.modules.pop(self.modname, None)
+        JailSetup.tearDown(self)
+
+    def make_shell(self, registry):
+        class TestKmd(Kmd):
+            plugins = registry
+            def do_grep(self, args):
+                pass
+        return TestKmd(stdout=StringIO(), stderr=StringIO())
+
+    def imported(self):
+        return self.modname in sys.modules
+
+
+class PluginTests(PluginSetup):
+
+    def setUp(self):
+        PluginSetup.setUp(self)
+        self.shell = self.make_shell(PluginRegistry({
+            'greet': ('kmdtestplugin:do_greet', 'Usage: greet <name>'),
+            'count': 'kmdtestplugin:do_count',
+        }))
+
+    def test_completenames(self):
+        self.assertEqual(self.shell.completenames('gr'), ['greet', 'grep'])
+        self.assertEqual(self.shell.completenames('c'), ['count'])
+        self.assertFalse(self.imported())
+
+    def test_dispatch(self):
+        self.shell.onecmd('greet world')
+        self.assertEqual(self.shell.stdout.getvalue(), 'Hello world\n')
+        self.assertTrue(self.imported())
+
+    def test_abbreviation(self):
+        self.shell.onecmd('gree world')
+        self.assertEqual(self.shell.stdout.getvalue(), 'Hello world\n')
+
+    def test_ambiguous(self):
+        self.shell.onecmd('gr world')
+        self.assertEqual(self.shell.stderr.getvalue(), '*** Unknown syntax: gr world\n')
+        self.assertFalse(self.imported())
+
+    def test_bound_method_cached(self):
+        self.shell.onecmd('count a b')
+        self.assertTrue(self.shell.do_count is self.shell.do_count)
+        self.assertEqual(self.shell.stdout.getvalue(), '2\n')
+
+    def test_dispatch_table(self):
+        self.shell.use_dispatch_table = True
+        self.shell.build_dispatch_table()
+        self.assertFalse(self.imported())
+        self.shell.onecmd('cou a b c')
+        self.assertEqual(self.shell.stdout.getvalue(), '3\n')
+
+    def test_help_topic_from_metadata(self):
+        self.shell.onecmd('help greet')
+        self.assertEqual(self.shell.stdout.getvalue(), 'Usage: greet <name>\n')
+        self.assertFalse(self.imported())
+
+    def test_help_topic_imports(self):
+        self.shell.onecmd('help count')
+        self.assertEqual(self.shell.stderr.getvalue(), '*** No help on count\n')
+        self.assertTrue(self.imported())
+
+    def test_help_screen(self):
+        self.shell.onecmd('help')
+        self.assertTrue('========\ncount  greet\n' in self.shell.stdout.getvalue())
+        self.assertFalse(self.imported())
+
+    def test_help_screen_after_import(self):
+        self.shell.onecmd('count')
+        self.shell.onecmd('help')
+        output = self.shell.stdout.getvalue()
+        self.assertTrue('========\ngreet\n' in output)
+        self.assertTrue('======\ncount  grep  help\n' in output)
+
+    def test_register(self):
+        self.shell.plugins.register('hello', 'kmdtestplugin:do_greet')
+        self.shell.onecmd('hello world')
+        self.assertEqual(self.shell.stdout.getvalue(), 'Hello world\n')
+
+
+class EntryPointTests(PluginSetup):
+
+    def setUp(self):
+        PluginSetup.setUp(self)
+        self.scans = 0
+        self.iter_entry_points = kmd.plugins.iter_entry_points
+        def iter_entry_points(group):
+            self.scans += 1
+            yield 'greet', 'kmdtestplugin:do_greet'
+        kmd.plugins.iter_entry_points = iter_entry_points
+
+    def tearDown(self):
+        kmd.plugins.iter_entry_points = self.iter_entry_points
+        PluginSetup.tearDown(self)
+
+    def test_discover(self):
+        registry = PluginRegistry(group='kmd.test', cache_file='cache.json')
+        self.assertEqual(registry.names(), ['greet'])
+        self.assertEqual(registry.get('greet').doc, None)
+
+    def test_cached(self):
+        PluginRegistry(group='kmd.test', cache_file='cache.json')
+        PluginRegistry(group='kmd.test', cache_file='cache.json')
+        self.assertEqual(self.scans, 1)
+
+    def test_stale_cache(self):
+        PluginRegistry(group='kmd.test', cache_file='cache.json')
+        f = open('cache.json', 'rt')
+        data = json.load(f)
+        f.close()
+        data['fingerprint'] = [['site-packages', 0]]
+        f = open('cache.json', 'wt')
+        json.dump(data, f)
+        f.close()
+        PluginRegistry(group='kmd.test', cache_file='cache.json')
+        self.assertEqual(self.scans, 2)
+
+    def test_doc_remembered(self):
+        shell = self.make_shell(PluginRegistry(group='kmd.test', cache_file='cache.json'))
+        shell.onecmd('greet world')
+        registry = PluginRegistry(group='kmd.test', cache_file='cache.json')
+        self.assertEqual(registry.get('greet').doc, 'Usage: greet <name>')
+
+    def test_default_cache_file(self):
+        os.environ['XDG_CACHE_HOME'] = self.tempdir
+        try:
+            PluginRegistry(group='kmd.test')
+        finally:
+            del os.environ['XDG_CACHE_HOME']
+        self.assertTrue(os.path.isfile(os.path.join('kmd', 'plugins-kmd.test.json')))
@@ -0,0 +1,226 @@
+import os
+import sys
+import stat
+import time
+import socket
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+from kmd.testing import JailSetup
+from kmd.prefork import ForkServer
+from kmd.client import Client
+
+
+class TestKmd(Kmd):
+
+    warmed = False
+
+    def do_echo(self, args):
+        self.stdout.write(args + '\n')
+
+    def do_pid(self, args):
+        self.stdout.write('%d\n' % os.getpid())
+
+    def do_warmed(self, args):
+        self.stdout.write('%s\n' % TestKmd.warmed)
+
+    def do_quit(self, args):
+        return True
+
+    def do_EOF(self, args):
+        return True
+
+
+class TestForkServer(ForkServer):
+
+    def warm(self):
+        super(TestForkServer, self).warm()
+        TestKmd.warmed = True
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.01)
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+@unittest.skipIf(not hasattr(os, 'fork') or not hasattr(socket, 'AF_UNIX'),
+                 'Requires fork and Unix domain sockets')
+class ForkServerTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.clients = []
+        self.server = None
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        if self.server is not None:
+            self.server.shutdown()
+        TestKmd.warmed = False
+        JailSetup.tearDown(self)
+
+    def start(self, **config):
+        self.server = TestForkServer(TestKmd, os.path.join(self.tempdir, 'kmd.sock'), **config)
+        self.server.start(0.01)
+        wait_for(lambda: self.server.idle >= self.server.min_idle)
+        return self.server
+
+    def connect(self):
+        client = Client(self.server.address, stdout=StringIO(), stderr=StringIO())
+        self.clients.append(client)
+        return client
+
+    def run_line(self, client, line):
+        client.send({'line': line})
+        return client.receive()
+
+    def session_pid(self):
+        client = self.connect()
+        client.receive()
+        self.run_line(client, 'pid')
+        self.run_line(client, 'quit')
+        return int(client.stdout.getvalue())
+
+    def test_session(self):
+        self.start()
+        client = self.connect()
+        self.assertEqual(client.receive(), {'prompt': '(Kmd) '})
+        self.assertEqual(self.run_line(client, 'echo hello'), {'prompt': '(Kmd) '})
+        self.assertEqual(self.run_line(client, 'quit'), {'exit': True})
+        self.assertEqual(client.stdout.getvalue(), 'hello\n')
+
+    def test_complete(self):
+        self.start()
+        client = self.connect()
+        client.receive()
+        client.send({'complete': ['ec', 'ec', 0, 2]})
+        self.assertEqual(client.receive(), {'matches': ['echo']})
+
+    def test_warm(self):
+        self.start()
+        client = self.connect()
+        client.receive()
+        self.run_line(client, 'warmed')
+        self.assertEqual(client.stdout.getvalue(), 'True\n')
+
+    def test_session_runs_in_worker(self):
+        self.start()
+        pid = self.session_pid()
+        self.assertNotEqual(pid, os.getpid())
+
+    def test_concurrent_sessions(self):
+        self.start(min_idle=1, max_idle=4)
+        a = self.connect()
+        b = self.connect()
+        a.receive()
+        b.receive()
+        self.run_line(a, 'pid')
+        self.run_line(b, 'pid')
+        self.assertNotEqual(a.stdout.getvalue(), b.stdout.getvalue())
+
+    def test_min_idle(self):
+        server = self.start(min_idle=3, max_idle=3)
+        self.assertEqual(len(server.workers), 3)
+        client = self.connect()
+        client.receive()
+        wait_for(lambda: len(server.workers) == 4)
+        self.assertEqual(server.idle, 3)
+        self.assertEqual(server.sessions, 1)
+
+    def test_max_idle(self):
+        server = self.start(min_idle=1, max_idle=1)
+        clients = [self.connect() for i in range(3)]
+        for client in clients:
+            client.receive()
+        wait_for(lambda: len(server.workers) >= 4)
+        for client in clients:
+            self.run_line(client, 'quit')
+        wait_for(lambda: len(server.workers) == 1)
+        self.assertEqual(server.idle, 1)
+
+    def test_max_workers(self):
+        server = self.start(min_idle=1, max_idle=1, max_workers=2)
+        a = self.connect()
+        b = self.connect()
+        a.receive()
+        b.receive()
+        time.sleep(0.1)
+        self.assertEqual(len(server.workers), 2)
+        self.assertEqual(server.idle, 0)
+
+    def test_max_sessions(self):
+        self.start(min_idle=1, max_idle=1, max_sessions=1)
+        pids = set(self.session_pid() for i in range(3))
+        self.assertEqual(len(pids), 3)
+
+    def test_recycling(self):
+        server = self.start(min_idle=1, max_idle=1, max_sessions=2)
+        pids = [self.session_pid() for i in range(6)]
+        for pid in pids:
+            self.assertTrue(pids.count(pid) <= 2)
+        wait_for(lambda: server.sessions == 6)
+
+    def test_shutdown(self):
+        server = self.start()
+        pids = list(server.workers)
+        server.shutdown()
+        self.server = None
+        for pid in pids:
+            self.assertFalse(is_running(pid))
+        self.assertFalse(os.path.exists(server.address))
+
+    def test_invalid_config(self):
+        address = os.path.join(self.tempdir, 'kmd.sock')
+        self.assertRaises(ValueError, ForkServer, TestKmd, address, min_idle=0)
+        self.assertRaises(ValueError, ForkServer, TestKmd, address, min_idle=3, max_idle=2)
+        self.assertRaises(ValueError, ForkServer, TestKmd, address, max_idle=4, max_workers=2)
+
+    def test_socket_mode(self):
+        server = self.start()
+        self.assertEqual(stat.S_IMODE(os.stat(server.address).st_mode), 0o600)
+
+    def test_file_not_removed(self):
+        self.mkfile('kmd.sock')
+        address = os.path.join(self.tempdir, 'kmd.sock')
+        self.assertRaises(socket.error, ForkServer, TestKmd, address)
+        self.assertTrue(os.path.isfile(address))
+
+    def test_close_in_worker(self):
+        server = self.start()
+        pid = os.fork()
+        if pid == 0:
+            # Pretend to be a worker closing its copy of the server
+            try:
+                server.close()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertTrue(os.path.exists(server.address))
+
+    def test_requires_fork(self):
+        fork = os.fork
+        del os.fork
+        try:
+            self.assertRaises(RuntimeError, ForkServer, TestKmd, ('127.0.0.1', 0))
+        finally:
+            os.fork = fork
+
+    def test_reject_remote(self):
+        self.assertRaises(ValueError, ForkServer, TestKmd, ('0.0.0.0', 0))
@@ -0,0 +1,164 @@
+import gc
+import os
+import sys
+import json
+import weakref
+import unittest
+import subprocess
+
+from rl import completion
+from rl import readline
+
+from kmd import Kmd
+from kmd.testing import reset
+from kmd.testing import JailSetup
+from kmd.caching import cacheable
+from kmd.profiling import CompletionProfiler
+
+import kmd
+
+TAB = '\t'
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(kmd.__file__)))
+
+PROFILE_SCRIPT = """\
+from rl import completion
+from rl import readline
+from kmd import Kmd
+shell = Kmd()
+shell.preloop()
+completion.line_buffer = 'he'
+readline.complete_internal('\\t')
+shell.postloop()
+"""
+
+
+class TestKmd(Kmd):
+
+    def complete_slow(self, text, *ignored):
+        for x in ('alpha', 'alpine', 'beta'):
+            if x.startswith(text):
+                yield x
+
+    def complete_none(self, text, *ignored):
+        return []
+
+    @cacheable
+    def complete_cached(self, text, *ignored):
+        return [x for x in ('alpha', 'alpine', 'beta') if x.startswith(text)]
+
+
+class CompletionProfilerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.profiler = CompletionProfiler()
+
+    def test_wrap(self):
+        def complete_foo(text, *ignored):
+            return ['foo', 'foobar']
+        wrapper = self.profiler.wrap(complete_foo)
+        self.assertEqual(list(wrapper('f', 'x f', 2, 3)), ['foo', 'foobar'])
+        stat = self.profiler.get('complete_foo')
+        self.assertEqual(stat.calls, 1)
+        self.assertEqual(stat.matches, 2)
+        self.assertEqual(stat.first_match.count, 1)
+
+    def test_wrap_is_lazy(self):
+        def complete_foo(text, *ignored):
+            yield 'foo'
+            raise AssertionError('consumed too far')
+        matches = self.profiler.wrap(complete_foo)('f', 'x f', 2, 3)
+        self.assertEqual(self.profiler.get('complete_foo'), None)
+        self.assertEqual(next(matches), 'foo')
+        matches.close()
+        stat = self.profiler.get('complete_foo')
+        self.assertEqual(stat.calls, 1)
+        self.assertEqual(stat.matches, 1)
+
+    def test_wrapper_reused(self):
+        shell = TestKmd()
+        self.assertEqual(self.profiler.wrap(shell.complete_slow),
+                         self.profiler.wrap(shell.complete_slow))
+        self.assertEqual(list(self.profiler.wrap(shell.complete_slow)('al')), ['alpha', 'alpine'])
+
+    def test_wrapper_does_not_keep_shell(self):
+        shell = TestKmd()
+        self.profiler.wrap(shell.complete_slow)
+        ref = weakref.ref(shell)
+        del shell
+        gc.collect()
+        self.assertEqual(ref(), None)
+        self.assertEqual(len(self.profiler.wrappers), 1)
+
+    def test_format(self):
+        self.profiler.record('complete_foo', 0.002, 0.001, 4)
+        lines = self.profiler.format().splitlines()
+        self.assertEqual(lines[0].split(), ['completer', 'calls', 'matches', 'first', 'p50', 'p95', 'p99'])
+        self.assertEqual(lines[1].split(), ['complete_foo', '1', '4.0', '1.000', '2.000', '2.000', '2.000'])
+
+
+class KmdProfilingTests(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        self.cmd = TestKmd()
+        self.cmd.completion_profiler = CompletionProfiler()
+        self.cmd.preloop()
+
+    def tearDown(self):
+        self.cmd.postloop()
+
+    def complete(self, text):
+        completion.line_buffer = text
+        readline.complete_internal(TAB)
+        return completion.line_buffer
+
+    def test_completer(self):
+        self.assertEqual(self.complete('slow alpi'), 'slow alpine ')
+        stat = self.cmd.completion_profiler.get('complete_slow')
+        self.assertEqual(stat.calls, 1)
+        self.assertEqual(stat.matches, 1)
+
+    def test_no_matches(self):
+        self.complete('none a')
+        stat = self.cmd.completion_profiler.get('complete_none')
+        self.assertEqual(stat.calls, 1)
+        self.assertEqual(stat.first_match.count, 0)
+
+    def test_completenames(self):
+        self.complete('he')
+        self.assertTrue('completenames' in self.cmd.completion_profiler)
+
+    def test_cache_hits_not_recorded(self):
+        self.complete('cached a')
+        self.complete('cached alp')
+        self.assertEqual(self.cmd.completion_profiler.get('complete_cached').calls, 1)
+
+    def test_with_timeout(self):
+        self.cmd.completion_timeout = 5
+        self.assertEqual(self.complete('slow alpi'), 'slow alpine ')
+        self.assertEqual(self.cmd.completion_profiler.get('complete_slow').calls, 1)
+
+
+class EnvironmentTests(JailSetup):
+
+    def run_script(self, value):
+        env = dict(os.environ, KMD_PROFILE_COMPLETION=value, PYTHONPATH=PACKAGE_ROOT)
+        process = subprocess.Popen([sys.executable, '-c', PROFILE_SCRIPT], env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        return stderr.decode('ascii')
+
+    def test_off_by_default(self):
+        self.assertEqual(Kmd().completion_profiler, None)
+
+    def test_report(self):
+        output = self.run_script('1')
+        self.assertTrue(output.startswith('completer '), output)
+        self.assertTrue('\ncompletenames ' in output, output)
+
+    def test_export(self):
+        self.run_script('profile.json')
+        with open('profile.json', 'rt') as f:
+            data = json.load(f)
+        self.assertEqual(data['completenames']['calls'], 1)
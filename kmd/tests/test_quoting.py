@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import os
+import random
 import unittest
 
 from rl import completer
@@ -12,14 +14,28 @@ from kmd import Kmd
 
 from kmd.quoting import backslash_dequote
 from kmd.quoting import backslash_quote
+from kmd.quoting import get_quoter
+from kmd.quoting import get_dequoter
+from kmd.quoting import FILENAME_QUOTE_CHARACTERS
+from kmd.quoting import BASH_FILENAME_QUOTE_CHARACTERS
+from kmd.quoting import SLASHIFY_IN_QUOTES
 from kmd.quoting import is_fully_quoted
 from kmd.quoting import char_is_quoted
+from kmd.quoting import char_is_backslash_quoted
+from kmd.quoting import get_scanner
+from kmd.quoting import QuoteScanner
 from kmd.quoting import backslash_dequote_string
 from kmd.quoting import quote_string
 from kmd.quoting import backslash_quote_string
 from kmd.quoting import backslash_dequote_filename
 from kmd.quoting import quote_filename
 from kmd.quoting import backslash_quote_filename
+from kmd.quoting import quote_filenames
+from kmd.quoting import backslash_quote_filenames
+from kmd.quoting import find_directories
+from kmd.quoting import tokenize
+from kmd.quoting import split_words
+from kmd.quoting import find_word
 
 from kmd.testing import JailSetup
 from kmd.testing import reset
@@ -114,6 +130,80 @@ class BackslashQuoteTests(unittest.TestCase):
         self.assertEqual(backslash_quote('€'), '€')
 
 
+def replace_quote(text, chars):
+    # The original implementation of backslash_quote
+    if '\\' in chars:
+        text = text.replace('\\', '\\\\')
+    for c in chars:
+        if c != '\\':
+            text = text.replace(c, '\\'+c)
+    return text
+
+
+def replace_dequote(text, chars):
+    # The original implementation of backslash_dequote
+    if '\\' in chars:
+        text = text.replace('\\\\', '\\')
+    for c in chars:
+        if c != '\\':
+            text = text.replace('\\'+c, c)
+    return text
+
+
+class QuotingEngineTests(unittest.TestCase):
+
+    CHARS = (
+        FILENAME_QUOTE_CHARACTERS,
+        SLASHIFY_IN_QUOTES,
+        '\\',
+        ' ',
+        ']^-',
+        'aa',
+        'a\\a\\',
+        set('ab\\'),
+    )
+
+    def setUp(self):
+        reset()
+        completer.filename_quote_characters = FILENAME_QUOTE_CHARACTERS
+
+    def random_strings(self, count):
+        r = random.Random(42)
+        for i in range(count):
+            yield ''.join(r.choice('ab\\ "\'$`\n]^-*') for j in range(r.randint(0, 12)))
+
+    def test_backslash_quote(self):
+        for text in self.random_strings(3000):
+            for chars in self.CHARS:
+                self.assertEqual(backslash_quote(text, chars), replace_quote(text, chars),
+                                 '%r %r' % (text, chars))
+
+    def test_backslash_dequote(self):
+        for text in self.random_strings(3000):
+            for chars in self.CHARS:
+                self.assertEqual(backslash_dequote(text, chars), replace_dequote(text, chars),
+                                 '%r %r' % (text, chars))
+
+    def test_backslash_dequote_default(self):
+        chars = set(FILENAME_QUOTE_CHARACTERS).union(BASH_FILENAME_QUOTE_CHARACTERS)
+        for text in self.random_strings(3000):
+            self.assertEqual(backslash_dequote(text), replace_dequote(text, chars))
+
+    def test_many_quoted_characters(self):
+        text = replace_quote('a b$c&d ' * 100, FILENAME_QUOTE_CHARACTERS)
+        self.assertEqual(backslash_dequote(text), 'a b$c&d ' * 100)
+
+    def test_empty_chars(self):
+        completer.filename_quote_characters = ''
+        self.assertEqual(backslash_quote('a b'), 'a b')
+
+    def test_functions_are_cached(self):
+        self.assertTrue(get_quoter(' &') is get_quoter(' &'))
+        self.assertTrue(get_quoter(set(' &')) is get_quoter(set('& ')))
+        self.assertTrue(get_dequoter() is get_dequoter())
+        self.assertFalse(get_dequoter() is get_dequoter(FILENAME_QUOTE_CHARACTERS))
+
+
 class FullyQuotedTests(unittest.TestCase):
 
     def setUp(self):
@@ -209,6 +299,207 @@ class CharIsQuotedTests(unittest.TestCase):
             self.assertEqual(char_is_quoted(s, len(s)-1), False, 'not False: %r' % s)
 
 
+def scan_is_quoted(text, index):
+    # The original rescanning implementation of char_is_quoted
+    skip_next = False
+    quote_char = ''
+    for i in range(index):
+        c = text[i]
+        if skip_next:
+            skip_next = False
+        elif quote_char != "'" and c == '\\':
+            skip_next = True
+            if i == index-1:
+                return True
+        elif quote_char != '':
+            if c == quote_char:
+                quote_char = ''
+        elif c in completer.quote_characters:
+            quote_char = c
+    if index < len(text) and text[index] == quote_char:
+        return False
+    return bool(quote_char)
+
+
+def scan_is_backslash_quoted(text, index):
+    # The original rescanning implementation of char_is_backslash_quoted
+    skip_next = False
+    for i in range(index):
+        c = text[i]
+        if skip_next:
+            skip_next = False
+        elif c == '\\':
+            skip_next = True
+            if i == index-1:
+                return True
+    return False
+
+
+class QuoteScannerTests(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        completer.quote_characters = '"\''
+
+    def random_lines(self, count):
+        r = random.Random(42)
+        for i in range(count):
+            yield ''.join(r.choice('ab \\\'"') for j in range(r.randint(0, 20)))
+
+    def test_matches_rescanning(self):
+        for line in self.random_lines(2000):
+            scanner = QuoteScanner(line)
+            for i in range(len(line)+1):
+                self.assertEqual(scanner.is_quoted(i), scan_is_quoted(line, i), '%r %d' % (line, i))
+                self.assertEqual(scanner.is_backslash_quoted(i), scan_is_backslash_quoted(line, i),
+                                 '%r %d' % (line, i))
+
+    def test_extend(self):
+        for line in self.random_lines(200):
+            scanner = QuoteScanner('')
+            for size in range(len(line)+1):
+                scanner.extend(line[:size])
+                for i in range(size+1):
+                    self.assertEqual(scanner.is_quoted(i), scan_is_quoted(line[:size], i))
+
+    def test_copy(self):
+        for line in self.random_lines(200):
+            scanner = QuoteScanner(line)
+            for size in range(len(line)+1):
+                copy = scanner.copy(size)
+                copy.extend(line)
+                self.assertEqual(copy.states, scanner.states)
+                self.assertEqual(copy.escapes, scanner.escapes)
+
+    def test_char_is_quoted_while_typing(self):
+        line = '"foo \\" bar\\ \'baz'
+        for size in list(range(len(line)+1)) + list(range(len(line), -1, -1)):
+            for i in range(size+1):
+                self.assertEqual(char_is_quoted(line[:size], i), scan_is_quoted(line[:size], i))
+                self.assertEqual(char_is_backslash_quoted(line[:size], i),
+                                 scan_is_backslash_quoted(line[:size], i))
+
+    def test_scanner_is_reused(self):
+        scanner = get_scanner('foo "bar')
+        self.assertTrue(get_scanner('foo "bar') is scanner)
+        extended = get_scanner('foo "bar baz')
+        self.assertEqual(extended.states[:9], scanner.states)
+        self.assertEqual(scanner.text, 'foo "bar')
+
+    def test_quote_characters_change(self):
+        self.assertEqual(char_is_quoted('"foo', 2), True)
+        completer.quote_characters = "'"
+        self.assertEqual(char_is_quoted('"foo', 2), False)
+
+    def test_negative_index(self):
+        self.assertEqual(char_is_quoted('"foo', -1), False)
+        self.assertEqual(char_is_backslash_quoted('\\foo', -1), False)
+
+    def test_long_line(self):
+        line = 'cmd ' + '{"a": "b\\\\c", \'x\': 1} ' * 1000
+        for i in range(len(line)):
+            char_is_quoted(line, i)
+        self.assertEqual(char_is_quoted(line, len(line)-3), False)
+
+
+class TokenizeTests(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        completer.quote_characters = '"\''
+        completer.filename_quote_characters = FILENAME_QUOTE_CHARACTERS
+
+    def spans(self, line):
+        return [(x.text, x.start, x.end) for x in tokenize(line)]
+
+    def test_words(self):
+        self.assertEqual(self.spans('  ls -l\tfoo  '), [('ls', 2, 4), ('-l', 5, 7), ('foo', 8, 11)])
+
+    def test_empty(self):
+        self.assertEqual(tokenize(''), ())
+        self.assertEqual(tokenize(' \t\n'), ())
+
+    def test_quoted_whitespace(self):
+        self.assertEqual(self.spans('a "b c" d\\ e \'f g\''), [('a', 0, 1), ('"b c"', 2, 7), ('d\\ e', 8, 12), ("'f g'", 13, 18)])
+
+    def test_values(self):
+        self.assertEqual(split_words('foo\\ bar "a \\"b\\" c" \'x\'\\\'\'y\' \'\\n\''),
+                         ['foo bar', 'a "b" c', "x'y", '\\n'])
+
+    def test_unknown_escapes(self):
+        self.assertEqual(split_words('a\\b "a\\b\\$"'), ['a\\b', 'a\\b$'])
+
+    def test_quote_char(self):
+        words = tokenize('foo "bar" a\'b\'"c" \'x')
+        self.assertEqual([x.quote_char for x in words], ['', '"', "'", "'"])
+        self.assertEqual([x.closed for x in words], [True, True, True, False])
+
+    def test_unclosed(self):
+        words = tokenize('"foo \\" bar\\')
+        self.assertEqual(len(words), 1)
+        self.assertEqual(words[0].value, 'foo " bar\\')
+        self.assertEqual(words[0].closed, False)
+        self.assertEqual(tokenize('foo\\')[0].closed, False)
+
+    def test_quote_characters(self):
+        completer.quote_characters = "'"
+        self.assertEqual(split_words('"a b"'), ['"a', 'b"'])
+        self.assertEqual(split_words('"a b"', '"'), ['a b'])
+
+    def test_cached(self):
+        self.assertTrue(tokenize('foo "bar') is tokenize('foo "bar'))
+        completer.quote_characters = "'"
+        self.assertEqual(len(tokenize('foo "bar')), 2)
+
+    def test_find_word(self):
+        self.assertEqual(find_word('ls "a b" c', 5).text, '"a b"')
+        self.assertEqual(find_word('ls "a b" c', 8).text, '"a b"')
+        self.assertEqual(find_word('ls  c', 3), None)
+
+    def test_matches_scanner(self):
+        r = random.Random(42)
+        for i in range(2000):
+            line = ''.join(r.choice('ab \\\'"') for j in range(r.randint(0, 20)))
+            breaks = [j for j, c in enumerate(line) if c == ' ' and not scan_is_quoted(line, j)]
+            expected = []
+            start = 0
+            for j in breaks + [len(line)]:
+                if j > start:
+                    expected.append((line[start:j], start, j))
+                start = j+1
+            self.assertEqual(self.spans(line), expected, repr(line))
+
+
+class KmdTokenizeTests(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        self.cmd = Kmd()
+        self.cmd.preloop()
+
+    def test_splitargs(self):
+        self.assertEqual(self.cmd.splitargs('a\\ b "c d" \'e\''), ['a b', 'c d', 'e'])
+
+    def test_splitargs_without_preloop(self):
+        reset()
+        self.assertEqual(Kmd().splitargs('a\\ b "c d"'), ['a b', 'c d'])
+
+    def test_parseline(self):
+        self.assertEqual(self.cmd.parseline('  foo-bar "baz"'), ('foo', '-bar "baz"', 'foo-bar "baz"'))
+        self.assertEqual(self.cmd.parseline('"foo"'), ('', '"foo"', '"foo"'))
+        self.assertEqual(self.cmd.parseline('?foo'), ('help', 'foo', 'help foo'))
+
+    def test_word_break_hook(self):
+        completion.line_buffer = '  ?he'
+        self.assertEqual(self.cmd.word_break_hook(2, 5), '?' + completer.word_break_characters)
+        self.assertEqual(self.cmd.word_break_hook(3, 5), None)
+        completion.line_buffer = '  he'
+        self.assertEqual(self.cmd.word_break_hook(2, 4), None)
+
+    def test_rejoin(self):
+        self.assertEqual(self.cmd.rejoin(['foo', 'a b', 'c\\ d']), 'foo a\\ b c\\ d')
+
+
 class DequoteStringTests(FileSetup):
 
     def setUp(self):
@@ -435,6 +726,66 @@ class BackslashQuoteFilenameTests(FileSetup):
         self.assertEqual(self.complete('"fun'), '"funny dir/') # NB: no closing quote on dir
 
 
+class QuoteFilenamesTests(FileSetup):
+
+    def setUp(self):
+        FileSetup.setUp(self)
+        reset()
+        self.cmd = Kmd()
+        self.cmd.preloop()
+        self.mkdir('funny dir', 'many')
+        for i in range(20):
+            self.mkdir(os.path.join('many', 'dir %d' % i))
+            self.mkfile(os.path.join('many', 'file %d' % i))
+        self.names = sorted(os.listdir('.')) + ['many/' + x for x in sorted(os.listdir('many'))]
+        self.names += ['', '.', 'many/', 'many//dir 1', 'missing/file', '~StartsWithTilde.txt']
+
+    def quote_each(self, func, names, single_match, quote_char):
+        quoted = []
+        for name in names:
+            completion.suppress_quote = False
+            quoted.append(func(name, single_match, quote_char))
+        completion.suppress_quote = False
+        return quoted
+
+    def test_quote_filenames(self):
+        for quote_char in ('', '"', "'"):
+            for single_match in (True, False):
+                self.assertEqual(quote_filenames(self.names, single_match, quote_char),
+                    self.quote_each(quote_filename, self.names, single_match, quote_char))
+
+    def test_backslash_quote_filenames(self):
+        for quote_char in ('', '"', "'"):
+            for single_match in (True, False):
+                self.assertEqual(backslash_quote_filenames(self.names, single_match, quote_char),
+                    self.quote_each(backslash_quote_filename, self.names, single_match, quote_char))
+
+    def test_directories_argument(self):
+        quoted = quote_filenames(['a', 'b'], True, '"', directories=set(['b']))
+        self.assertEqual(quoted, ['"a"', '"b'])
+
+    def test_suppress_quote(self):
+        self.assertEqual(quote_filenames(['funny dir', 'Hello World.txt'], True, '"'),
+                         ['"funny dir', '"Hello World.txt"'])
+        self.assertEqual(completion.suppress_quote, False)
+        completion.suppress_quote = True
+        self.assertEqual(quote_filenames(['Hello World.txt'], True, '"'), ['"Hello World.txt'])
+
+    def test_find_directories(self):
+        paths = ['many/dir %d' % i for i in range(20)] + ['many/file 1', 'many/missing', 'funny dir']
+        self.assertEqual(find_directories(paths), set(paths[:20] + ['funny dir']))
+
+    @unittest.skipIf(not hasattr(os, 'symlink'), 'Requires symlinks')
+    def test_find_directories_follows_symlinks(self):
+        os.symlink(os.path.abspath('funny dir'), os.path.join('many', 'link'))
+        paths = ['many/dir %d' % i for i in range(20)] + ['many/link']
+        self.assertEqual(find_directories(paths), set(paths))
+
+    def test_find_directories_missing_parent(self):
+        paths = ['missing/dir %d' % i for i in range(20)]
+        self.assertEqual(find_directories(paths), set())
+
+
 class SetTests(unittest.TestCase):
 
     def test_union(self):
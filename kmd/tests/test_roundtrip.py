@@ -0,0 +1,146 @@
+import os
+import random
+
+from rl import completer
+from rl import completion
+
+from kmd import Kmd
+
+from kmd.quoting import BASH_FILENAME_QUOTE_CHARACTERS
+from kmd.quoting import FILENAME_QUOTE_CHARACTERS
+from kmd.quoting import is_fully_quoted
+from kmd.quoting import quote_string
+from kmd.quoting import backslash_quote_string
+from kmd.quoting import backslash_dequote_string
+from kmd.quoting import quote_filename
+from kmd.quoting import backslash_quote_filename
+from kmd.quoting import backslash_dequote_filename
+from kmd.quoting import tokenize
+from kmd.quoting import split_words
+
+from kmd.bench import FILENAME_ALPHABET
+from kmd.bench import random_filenames
+
+from kmd.testing import JailSetup
+from kmd.testing import reset
+
+#: Names every round-trip test starts with.
+PATHOLOGICAL = [
+    '\\', '\\\\', '"', "'", "''", '""', '\\"', "\\'", "'\\''", '~', '\\~',
+    ' ', '\t', '\n', '  \\ ', '$`\\"\n', 'a\\', "it's", 'say "hi"',
+    '\\' * 50, "'" * 50, '"' * 50, 'x y' * 100, FILENAME_ALPHABET,
+]
+
+
+class RoundTripTests(JailSetup):
+    """Quote random filenames and check that dequoting returns them."""
+
+    count = 2000
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        reset()
+        self.cmd = Kmd()
+        self.cmd.preloop()
+
+    def tearDown(self):
+        self.cmd.postloop()
+        JailSetup.tearDown(self)
+
+    def names(self, alphabet=FILENAME_ALPHABET, seed=42):
+        names = [x for x in PATHOLOGICAL if not set(x) - set(alphabet)]
+        names += random_filenames(self.count, seed, alphabet)
+        return [x for x in names if not os.path.lexists(os.path.expanduser(x))]
+
+    def quote(self, func, name, single_match=True, quote_char=''):
+        completion.suppress_quote = False
+        return func(name, single_match, quote_char)
+
+    def assertWord(self, quoted, name):
+        words = tokenize(quoted)
+        self.assertEqual([x.value for x in words], [name], repr(quoted))
+        self.assertEqual((words[0].start, words[0].end), (0, len(quoted)))
+
+    def check_quote_char(self, func, dequote, quote_char):
+        for name in self.names():
+            quoted = self.quote(func, name, True, quote_char)
+            self.assertEqual(quoted[0], quote_char)
+            self.assertEqual(quoted[-1], quote_char)
+            self.assertEqual(dequote(quoted[1:-1], quote_char), name, repr(quoted))
+            self.assertWord(quoted, name)
+            self.assertTrue(tokenize(quoted)[0].closed)
+
+            quoted = self.quote(func, name, False, quote_char)
+            self.assertEqual(dequote(quoted[1:], quote_char), name, repr(quoted))
+            self.assertWord(quoted, name)
+
+    def check_backslash(self, func, dequote, alphabet=FILENAME_ALPHABET):
+        for name in self.names(alphabet):
+            quoted = self.quote(func, name)
+            self.assertEqual(dequote(quoted), name, repr(quoted))
+            self.assertWord(quoted, name)
+
+    def test_quote_string_double(self):
+        self.check_quote_char(quote_string, backslash_dequote_string, '"')
+
+    def test_quote_string_single(self):
+        self.check_quote_char(quote_string, backslash_dequote_string, "'")
+
+    def test_quote_string_default(self):
+        for name in self.names():
+            self.assertWord(self.quote(quote_string, name), name)
+
+    def test_quote_filename_double(self):
+        self.check_quote_char(quote_filename, backslash_dequote_filename, '"')
+
+    def test_quote_filename_single(self):
+        self.check_quote_char(quote_filename, backslash_dequote_filename, "'")
+
+    def test_quote_filename_default(self):
+        for name in self.names():
+            # Tildes are expanded
+            if not name.startswith('~'):
+                self.assertWord(self.quote(quote_filename, name), name)
+
+    def test_backslash_quote_string(self):
+        # Backslash-dequoting also removes backslashes before characters
+        # missing from filename_quote_characters, like ~
+        self.check_backslash(backslash_quote_string, backslash_dequote_string,
+                             FILENAME_ALPHABET.replace('~', ''))
+
+    def test_backslash_quote_string_bash_characters(self):
+        completer.filename_quote_characters = BASH_FILENAME_QUOTE_CHARACTERS
+        self.check_backslash(backslash_quote_string, backslash_dequote_string)
+
+    def test_backslash_quote_filename(self):
+        completer.filename_quote_characters = BASH_FILENAME_QUOTE_CHARACTERS
+        self.check_backslash(backslash_quote_filename, backslash_dequote_filename)
+
+    def test_backslash_quote_tokenize(self):
+        for name in self.names():
+            self.assertWord(self.quote(backslash_quote_string, name), name)
+
+    def test_quote_character_in_filename(self):
+        for name in self.names('ab "\''):
+            self.assertWord(self.quote(quote_string, name, True, '"'), name)
+            self.assertWord(self.quote(quote_string, name, True, "'"), name)
+
+    def test_rejoin(self):
+        r = random.Random(42)
+        names = [x for x in self.names() if x]
+        for i in range(500):
+            args = r.sample(names, r.randint(1, 8))
+            # Fully quoted arguments are passed through
+            expected = [is_fully_quoted(x, FILENAME_QUOTE_CHARACTERS) and split_words(x)[0] or x
+                        for x in args]
+            self.assertEqual(self.cmd.splitargs(self.cmd.rejoin(args)), expected, repr(args))
+
+    def test_rejoin_plain(self):
+        args = random_filenames(self.count, 42, 'abc .$\'"')
+        args = [x for x in args if x.strip()]
+        self.assertEqual(self.cmd.splitargs(self.cmd.rejoin(args)), args)
+
+    def test_random_filenames(self):
+        self.assertEqual(random_filenames(10), random_filenames(10))
+        self.assertNotEqual(random_filenames(10), random_filenames(10, 43))
+        self.assertEqual(set(''.join(random_filenames(1000, 1, 'ab'))), set('ab'))
@@ -0,0 +1,90 @@
+import sys
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+from kmd.testing import JailSetup
+
+
+class TestKmd(Kmd):
+
+    prompt = 'PROMPT> '
+
+    def preloop(self):
+        Kmd.preloop(self)
+        self.log = ['preloop']
+
+    def postloop(self):
+        Kmd.postloop(self)
+        self.log.append('postloop')
+
+    def precmd(self, line):
+        return line.upper()
+
+    def do_ECHO(self, args):
+        self.stdout.write(args + '\n')
+
+    def do_FAIL(self, args):
+        raise ValueError(args)
+
+    def do_QUIT(self, args):
+        return True
+
+
+class RunScriptTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+
+    def test_stream(self):
+        status = self.shell.runscript(StringIO('echo a\necho b\n'))
+        self.assertEqual(status, 0)
+        self.assertEqual(self.shell.stdout.getvalue(), 'A\nB\n')
+        self.assertEqual(self.shell.log, ['preloop', 'postloop'])
+
+    def test_filename(self):
+        f = open('script', 'wt')
+        f.write('echo a\r\n# comment\necho b')
+        f.close()
+        self.assertEqual(self.shell.runscript('script'), 0)
+        self.assertEqual(self.shell.stdout.getvalue(), 'A\nB\n')
+
+    def test_no_prompt(self):
+        self.shell.runscript(['echo a'])
+        self.assertTrue('PROMPT' not in self.shell.stdout.getvalue())
+
+    def test_report(self):
+        self.shell.runscript(['echo a', 'echo b'])
+        self.assertTrue(self.shell.stderr.getvalue().startswith('2 lines in '))
+        self.assertTrue(self.shell.stderr.getvalue().endswith(' lines/sec)\n'))
+
+    def test_stop(self):
+        self.shell.runscript(['echo a', 'quit', 'echo b'])
+        self.assertEqual(self.shell.stdout.getvalue(), 'A\n')
+
+    def test_continue_on_error(self):
+        status = self.shell.runscript(['echo a', 'fail oops', 'echo b'])
+        self.assertEqual(status, 1)
+        self.assertEqual(self.shell.stdout.getvalue(), 'A\nB\n')
+        self.assertTrue(self.shell.stderr.getvalue().startswith(
+            '*** Error in line 2: ValueError: OOPS\n'))
+
+    def test_stop_on_error(self):
+        status = self.shell.runscript(['echo a', 'fail oops', 'echo b'], stop_on_error=True)
+        self.assertEqual(status, 1)
+        self.assertEqual(self.shell.stdout.getvalue(), 'A\n')
+        self.assertEqual(self.shell.log, ['preloop', 'postloop'])
+
+    def test_restores_use_rawinput(self):
+        self.shell.runscript(['echo a'])
+        self.assertEqual(self.shell.use_rawinput, 1)
+
+    def test_run(self):
+        status = self.shell.run(['ignored'], script=['echo a', 'fail'], stop_on_error=True)
+        self.assertEqual(status, 1)
+        self.assertEqual(self.shell.stdout.getvalue(), 'A\n')
@@ -0,0 +1,279 @@
+import os
+import sys
+import stat
+import socket
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from rl import completer
+from rl import completion
+
+from kmd import Kmd
+from kmd.testing import JailSetup
+from kmd.testing import reset
+from kmd.caching import cacheable
+from kmd.server import KmdServer
+from kmd.server import receive
+from kmd.client import Client
+
+
+class TestKmd(Kmd):
+
+    intro = 'Welcome'
+    calls = []
+
+    def do_echo(self, args):
+        self.stdout.write(args + '\n')
+
+    def do_warn(self, args):
+        self.stderr.write(args + '\n')
+
+    def do_fail(self, args):
+        raise ValueError(args)
+
+    def do_read(self, args):
+        self.stdout.write('got ' + self.stdin.readline())
+
+    def do_quit(self, args):
+        return True
+
+    def do_EOF(self, args):
+        return True
+
+    def complete_ls(self, text, *ignored):
+        return completion.complete_filename(text)
+
+    @cacheable
+    def complete_echo(self, text, *ignored):
+        self.calls.append(text)
+        return [x for x in ('alpha', 'alpine', 'beta') if x.startswith(text)]
+
+
+@unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'Requires Unix domain sockets')
+class ServerTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        TestKmd.calls = []
+        self.server = KmdServer(TestKmd, os.path.join(self.tempdir, 'kmd.sock'))
+        self.server.start(0.01)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.shutdown()
+        JailSetup.tearDown(self)
+
+    def connect(self):
+        client = Client(self.server.address, stdout=StringIO(), stderr=StringIO())
+        self.clients.append(client)
+        return client
+
+    def run_line(self, client, line):
+        client.send({'line': line})
+        return client.receive()
+
+    def test_session(self):
+        client = self.connect()
+        self.assertEqual(client.receive(), {'prompt': '(Kmd) '})
+        self.assertEqual(client.stdout.getvalue(), 'Welcome\n')
+        self.assertEqual(self.run_line(client, 'echo hello'), {'prompt': '(Kmd) '})
+        self.assertEqual(self.run_line(client, 'warn oops'), {'prompt': '(Kmd) '})
+        self.assertEqual(self.run_line(client, 'quit'), {'exit': True})
+        self.assertEqual(client.stdout.getvalue(), 'Welcome\nhello\n')
+        self.assertEqual(client.stderr.getvalue(), 'oops\n')
+
+    def test_eof(self):
+        client = self.connect()
+        client.receive()
+        self.assertEqual(self.run_line(client, None), {'exit': True})
+
+    def test_error(self):
+        client = self.connect()
+        client.receive()
+        self.assertEqual(self.run_line(client, 'fail bad'), {'prompt': '(Kmd) '})
+        self.assertEqual(client.stderr.getvalue(), '*** ValueError: bad\n')
+
+    def test_malformed_message(self):
+        client = self.connect()
+        client.receive()
+        for data in (b'{"line": \n', b'[1, 2]\n'):
+            client.wfile.write(data)
+            client.wfile.flush()
+            self.assertTrue(receive(client.rfile)['error'].startswith('Malformed message: '))
+        self.assertEqual(self.run_line(client, 'echo hello'), {'prompt': '(Kmd) '})
+        self.assertEqual(client.stdout.getvalue(), 'Welcome\nhello\n')
+
+    def test_client_reports_error(self):
+        client = self.connect()
+        client.receive()
+        client.wfile.write(b'oops\n')
+        client.send({'line': 'echo hello'})
+        self.assertEqual(client.receive(), {'prompt': '(Kmd) '})
+        self.assertTrue(client.stderr.getvalue().startswith('*** Malformed message: '))
+
+    def test_socket_mode(self):
+        mode = os.stat(self.server.address).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o600)
+
+    def test_stdin(self):
+        client = self.connect()
+        client.receive()
+        self.assertEqual(self.run_line(client, 'read'), {'readline': True})
+        self.assertEqual(self.run_line(client, 'some input'), {'prompt': '(Kmd) '})
+        self.assertEqual(client.stdout.getvalue(), 'Welcome\ngot some input\n')
+
+    def test_complete(self):
+        client = self.connect()
+        client.receive()
+        client.send({'complete': ['ec', 'ec', 0, 2]})
+        self.assertEqual(client.receive(), {'matches': ['echo']})
+        client.send({'complete': ['al', '  echo al', 7, 9]})
+        self.assertEqual(client.receive(), {'matches': ['alpha', 'alpine']})
+
+    def test_concurrent_sessions(self):
+        a = self.connect()
+        b = self.connect()
+        a.receive()
+        b.receive()
+        self.run_line(a, 'echo from a')
+        self.run_line(b, 'echo from b')
+        self.assertEqual(a.stdout.getvalue(), 'Welcome\nfrom a\n')
+        self.assertEqual(b.stdout.getvalue(), 'Welcome\nfrom b\n')
+
+    def test_shared_completion_cache(self):
+        a = self.connect()
+        b = self.connect()
+        a.receive()
+        b.receive()
+        a.send({'complete': ['a', 'echo a', 5, 6]})
+        a.receive()
+        b.send({'complete': ['alp', 'echo alp', 5, 8]})
+        self.assertEqual(b.receive(), {'matches': ['alpha', 'alpine']})
+        self.assertEqual(TestKmd.calls, ['a'])
+
+    def test_client_goes_away(self):
+        client = self.connect()
+        client.receive()
+        client.close()
+        self.clients.remove(client)
+        client = self.connect()
+        self.assertEqual(client.receive(), {'prompt': '(Kmd) '})
+
+    def test_completer_config(self):
+        client = self.connect()
+        client.receive()
+        self.assertEqual(client.config['shell_escape_chars'], '')
+        self.assertEqual(client.config['quote_characters'], completer.quote_characters or '"\'')
+
+    def test_complete_filenames(self):
+        self.mkfile('abc')
+        client = self.connect()
+        client.receive()
+        client.send({'complete': ['ab', 'ls ab', 3, 5, {'found_quote': 0, 'quote_character': ''}]})
+        self.assertEqual(client.receive(), {'matches': ['abc'], 'filenames': True})
+        client.send({'complete': ['ec', 'ec', 0, 2]})
+        self.assertEqual(client.receive(), {'matches': ['echo']})
+
+    def test_client_complete(self):
+        self.mkfile('abc')
+        client = self.connect()
+        client.receive()
+        completion.line_buffer = 'ls ab'
+        completion.begidx = 3
+        completion.endidx = 5
+        completion.filename_completion_desired = False
+        self.assertEqual(client.complete('ab', 0), 'abc')
+        self.assertEqual(client.complete('ab', 1), None)
+        self.assertEqual(completion.filename_completion_desired, True)
+
+
+@unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'Requires Unix domain sockets')
+class RemoveSocketTests(JailSetup):
+
+    def test_stale_socket_removed(self):
+        path = os.path.join(self.tempdir, 'kmd.sock')
+        KmdServer(TestKmd, path).server.server_close()
+        self.assertTrue(os.path.exists(path))
+        KmdServer(TestKmd, path).close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_file_not_removed(self):
+        self.mkfile('kmd.sock')
+        path = os.path.join(self.tempdir, 'kmd.sock')
+        self.assertRaises(socket.error, KmdServer, TestKmd, path)
+        self.assertTrue(os.path.isfile(path))
+
+    def test_close_keeps_file(self):
+        path = os.path.join(self.tempdir, 'kmd.sock')
+        server = KmdServer(TestKmd, path)
+        os.remove(path)
+        self.mkfile('kmd.sock')
+        server.close()
+        self.assertTrue(os.path.isfile(path))
+
+
+class AddressTests(unittest.TestCase):
+
+    def test_loopback(self):
+        from kmd.server import is_loopback
+        self.assertEqual(is_loopback('127.0.0.1'), True)
+        self.assertEqual(is_loopback('localhost'), True)
+        self.assertEqual(is_loopback('0.0.0.0'), False)
+        self.assertEqual(is_loopback(''), False)
+
+    def test_reject_remote(self):
+        self.assertRaises(ValueError, KmdServer, TestKmd, ('0.0.0.0', 0))
+        self.assertRaises(ValueError, KmdServer, TestKmd, ('', 0))
+
+    def test_tcp(self):
+        server = KmdServer(TestKmd, ('127.0.0.1', 0))
+        server.start(0.01)
+        try:
+            client = Client(server.server_address, stdout=StringIO(), stderr=StringIO())
+            self.assertEqual(client.receive(), {'prompt': '(Kmd) '})
+            client.close()
+        finally:
+            server.shutdown()
+
+
+class ShellKmd(Kmd):
+
+    def do_shell(self, args):
+        pass
+
+
+class ClientHookTests(unittest.TestCase):
+
+    def setUp(self):
+        reset()
+        from kmd.client import Client
+        self.client = Client.__new__(Client)
+        self.client.config = {'quote_characters': '"\'', 'shell_escape_chars': '!'}
+        self.client.configure()
+
+    def tearDown(self):
+        reset()
+
+    def test_hooks_installed(self):
+        self.assertEqual(completer.word_break_hook, self.client.word_break_hook)
+        self.assertEqual(completer.filename_quoting_function, self.client.quote_filename)
+        self.assertEqual(completer.filename_dequoting_function, self.client.dequote_filename)
+
+    def test_word_break_hook(self):
+        completion.line_buffer = '  !ls'
+        self.assertEqual(self.client.word_break_hook(2, 5), '!' + completer.word_break_characters)
+        completion.line_buffer = '  ?he'
+        self.assertEqual(self.client.word_break_hook(2, 5), '?' + completer.word_break_characters)
+        self.client.config['shell_escape_chars'] = ''
+        completion.line_buffer = '!ls'
+        self.assertEqual(self.client.word_break_hook(0, 3), None)
+
+    def test_quoting(self):
+        self.assertEqual(self.client.quote_filename('a b', True, ''), 'a\\ b')
+        self.assertEqual(self.client.dequote_filename('a\\ b', ''), 'a b')
@@ -0,0 +1,131 @@
+import sys
+import json
+import unittest
+
+if sys.version_info[0] >= 3:
+    from io import StringIO
+else:
+    from StringIO import StringIO
+
+from kmd import Kmd
+from kmd.testing import JailSetup
+from kmd.stats import Histogram
+from kmd.stats import CommandStats
+from kmd.stats import Statistics
+
+
+class TestKmd(Statistics, Kmd):
+
+    def do_echo(self, args):
+        self.stdout.write(args + '\n')
+
+    def do_fail(self, args):
+        raise ValueError(args)
+
+
+class HistogramTests(unittest.TestCase):
+
+    def test_empty(self):
+        h = Histogram()
+        self.assertEqual(h.quantile(0.5), None)
+        self.assertEqual(h.mean, None)
+
+    def test_quantiles(self):
+        h = Histogram()
+        for i in range(1, 101):
+            h.add(i / 1000.0)
+        self.assertEqual(h.count, 100)
+        self.assertEqual(h.min, 0.001)
+        self.assertEqual(h.max, 0.1)
+        self.assertAlmostEqual(h.mean, 0.0505)
+        for q, exact in ((0.5, 0.050), (0.95, 0.095), (0.99, 0.099)):
+            value = h.quantile(q)
+            self.assertTrue(abs(value - exact) / exact < 0.1, (q, value))
+
+    def test_clamped_to_range(self):
+        h = Histogram()
+        h.add(0.5)
+        self.assertEqual(h.quantile(0), 0.5)
+        self.assertEqual(h.quantile(1), 0.5)
+
+    def test_tiny_values(self):
+        h = Histogram()
+        h.add(0.0)
+        h.add(1e-9)
+        self.assertEqual(h.buckets, {0: 2})
+
+
+class CommandStatsTests(unittest.TestCase):
+
+    def test_off_by_default(self):
+        shell = Kmd()
+        self.assertEqual(shell.command_stats, None)
+
+    def test_enable(self):
+        shell = Kmd(stdout=StringIO())
+        shell.command_stats = CommandStats()
+        shell.onecmd('help')
+        shell.onecmd('? help')
+        self.assertEqual(shell.command_stats.get('help').calls, 2)
+
+    def test_unknown_not_recorded(self):
+        shell = Kmd(stderr=StringIO())
+        shell.command_stats = CommandStats()
+        shell.onecmd('foo')
+        self.assertEqual(shell.command_stats.as_dict(), {})
+
+
+class StatisticsTests(JailSetup):
+
+    def setUp(self):
+        JailSetup.setUp(self)
+        self.shell = TestKmd(stdout=StringIO(), stderr=StringIO())
+
+    def test_record(self):
+        self.shell.onecmd('echo a')
+        self.shell.onecmd('ec b')
+        stat = self.shell.command_stats.get('echo')
+        self.assertEqual(stat.calls, 2)
+        self.assertEqual(stat.errors, 0)
+        self.assertEqual(stat.wall.count, 2)
+        self.assertEqual(stat.cpu.count, 2)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, self.shell.onecmd, 'fail')
+        stat = self.shell.command_stats.get('fail')
+        self.assertEqual(stat.calls, 1)
+        self.assertEqual(stat.errors, 1)
+
+    def test_dispatch_table(self):
+        self.shell.use_dispatch_table = True
+        self.shell.onecmd('ech a')
+        self.assertTrue('echo' in self.shell.command_stats)
+
+    def test_stats_command(self):
+        self.shell.onecmd('echo a')
+        self.shell.stdout = StringIO()
+        self.shell.onecmd('stats')
+        lines = self.shell.stdout.getvalue().splitlines()
+        self.assertEqual(lines[0].split(), ['command', 'calls', 'errors', 'p50', 'p95', 'p99', 'cpu'])
+        self.assertEqual(lines[1].split()[:3], ['echo', '1', '0'])
+        self.assertEqual(len(lines), 2)
+
+    def test_reset(self):
+        self.shell.onecmd('echo a')
+        self.shell.onecmd('stats reset')
+        self.assertEqual(list(self.shell.command_stats.commands), ['stats'])
+
+    def test_usage(self):
+        self.shell.onecmd('stats foo')
+        self.assertEqual(self.shell.stderr.getvalue(), '*** Usage: stats [reset | export <file>]\n')
+
+    def test_export_in_postloop(self):
+        self.shell.stats_file = 'stats.json'
+        self.shell.onecmd('echo a')
+        self.shell.postloop()
+        with open('stats.json', 'rt') as f:
+            data = json.load(f)
+        self.assertEqual(list(data), ['echo'])
+        self.assertEqual(data['echo']['calls'], 1)
+        self.assertEqual(sorted(data['echo']['wall']),
+            ['count', 'max', 'mean', 'min', 'p50', 'p95', 'p99', 'total'])